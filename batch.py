@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import copy
+import Queue
+import threading
+import collections
+import multiprocessing
+
+# local
+import legacy.popeye
+import model
+import solvercache
+import solvers
+
+OK, TIMEOUT, OVERFLOW, FAILED, CANCELLED = \
+    solvers.OK, solvers.TIMEOUT, solvers.OVERFLOW, solvers.FAILED, solvers.CANCELLED
+
+def defaultWorkers():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def makeInput(entry, sticky_options):
+    board = model.Board()
+    if entry.has_key('algebraic'):
+        board.fromAlgebraic(entry['algebraic'])
+    input = legacy.popeye.create_input(entry, False, copy.deepcopy(sticky_options), \
+        board.toPopeyePiecesClause())
+    if isinstance(input, unicode):
+        input = input.encode('utf8')
+    return input
+
+def solutionFromOutput(output):
+    # stripping popeye header (version) and footer (solving time)
+    lines = output.strip().split("\n")
+    if len(lines) < 2:
+        return ''
+    return ("\n".join(lines[1:-2])).strip()
+
+class Job:
+    def __init__(self, idx, input):
+        self.idx, self.input = idx, input
+        self.key = None
+        self.chunks = []
+
+class Result:
+    def __init__(self, job, status, output, elapsed, cached = False):
+        self.idx, self.key, self.status, self.output, self.elapsed, self.cached = \
+            job.idx, job.key, status, output, elapsed, cached
+
+class BatchSolver:
+    # the jobs go to a solvers.Scheduler (a private one unless given) with batch priority,
+    # so that the solvers started from the views go first; at most workers jobs are submitted
+    # at a time, the scheduler can run other jobs besides
+    def __init__(self, backend, workers, timeout, max_bytes, cache = None, scheduler = None):
+        self.backend, self.timeout, self.max_bytes, self.cache = \
+            backend, timeout, max_bytes, cache
+        self.workers = [workers, defaultWorkers()][workers < 1]
+        if scheduler is None:
+            scheduler = solvers.Scheduler(self.workers)
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.submitted = set()
+        self.finished = Queue.Queue()
+        self.stop_requested = False
+        self.backend.keepWarm(self.workers)
+
+    def stop(self):
+        self.stop_requested = True
+        self.lock.acquire()
+        try:
+            submitted = list(self.submitted)
+        finally:
+            self.lock.release()
+        for job in submitted:
+            self.scheduler.cancel(job)
+        self.close()
+
+    def close(self):
+        # terminates the processes that were started in advance
+        self.backend.close()
+
+    # solvers.Job listener, invoked in the scheduler threads
+    def onOutput(self, job, data):
+        job.tag.chunks.append(data)
+
+    def onError(self, job, data):
+        job.tag.chunks.append(data)
+
+    def onFinished(self, job):
+        self.finished.put(job)
+
+    def run(self, jobs, callback):
+        # callback(result) is invoked in the calling thread, in order of completion
+        pending = collections.deque()
+        for job in jobs:
+            if self.stop_requested:
+                return
+            if not self.cache is None:
+                job.key = solvercache.makeKey(job.input, self.backend.signature())
+                cached = self.cache.get(job.key)
+                if not cached is None:
+                    callback(Result(job, OK, cached['output'], 0.0, True))
+                    continue
+            pending.append(job)
+        in_flight = 0
+        while len(pending) or in_flight > 0:
+            while len(pending) and in_flight < self.workers and not self.stop_requested:
+                job = pending.popleft()
+                job.chunks = []
+                solverJob = solvers.Job(self.backend, job.input, solvers.BATCH, \
+                    self.timeout, self.max_bytes, self)
+                solverJob.tag = job
+                self.lock.acquire()
+                self.submitted.add(solverJob)
+                self.lock.release()
+                self.scheduler.submit(solverJob)
+                in_flight = in_flight + 1
+            if self.stop_requested:
+                while len(pending):
+                    callback(Result(pending.popleft(), CANCELLED, '', 0.0))
+            if in_flight == 0:
+                break
+            try:
+                solverJob = self.finished.get(True, 1.0)
+            except Queue.Empty:
+                continue
+            in_flight = in_flight - 1
+            self.lock.acquire()
+            self.submitted.discard(solverJob)
+            self.lock.release()
+            result = Result(solverJob.tag, solverJob.status, ''.join(solverJob.tag.chunks), solverJob.elapsed)
+            if result.status == OK and not self.cache is None:
+                self.cache.put(result.key, result.output)
+            callback(result)
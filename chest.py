@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 
 # standard
-import os
-import tempfile
 import re
 
 # 3rd party
@@ -10,8 +8,10 @@ from PyQt4 import QtGui, QtCore
 
 # local
 import model
+import console
+import legacy.popeye
+import solvers
 
-CHESTCONF = {"hash": 128, "in": "input.txt", "out": "output.txt"}
 CHESTSTIPULATION = re.compile('^([sh]?)([#=])(\d+)(\.5)?$', re.IGNORECASE)
 
 def isOrthodox(fen):
@@ -36,6 +36,86 @@ def checkOption(pbm, option):
             return opt
     return False
         
+def createInput(e, brd):
+    # returns (chest input, None) or (None, why chest cannot solve it)
+    # TODO #2: translate messages
+    if not CHESTSTIPULATION.match(e['stipulation'].lower()):            
+        return None, 'Stipulation is not suported by Chest'
+    
+    if isOrthodox(brd.toFen()) == False:
+        return None, 'Chest can solve only orthodox problems'
+    
+    if hasFairyElements(e):            
+        return None, "Chest doesn't support fairy conditions"
+    
+    input_str = "LE\nf " + brd.toFen().replace("S", "N").replace("s", "n") + "\n"
+    # input_str += "cws\ncwl\ncbs\ncbl\n" #castling
+    
+    option = checkOption(e, 'NoCastling')
+    if str(brd.board[56]) == 'white rook' and str(brd.board[60]) == 'white king':
+        if option == False or not 'a1' in option: 
+            input_str += 'cwl\n'
+    if str(brd.board[63]) == 'white rook' and str(brd.board[60]) == 'white king':
+        if option == False or not 'h1' in option:
+            input_str += 'cws\n'
+    if str(brd.board[0]) == 'black rook' and str(brd.board[4]) == 'black king':
+        if option == False or not 'a8' in option:
+            input_str += 'cbl\n'
+    if str(brd.board[7]) == 'black rook' and str(brd.board[4]) == 'black king':
+        if option == False or not 'h8' in option:
+            input_str += 'cbs\n'
+        
+    option = checkOption(e, 'EnPassant')
+    
+    if option != False:
+        aux = option.replace('EnPassant ', '')
+        enp = 'e' + aux[0] + ('4' if aux[1] == '3' else '5')
+        input_str += enp + "\n"
+    
+    # stip preparing
+    stip, stipulation, move = e['stipulation'].lower(), {}, 'w'
+    if '#' in stip:
+        stipulation = stip.split('#')
+        if stipulation[0] != '':
+            input_str += "j" + stipulation[0] + "\n"
+    elif '=' in stip:
+        stipulation = stip.split('=')
+        if stipulation[0] != '':
+            input_str += "j" + stipulation[0].upper() + "\n"
+        else:
+            stipulation[0] = 'O'
+    
+    if stipulation[0] == 'h' or stipulation[0] == 'H':
+        if '.' in stipulation[1]:
+            return None, 'Chest cant solve helpmates with halfmoves'
+        else:
+            move = 'b'
+    input_str += "z" + stipulation[1] + move + "\n"
+    return input_str, None
+
+# chest output is translated line by line into popeye notation and parsed as popeye output
+RE_CHEST_MOVE = re.compile('(?P<piece>[KQRBN]?)(?P<dep>[a-h][1-8])(?P<cap>[-x:*])(?P<arr>[a-h][1-8])(=?(?P<promotion>[QRBN]))?')
+RE_CHEST_MOVENO = re.compile('(?P<moveno>[0-9]+)\.\s*(?P<ellipsis>\.\.\.)?\s*')
+RE_CHEST_CASTLING = re.compile('O-O(?P<long>-O)?')
+
+def toPopeyeMove(m):
+    promotion = ''
+    if not m.group('promotion') is None:
+        promotion = '=' + m.group('promotion').replace('N', 'S')
+    return m.group('piece').replace('N', 'S') + m.group('dep') + ['-', '*'][m.group('cap') != '-'] + \
+        m.group('arr') + promotion
+
+def toPopeyeLine(line):
+    line = RE_CHEST_MOVE.sub(toPopeyeMove, line)
+    line = RE_CHEST_CASTLING.sub(lambda m: ['0-0', '0-0-0'][m.group('long') is not None], line)
+    return RE_CHEST_MOVENO.sub(lambda m: m.group('moveno') + ['.', '...'][m.group('ellipsis') is not None], line)
+
+def parseOutput(e, output):
+    # returns the solution tree (legacy.chess.Node), raises legacy.popeye.ParseError, legacy.chess.UnsupportedError
+    # header and footer are as in ChestView.onCompact, lines with '=*=' (any move) are not representable
+    lines = [toPopeyeLine(line) for line in output.split("\n")[8:-3] if not '=*=' in line]
+    return legacy.popeye.parse_output(e, "Chest\n\n" + "\n".join(lines) + "\n\nChest\n")
+
 class ChestView(QtGui.QSplitter):
     
     def __init__(self, Conf, Lang, Mainframe):
@@ -45,7 +125,12 @@ class ChestView(QtGui.QSplitter):
         self.input = InputWidget()
         self.input.setReadOnly(True)
         self.output = OutputWidget(self)
-        self.output.setReadOnly(True)
+        self.raw = console.OutputBuffer(int(self.Conf.value('console-spill-bytes')))
+        self.job = None
+        self.listener = console.JobListener()
+        self.listener.sigOutput.connect(self.onOut)
+        self.listener.sigError.connect(self.onError)
+        self.listener.sigFinished.connect(self.onFinished)
         
         self.btnRun = QtGui.QPushButton('')
         self.btnRun.clicked.connect(self.onRun)
@@ -86,130 +171,40 @@ class ChestView(QtGui.QSplitter):
     def onRun(self):
         self.setActionEnabled(False)
         self.output.clear()
+        self.raw.clear()
         
-        handle, self.temp_filename = tempfile.mkstemp()
-        
-        input = self.input.toPlainText().toAscii()
-        
-        os.write(handle, input)
-        os.close(handle)
-        
-        self.chestProc = QtCore.QProcess()
-        self.chestProc.readyReadStandardOutput.connect(self.onOut)
-        self.chestProc.readyReadStandardError.connect(self.onError)
-        self.chestProc.finished.connect(self.onFinished)
+        input = str(self.input.toPlainText().toAscii())
+        self.job = solvers.Job(solvers.chestBackend(), input, solvers.INTERACTIVE, 0, 0, self.listener)
+        self.Mainframe.solverScheduler.submit(self.job)
+                
+    def onOut(self, job, data):
+        if job is self.job:
+            self.raw.append(data)
+            self.output.appendOutput(data)
         
-        chest_exe = self.Conf.value('chest-executable')[os.name]
-        params = ["-r", "-LS", "-M " + str(CHESTCONF['hash'])]
-        params.append(self.temp_filename)
+    def onError(self, job, data):
+        if job is self.job:
+            self.output.appendError(data)
         
-        self.chestProc.error.connect(self.onFailed)
-        self.chestProc.start(chest_exe, params)
-                
-    def onOut(self):
-        data = self.chestProc.readAllStandardOutput()
-        self.output.insertPlainText(QtCore.QString(data))
-        # TODO #1: add break for big output
-        
-    def onError(self):
-        self.output.setTextColor(QtGui.QColor(255,0,0))
-        self.output.insertPlainText(QtCore.QString(self.chestProc.readAllStandardError()))
-        self.output.setTextColor(QtGui.QColor(0,0,0))
-    
-    def onFailed(self):
-        try:
-            os.unlink(self.temp_filename)
-        except:
-            pass
-        self.setActionEnabled(True)
-        # if not self.stop_requested:
-        # msgBox("failed " + self.chestProc.error)
-        
-    def onFinished(self):
-        try:
-            os.unlink(self.temp_filename)
-        except:
-            pass
-        self.setActionEnabled(True)
+    def onFinished(self, job):
+        if job is self.job:
+            self.job = None
+            self.setActionEnabled(True)
         
     def onStop(self):
-        self.chestProc.kill()
-        try:
-            os.unlink(self.temp_filename)
-        except:
-            pass
-        self.output.insertPlainText(self.Lang.value('MSG_Terminated'))
+        if self.job is None:
+            return
+        self.Mainframe.solverScheduler.cancel(self.job)
+        self.output.appendOutput(self.Lang.value('MSG_Terminated'))
         self.setActionEnabled(True)
 
+    def shutdown(self):
+        self.raw.close()
+
     def onModelChanged(self):
-        e = self.Mainframe.model.cur()
-        brd = self.Mainframe.model.board
-        # TODO #2: translate messages
-        # self.input.setText(self.Mainframe.model.board.toFen() + " " + self.Mainframe.model.cur()['stipulation'])
-        if not CHESTSTIPULATION.match(e['stipulation'].lower()):            
-            self.input.setText('Stipulation is not suported by Chest')
-            self.btnRun.setEnabled(False)
-            return
-        
-        if isOrthodox(brd.toFen()) == False:
-            self.input.setText('Chest can solve only orthodox problems')
-            self.btnRun.setEnabled(False)
-            return
-        
-        if hasFairyElements(e):            
-            self.input.setText("Chest doesn't support fairy conditions")
-            self.btnRun.setEnabled(False)
-            return        
-        
-        self.btnRun.setEnabled(True)
-        input_str = "LE\nf " + brd.toFen().replace("S", "N").replace("s", "n") + "\n"
-        # input_str += "cws\ncwl\ncbs\ncbl\n" #castling
-        
-        option = checkOption(e, 'NoCastling')
-        if str(brd.board[56]) == 'white rook' and str(brd.board[60]) == 'white king':
-            if option == False or not 'a1' in option: 
-                input_str += 'cwl\n'
-        if str(brd.board[63]) == 'white rook' and str(brd.board[60]) == 'white king':
-            if option == False or not 'h1' in option:
-                input_str += 'cws\n'
-        if str(brd.board[0]) == 'black rook' and str(brd.board[4]) == 'black king':
-            if option == False or not 'a8' in option:
-                input_str += 'cbl\n'
-        if str(brd.board[7]) == 'black rook' and str(brd.board[4]) == 'black king':
-            if option == False or not 'h8' in option:
-                input_str += 'cbs\n'
-            
-        option = checkOption(e, 'EnPassant')
-        
-        if option != False:
-            aux = option.replace('EnPassant ', '')
-            enp = 'e' + aux[0] + ('4' if aux[1] == '3' else '5')
-            # print enp
-            input_str += enp + "\n"
-        
-        # stip preparing
-        # better to wrap into a method?
-        stip, stipulation, move = e['stipulation'].lower(), {}, 'w'
-        if '#' in stip:
-            stipulation = stip.split('#')
-            if stipulation[0] != '':
-                input_str += "j" + stipulation[0] + "\n"
-        elif '=' in stip:
-            stipulation = stip.split('=')
-            if stipulation[0] != '':
-                input_str += "j" + stipulation[0].upper() + "\n"
-            else:
-                stipulation[0] = 'O'
-        
-        if stipulation[0] == 'h' or stipulation[0] == 'H':
-            if '.' in stipulation[1]:
-                self.input.setText('Chest cant solve helpmates with halfmoves')
-                return
-            else:
-                move = 'b'
-        input_str += "z" + stipulation[1] + move + "\n"
-        
-        self.input.setText(input_str)
+        input, message = createInput(self.Mainframe.model.cur(), self.Mainframe.model.board)
+        self.btnRun.setEnabled(not input is None)
+        self.input.setText([input, message][input is None])
           
     def checkCurrentEntry(self):
         if model.hasFairyElements(self.Mainframe.model.cur()):
@@ -230,7 +225,7 @@ class ChestView(QtGui.QSplitter):
         self.btnCompact.setText('compact') # (self.Lang.value('CHEST_Stop'))
         
     def onCompact(self):
-        out = str(self.output.toPlainText())
+        out = self.raw.text()
         out = out.replace("=*=", str("~"))
         aux = out.split('\n')[8:-3]
         # print aux
@@ -241,10 +236,10 @@ class ChestView(QtGui.QSplitter):
         self.btnRun.setEnabled(status)
         self.btnStop.setEnabled(not status)
         
-class OutputWidget(QtGui.QTextEdit):
+class OutputWidget(console.OutputConsole):
     def __init__(self,  parentView):
         self.parentView = parentView
-        super(OutputWidget, self).__init__()
+        super(OutputWidget, self).__init__(int(parentView.Conf.value('console-max-lines')))
 
 class InputWidget(QtGui.QTextEdit):
     def __init__(self):
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# 3rd party
+import yaml
+
+class Conf:
+    file = 'conf/main.yaml'
+    dist_file = 'conf/main.dist.yaml'
+    keywords_file = 'conf/keywords.yaml'
+    zoo_file = 'conf/zoos.yaml'
+    
+    def read():
+        f = open(Conf.file, 'r')
+        try:
+            Conf.values = yaml.load(f)
+        finally:
+            f.close()
+
+        # main.yaml is rewritten on exit, so the keys added in later versions
+        # come from the distributed defaults
+        f = open(Conf.dist_file, 'r')
+        try:
+            defaults = yaml.load(f)
+        finally:
+            f.close()
+        for k, v in defaults.iteritems():
+            if not Conf.values.has_key(k):
+                Conf.values[k] = v
+
+        Conf.zoos = []
+        f = open(Conf.zoo_file, 'r')
+        try:
+            for zoo in yaml.load_all(f):
+                Conf.zoos.append(zoo)
+        finally:
+            f.close()
+
+        f = open(Conf.keywords_file, 'r')
+        try:
+            Conf.keywords = yaml.load(f)
+        finally:
+            f.close()
+    read = staticmethod(read)
+
+    def write():
+        f = open(Conf.file, 'w')
+        try:
+            f.write(unicode(yaml.dump(Conf.values, encoding=None, allow_unicode=True)).encode('utf8'))
+        finally:
+            f.close()
+    write = staticmethod(write)
+
+    
+    def value(v):
+        return Conf.values[v]
+    value = staticmethod(value)
+
+class Lang:
+    file = 'conf/lang.yaml'
+    
+    def read():
+        f = open(Lang.file, 'r')
+        try:
+            Lang.values = yaml.load(f)
+        finally:
+            f.close()
+        Lang.current = Conf.value('default-lang')
+    read = staticmethod(read)
+
+    def value(v):
+        return Lang.values[v][Lang.current]
+    value = staticmethod(value)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import os
+import atexit
+import tempfile
+
+# 3rd party
+from PyQt4 import QtGui, QtCore
+
+FLUSH_INTERVAL_MS = 100
+TAIL_BLOCK_SIZE = 1 << 16
+
+class OutputBuffer:
+    # complete output of a solver run: kept in memory while it is small,
+    # moved to a temporary file once it grows over spill_bytes
+    def __init__(self, spill_bytes):
+        self.spill_bytes = spill_bytes
+        self.chunks, self.size = [], 0
+        self.spill, self.spill_filename = None, None
+        atexit.register(self.close) # the spill file does not outlive the application
+
+    def append(self, data):
+        self.size = self.size + len(data)
+        if not self.spill is None:
+            self.spill.write(data)
+            return
+        self.chunks.append(data)
+        if self.spill_bytes > 0 and self.size > self.spill_bytes:
+            handle, self.spill_filename = tempfile.mkstemp()
+            self.spill = os.fdopen(handle, 'w+b')
+            self.spill.write(''.join(self.chunks))
+            self.chunks = []
+
+    def text(self):
+        if self.spill is None:
+            if len(self.chunks) > 1:
+                self.chunks = [''.join(self.chunks)]
+            return ''.join(self.chunks)
+        self.spill.flush()
+        self.spill.seek(0)
+        data = self.spill.read()
+        self.spill.seek(0, os.SEEK_END)
+        return data
+
+    def tail(self, lines):
+        # the last lines of the output, the spill file is read from the end
+        if self.spill is None:
+            data = self.text()
+        else:
+            self.spill.flush()
+            pos, data = self.size, ''
+            while pos > 0 and data.count("\n") <= lines:
+                step = min(TAIL_BLOCK_SIZE, pos)
+                pos = pos - step
+                self.spill.seek(pos)
+                data = self.spill.read(step) + data
+            self.spill.seek(0, os.SEEK_END)
+        return "\n".join(data.split("\n")[-lines:])
+
+    def clear(self):
+        if not self.spill is None:
+            self.spill.close()
+            try:
+                os.unlink(self.spill_filename)
+            except OSError:
+                pass
+        self.chunks, self.size = [], 0
+        self.spill, self.spill_filename = None, None
+
+    def close(self):
+        # the spill file is deleted, the buffer stays usable
+        self.clear()
+
+class OutputConsole(QtGui.QPlainTextEdit):
+    # shows the tail of a solver output: the widget keeps max_lines last lines only
+    # and the chunks that arrive in quick succession are inserted together
+    def __init__(self, max_lines):
+        super(OutputConsole, self).__init__()
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(max_lines)
+        self.pending = []
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(FLUSH_INTERVAL_MS)
+        self.timer.timeout.connect(self.flush)
+
+    def appendOutput(self, data):
+        self.pending.append(QtCore.QString(data))
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def appendError(self, data):
+        self.flush()
+        charFormat = QtGui.QTextCharFormat()
+        charFormat.setForeground(QtGui.QBrush(QtGui.QColor(255, 0, 0)))
+        self.insertAtEnd(QtCore.QString(data), charFormat)
+
+    def flush(self):
+        self.timer.stop()
+        if len(self.pending) == 0:
+            return
+        data = QtCore.QStringList(self.pending).join('')
+        self.pending = []
+        self.insertAtEnd(data, QtGui.QTextCharFormat())
+
+    def insertAtEnd(self, data, charFormat):
+        # follows the output unless the user has scrolled up
+        scrollBar = self.verticalScrollBar()
+        following = scrollBar.value() == scrollBar.maximum()
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(data, charFormat)
+        if following:
+            scrollBar.setValue(scrollBar.maximum())
+
+    def setText(self, text):
+        # inserted the same way as the output, so that max_lines applies
+        self.timer.stop()
+        self.pending = []
+        self.setPlainText(QtCore.QString())
+        self.insertAtEnd(QtCore.QString(text), QtGui.QTextCharFormat())
+
+    def clear(self):
+        self.setText('')
+
+class JobListener(QtCore.QObject):
+    # receives the events of solvers.Job in the solver threads and emits them
+    # as signals, so that the connected slots run in the GUI thread
+    sigOutput = QtCore.pyqtSignal(object, object)
+    sigError = QtCore.pyqtSignal(object, object)
+    sigFinished = QtCore.pyqtSignal(object)
+
+    def onOutput(self, job, data):
+        self.sigOutput.emit(job, data)
+
+    def onError(self, job, data):
+        self.sigError.emit(job, data)
+
+    def onFinished(self, job):
+        self.sigFinished.emit(job)
@@ -2,13 +2,14 @@
 
 # standard
 import os
-import tempfile
+import time
 import copy
 import string
 import re
 import struct
 import ctypes
 import urllib
+import sqlite3
 
 # 3rd party
 import yaml
@@ -20,10 +21,17 @@ import legacy.chess
 import options
 import model
 import pbm
-import pdf
-import xfen2img
 import fancy
 import chest
+import storage
+import olvdb
+import solvercache
+import positionindex
+import patterns
+import batch
+import solvers
+import console
+from config import Conf, Lang
 
 
 class SigWrapper(QtCore.QObject):
@@ -74,6 +82,11 @@ class Mainframe(QtGui.QMainWindow):
         super(Mainframe, self).__init__()
 
         Mainframe.model = model.Model()
+        Mainframe.solverCache = solvercache.SolverCache(Conf.value('solver-cache-dir'), \
+            int(Conf.value('solver-cache-max-bytes')))
+        # all solver runs - from the views and batch - share the limit of running processes
+        Mainframe.solverScheduler = solvers.Scheduler(\
+            [int(Conf.value('solver-max-running')), batch.defaultWorkers()][int(Conf.value('solver-max-running')) < 1])
 
         self.initLayout()
         self.initActions()
@@ -183,6 +196,12 @@ class Mainframe(QtGui.QMainWindow):
         self.deleteEntryAction = QtGui.QAction(QtGui.QIcon('resources/icons/delete.png'), Lang.value('MI_Delete_entry'), self)        
         self.deleteEntryAction.triggered.connect(self.onDeleteEntry)
 
+        self.findPositionsAction = QtGui.QAction(Lang.value('MI_Find_positions'), self)
+        self.findPositionsAction.triggered.connect(self.onFindPositions)
+
+        self.searchPatternAction = QtGui.QAction(Lang.value('MI_Search_pattern'), self)
+        self.searchPatternAction.triggered.connect(self.onSearchPattern)
+
         self.exitAction = QtGui.QAction(QtGui.QIcon('resources/icons/exit.png'), Lang.value('MI_Exit'), self)        
         self.exitAction.setShortcut('Ctrl+Q')
         self.exitAction.triggered.connect(self.close)
@@ -193,6 +212,9 @@ class Mainframe(QtGui.QMainWindow):
         self.startPopeyeAction.triggered.connect(self.popeyeView.startPopeye)
         self.stopPopeyeAction = QtGui.QAction(QtGui.QIcon('resources/icons/stop.png'), Lang.value('MI_Stop_Popeye'), self)        
         self.stopPopeyeAction.triggered.connect(self.popeyeView.stopPopeye)
+        self.raceAction = QtGui.QAction(Lang.value('MI_Run_fastest'), self)
+        self.raceAction.setShortcut('Shift+F7')
+        self.raceAction.triggered.connect(self.popeyeView.startFastest)
         self.listLegalBlackMoves = QtGui.QAction(QtGui.QIcon('resources/icons/anyblack.png'), Lang.value('MI_Legal_black_moves'), self)        
         self.listLegalBlackMoves.triggered.connect(self.popeyeView.makeListLegal('black'))
         self.listLegalWhiteMoves = QtGui.QAction(QtGui.QIcon('resources/icons/anywhite.png'), Lang.value('MI_Legal_white_moves'), self)        
@@ -201,9 +223,13 @@ class Mainframe(QtGui.QMainWindow):
         self.optionsAction.triggered.connect(self.popeyeView.onOptions)
         self.twinsAction = QtGui.QAction(QtGui.QIcon('resources/icons/gemini.png'), Lang.value('MI_Twins'), self)        
         self.twinsAction.triggered.connect(self.popeyeView.onTwins)
+        self.solveAllAction = QtGui.QAction(Lang.value('MI_Solve_all'), self)
+        self.solveAllAction.triggered.connect(self.onSolveAll)
+        self.solveSelectionAction = QtGui.QAction(Lang.value('MI_Solve_selection'), self)
+        self.solveSelectionAction.triggered.connect(self.onSolveSelection)
 
         self.popeyeView.setActions({'start':self.startPopeyeAction, 'stop':self.stopPopeyeAction,\
-            'legalb':self.listLegalBlackMoves, 'legalw':self.listLegalWhiteMoves,
+            'race':self.raceAction, 'legalb':self.listLegalBlackMoves, 'legalw':self.listLegalWhiteMoves,
             'options':self.optionsAction, 'twins':self.twinsAction})
         
         langs = Conf.value('languages')    
@@ -239,12 +265,18 @@ class Mainframe(QtGui.QMainWindow):
         self.editMenu = menubar.addMenu(Lang.value('MI_Edit'))
         map(self.editMenu.addAction, [self.addEntryAction, self.deleteEntryAction])
         self.editMenu.addSeparator()
+        map(self.editMenu.addAction, [self.findPositionsAction, self.searchPatternAction])
+        self.editMenu.addSeparator()
 
         # Popeye menu
         self.popeyeMenu = menubar.addMenu(Lang.value('MI_Popeye'))
         map(self.popeyeMenu.addAction, [self.startPopeyeAction, self.stopPopeyeAction,\
             self.listLegalBlackMoves, self.listLegalWhiteMoves,
             self.optionsAction, self.twinsAction])
+        self.popeyeMenu.addSeparator()
+        self.popeyeMenu.addAction(self.raceAction)
+        self.popeyeMenu.addSeparator()
+        map(self.popeyeMenu.addAction, [self.solveAllAction, self.solveSelectionAction])
         
         # help menu
         menubar.addSeparator()
@@ -338,12 +370,17 @@ class Mainframe(QtGui.QMainWindow):
         self.saveTemplateAction.setText(Lang.value('MI_Save_template'))
         self.addEntryAction.setText(Lang.value('MI_Add_entry'))
         self.deleteEntryAction.setText(Lang.value('MI_Delete_entry'))
+        self.findPositionsAction.setText(Lang.value('MI_Find_positions'))
+        self.searchPatternAction.setText(Lang.value('MI_Search_pattern'))
         self.startPopeyeAction.setText(Lang.value('MI_Run_Popeye'))
         self.stopPopeyeAction.setText(Lang.value('MI_Stop_Popeye'))
+        self.raceAction.setText(Lang.value('MI_Run_fastest'))
         self.listLegalWhiteMoves.setText(Lang.value('MI_Legal_white_moves'))
         self.listLegalBlackMoves.setText(Lang.value('MI_Legal_black_moves'))
         self.optionsAction.setText(Lang.value('MI_Options'))
         self.twinsAction.setText(Lang.value('MI_Twins'))
+        self.solveAllAction.setText(Lang.value('MI_Solve_all'))
+        self.solveSelectionAction.setText(Lang.value('MI_Solve_selection'))
         self.aboutAction.setText(Lang.value('MI_About'))
         self.importPbmAction.setText(Lang.value('MI_Import_PBM'))
         self.importCcvAction.setText(Lang.value('MI_Import_CCV'))
@@ -370,6 +407,7 @@ class Mainframe(QtGui.QMainWindow):
     def onNewFile(self):
         if not self.doDirtyCheck():
             return
+        self.saveIndex()
         Mainframe.model = model.Model()
         self.overview.rebuild()
         Mainframe.sigWrapper.sigModelChanged.emit()
@@ -380,46 +418,49 @@ class Mainframe(QtGui.QMainWindow):
         default_dir = './collections/'
         if Mainframe.model.filename != '':
             default_dir, tail = os.path.split(Mainframe.model.filename)
-        fileName = QtGui.QFileDialog.getOpenFileName(self, Lang.value('MI_Open'), default_dir, "(*.olv)")
+        fileName = QtGui.QFileDialog.getOpenFileName(self, Lang.value('MI_Open'), default_dir, "(*.olv *.olvdb)")
         if not fileName:
             return
         self.openCollection(fileName)
 
     def openCollection(self,  fileName):
+        self.saveIndex()
         try:
-            f = open(unicode(fileName), 'r')
             Mainframe.model = model.Model()
-            Mainframe.model.delete(0)
-            for data in yaml.load_all(f):
-                Mainframe.model.add(model.makeSafe(data), False)
-            f.close()
-            Mainframe.model.is_dirty = False
+            Mainframe.model.load(storage.openCollection(unicode(fileName)))
         except IOError:
             msgBox(Lang.value('MSG_IO_failed'))
             Mainframe.model = model.Model()
-        except yaml.YAMLError, e:
-            msgBox(Lang.value('MSG_YAML_failed') % e)
-            Mainframe.model = model.Model()
         else:
+            # the entries are parsed on first access, the broken ones are reported then
+            reportParseErrors()
             if len(Mainframe.model.entries) == 0:
                 Mainframe.model = model.Model()
             Mainframe.model.filename = unicode(fileName)
         finally:
             self.overview.rebuild()
+            self.saveIndex() # now with the overview summaries
             Mainframe.sigWrapper.sigModelChanged.emit()
+
+    def saveIndex(self):
+        # the overview summaries and the entries parsed so far, for the next time the file is opened
+        if isinstance(Mainframe.model.entries, storage.LazyEntries):
+            Mainframe.model.entries.saveIndex()
         
     def onSaveFile(self):
         if Mainframe.model.filename != '':
-            f = open(Mainframe.model.filename, 'w')
             try:
-                for i in xrange(len(Mainframe.model.entries)):
-                    f.write("---\n")
-                    f.write(unicode(yaml.dump(Mainframe.model.entries[i], encoding=None, allow_unicode=True)).encode('utf8'))
-                    Mainframe.model.dirty_flags[i] = False
+                Mainframe.model.entries = storage.saveCollection(Mainframe.model.filename, \
+                    Mainframe.model.entries, Mainframe.model.dirty_flags)
+                Mainframe.model.dirty_flags = [False] * len(Mainframe.model.entries)
                 Mainframe.model.is_dirty = False
                 self.overview.removeDirtyMarks()
+            except (IOError, OSError, sqlite3.Error):
+                msgBox(Lang.value('MSG_IO_failed'))
+            except yaml.YAMLError, e:
+                # saving to .olvdb parses the entries that were not loaded yet
+                msgBox(Lang.value('MSG_YAML_failed') % e)
             finally:
-                f.close()
                 Mainframe.sigWrapper.sigModelChanged.emit()
         else:
             self.onSaveFileAs()
@@ -428,7 +469,7 @@ class Mainframe(QtGui.QMainWindow):
         default_dir = './collections/'
         if Mainframe.model.filename != '':
             default_dir, tail = os.path.split(Mainframe.model.filename)
-        fileName = QtGui.QFileDialog.getSaveFileName(self, Lang.value('MI_Save_as'), default_dir, "(*.olv)")
+        fileName = QtGui.QFileDialog.getSaveFileName(self, Lang.value('MI_Save_as'), default_dir, "(*.olv *.olvdb)")
         if not fileName:
             return
         Mainframe.model.filename = unicode(fileName)
@@ -541,6 +582,7 @@ class Mainframe(QtGui.QMainWindow):
         if not fileName:
             return
         try:
+            import pdf # reportlab is loaded on the first export only
             ed = pdf.ExportDocument(Mainframe.model.entries, Lang)
             ed.doExport(unicode(fileName))
         except IOError:
@@ -553,6 +595,7 @@ class Mainframe(QtGui.QMainWindow):
         if not fileName:
             return
         try:
+            import xfen2img # as well as PIL
             xfen2img.convert(Mainframe.model.board.toFen(), unicode(fileName))
         except IOError:
             msgBox(Lang.value('MSG_IO_failed'))
@@ -561,24 +604,73 @@ class Mainframe(QtGui.QMainWindow):
         
     def onAddEntry(self):
         idx = Mainframe.model.current + 1
-        Mainframe.model.insert(copy.deepcopy(Mainframe.model.defaultEntry), True, idx)
-        self.overview.insertItem(idx)
+        self.overview.insertItem(idx, copy.deepcopy(Mainframe.model.defaultEntry), True)
         
+    def onSolveAll(self):
+        self.solveBatch(range(len(Mainframe.model.entries)), Lang.value('MI_Solve_all'))
+
+    def onSolveSelection(self):
+        selection = sorted([x.row() for x in self.overview.selectionModel().selectedRows()])
+        if len(selection) == 0:
+            selection = [Mainframe.model.current]
+        self.solveBatch(selection, Lang.value('MI_Solve_selection'))
+
+    def solveBatch(self, indices, title):
+        dialog = BatchSolveDialog(indices, title)
+        dialog.exec_()
+        if dialog.solved > 0:
+            self.overview.overviewModel.refreshRows(0, len(Mainframe.model.entries) - 1, 0, 0)
+            Mainframe.sigWrapper.sigModelChanged.emit()
+
     def onDeleteEntry(self):
         dialog = YesNoDialog(Lang.value('MSG_Confirm_delete_entry'))
         if not dialog.exec_():
             return
         self.overview.skip_current_item_changed = True
         idx = Mainframe.model.current
-        Mainframe.model.delete(idx)
         self.overview.deleteItem(idx)
         self.overview.skip_current_item_changed = False
+        reportParseErrors()
         if len(Mainframe.model.entries) == 0:
-            Mainframe.model.insert(copy.deepcopy(Mainframe.model.defaultEntry), True, 0)
-            self.overview.insertItem(idx)
+            self.overview.insertItem(0, copy.deepcopy(Mainframe.model.defaultEntry), True)
         else:
-            self.overview.setCurrentItem(self.overview.topLevelItem(Mainframe.model.current))
+            self.overview.setCurrentRow(Mainframe.model.current)
         Mainframe.sigWrapper.sigModelChanged.emit()
+    def onFindPositions(self):
+        # the chosen collections are indexed on first use, see positionindex.PositionIndex
+        default_dir = './collections/'
+        if Mainframe.model.filename != '':
+            default_dir, tail = os.path.split(Mainframe.model.filename)
+        fileNames = QtGui.QFileDialog.getOpenFileNames(self, Lang.value('MI_Find_positions'), default_dir, "(*.olv *.olvdb)")
+        if len(fileNames) == 0:
+            return
+        lines = []
+        try:
+            for fileName, idx, kind in positionindex.findPositions(Mainframe.model.cur(), \
+                [unicode(fileName) for fileName in fileNames]):
+                if fileName == Mainframe.model.filename and idx == Mainframe.model.current and \
+                    not Mainframe.model.is_dirty:
+                    continue # the entry itself
+                entries = storage.openCollection(fileName)
+                try:
+                    summary = entries.summary(idx)
+                finally:
+                    entries.close()
+                lines.append(u'%s #%d: %s (%s)' % (os.path.basename(fileName), idx + 1, \
+                    u', '.join([summary[key] for key in ['authors', 'source', 'date'] if summary[key] != '']), \
+                    Lang.value(['MSG_Symmetric', 'MSG_Identical'][kind == positionindex.IDENTICAL])))
+        except IOError:
+            msgBox(Lang.value('MSG_IO_failed'))
+            return
+        if len(lines) == 0:
+            msgBox(Lang.value('MSG_No_positions_found'))
+        else:
+            msgBox(Lang.value('MSG_Positions_found') + u'\n\n' + u'\n'.join(lines))
+
+    def onSearchPattern(self):
+        dialog = PatternSearchDialog(self.overview)
+        dialog.exec_()
+
     def onFocusOnPieces(self):
         self.tabBar1.setCurrentWidget(self.chessBox)
     def onFocusOnStipulation(self):
@@ -635,7 +727,11 @@ class Mainframe(QtGui.QMainWindow):
         settings.setValue("overviewColumnWidths", self.overview.getColumnWidths());
 
         self.chessBox.sync()
+        self.saveIndex()
         Conf.write()
+        Mainframe.solverScheduler.shutdown()
+        self.popeyeView.shutdown()
+        self.chestView.shutdown()
         event.accept()            
 
 class ClickableLabel(QtGui.QLabel):
@@ -769,6 +865,239 @@ class YesNoCancelDialog(QtGui.QDialog):
         self.reject()
         
         
+class BatchSolveDialog(QtGui.QDialog):
+
+    class Worker(QtCore.QThread):
+        sigResult = QtCore.pyqtSignal(object)
+        def __init__(self, solver, jobs):
+            QtCore.QThread.__init__(self)
+            self.solver, self.jobs = solver, jobs
+        def run(self):
+            # results are delivered to the GUI thread via queued signal
+            self.solver.run(self.jobs, self.sigResult.emit)
+
+    def __init__(self, indices, title):
+        super(BatchSolveDialog, self).__init__()
+        self.setWindowTitle(title)
+        self.indices = indices
+        self.solver, self.worker = None, None
+        self.total, self.done, self.solved, self.failed = 0, 0, 0, 0
+        
+        vbox = QtGui.QVBoxLayout()
+        self.overwrite = QtGui.QCheckBox(Lang.value('BS_Overwrite'))
+        vbox.addWidget(self.overwrite)
+        self.progress = QtGui.QProgressBar()
+        vbox.addWidget(self.progress)
+        self.labelStatus = QtGui.QLabel('')
+        vbox.addWidget(self.labelStatus)
+        vbox.addStretch(1)
+        
+        hbox = QtGui.QHBoxLayout()
+        hbox.addStretch(1)
+        self.buttonStart = QtGui.QPushButton(Lang.value('MI_Run_Popeye'), self)
+        self.buttonStart.clicked.connect(self.onStart)
+        self.buttonStop = QtGui.QPushButton(Lang.value('MI_Stop_Popeye'), self)
+        self.buttonStop.clicked.connect(self.onStop)
+        self.buttonStop.setEnabled(False)
+        self.buttonClose = QtGui.QPushButton(Lang.value('BS_Close'), self)
+        self.buttonClose.clicked.connect(self.reject)
+        
+        hbox.addWidget(self.buttonStart)
+        hbox.addWidget(self.buttonStop)
+        hbox.addWidget(self.buttonClose)
+        vbox.addLayout(hbox)
+        self.setLayout(vbox)
+        self.setMinimumWidth(400)
+
+    def onStart(self):
+        jobs, sticky_options = [], Conf.value('popeye-sticky-options')
+        self.total, self.done, self.solved, self.failed = 0, 0, 0, 0
+        entries = Mainframe.model.entries
+        for idx in self.indices:
+            # the entries that were not loaded yet are not kept parsed
+            try:
+                if hasattr(entries, 'isParsed') and not entries.isParsed(idx):
+                    entry = entries.parse(idx)
+                else:
+                    entry = entries[idx]
+            except yaml.YAMLError:
+                self.failed = self.failed + 1
+                continue
+            if entry.has_key('solution') and unicode(entry['solution']).strip() != '' and \
+                not self.overwrite.isChecked():
+                continue
+            try:
+                jobs.append(batch.Job(idx, batch.makeInput(entry, sticky_options)))
+            except:
+                self.failed = self.failed + 1
+        self.total = len(jobs) + self.failed
+        self.done = self.failed
+        self.progress.setRange(0, max(1, self.total))
+        self.started = time.time()
+        self.updateStatus()
+        if len(jobs) == 0:
+            return
+
+        self.solver = batch.BatchSolver(solvers.popeyeBackend(), \
+            int(Conf.value('batch-workers')), float(Conf.value('batch-timeout')), \
+            int(Conf.value('popeye-stop-max-bytes')), Mainframe.solverCache, Mainframe.solverScheduler)
+        self.worker = BatchSolveDialog.Worker(self.solver, jobs)
+        self.worker.sigResult.connect(self.onResult)
+        self.worker.finished.connect(self.onFinished)
+        self.buttonStart.setEnabled(False)
+        self.overwrite.setEnabled(False)
+        self.buttonStop.setEnabled(True)
+        self.worker.start()
+
+    def onStop(self):
+        if not self.solver is None:
+            self.solver.stop()
+
+    def onResult(self, result):
+        self.done = self.done + 1
+        if result.status == batch.OK:
+            Mainframe.model.entries[result.idx]['solution'] = batch.solutionFromOutput(result.output)
+            Mainframe.model.dirty_flags[result.idx] = True
+            Mainframe.model.is_dirty = True
+            self.solved = self.solved + 1
+        elif result.status != batch.CANCELLED:
+            self.failed = self.failed + 1
+        self.updateStatus()
+
+    def onFinished(self):
+        self.solver.close()
+        self.buttonStart.setEnabled(True)
+        self.overwrite.setEnabled(True)
+        self.buttonStop.setEnabled(False)
+        self.updateStatus()
+
+    def updateStatus(self):
+        self.progress.setValue(self.done)
+        elapsed = max(time.time() - self.started, 0.001)
+        rate = self.done / elapsed # problems per second
+        eta = '--:--'
+        if rate > 0:
+            remaining = int((self.total - self.done) / rate)
+            eta = "%d:%02d" % (remaining // 60, remaining % 60)
+        self.labelStatus.setText(Lang.value('BS_Status') % \
+            (self.done, self.total, self.solved, self.failed, rate * 60, eta))
+
+    def reject(self):
+        if not self.worker is None and self.worker.isRunning():
+            self.solver.stop()
+            self.worker.wait()
+        QtGui.QDialog.reject(self)
+
+class PatternSearchDialog(QtGui.QDialog):
+    # the pattern is the current board, see patterns.Pattern; the matching entries
+    # are selected in the overview as they are found
+    CHUNK = 500 # entries per timer tick
+
+    def __init__(self, overview):
+        super(PatternSearchDialog, self).__init__()
+        self.setWindowTitle(Lang.value('MI_Search_pattern'))
+        self.overview = overview
+        self.pattern, self.pending, self.found = None, [], 0
+        self.matches = None # with numpy, the result for all the entries at once
+
+        vbox = QtGui.QVBoxLayout()
+        hint = QtGui.QLabel(Lang.value('PS_Hint'))
+        hint.setWordWrap(True)
+        vbox.addWidget(hint)
+        self.anywhere = QtGui.QCheckBox(Lang.value('PS_Anywhere'))
+        vbox.addWidget(self.anywhere)
+        self.symmetric = QtGui.QCheckBox(Lang.value('PS_Symmetric'))
+        vbox.addWidget(self.symmetric)
+        form = QtGui.QFormLayout()
+        hbox = QtGui.QHBoxLayout()
+        self.minPieces, self.maxPieces = QtGui.QSpinBox(), QtGui.QSpinBox()
+        for spin, value in [(self.minPieces, 0), (self.maxPieces, 64)]:
+            spin.setRange(0, 64)
+            spin.setValue(value)
+            hbox.addWidget(spin)
+        hbox.addStretch(1)
+        form.addRow(Lang.value('PS_Pieces'), hbox)
+        self.minFairy = QtGui.QSpinBox()
+        self.minFairy.setRange(0, 64)
+        form.addRow(Lang.value('PS_Min_fairy_pieces'), self.minFairy)
+        vbox.addLayout(form)
+        self.progress = QtGui.QProgressBar()
+        vbox.addWidget(self.progress)
+        self.labelStatus = QtGui.QLabel('')
+        vbox.addWidget(self.labelStatus)
+        vbox.addStretch(1)
+
+        hbox = QtGui.QHBoxLayout()
+        hbox.addStretch(1)
+        self.buttonStart = QtGui.QPushButton(Lang.value('PS_Search'), self)
+        self.buttonStart.clicked.connect(self.onStart)
+        self.buttonStop = QtGui.QPushButton(Lang.value('MI_Stop_Popeye'), self)
+        self.buttonStop.clicked.connect(self.onStop)
+        self.buttonStop.setEnabled(False)
+        self.buttonClose = QtGui.QPushButton(Lang.value('BS_Close'), self)
+        self.buttonClose.clicked.connect(self.reject)
+        hbox.addWidget(self.buttonStart)
+        hbox.addWidget(self.buttonStop)
+        hbox.addWidget(self.buttonClose)
+        vbox.addLayout(hbox)
+        self.setLayout(vbox)
+        self.setMinimumWidth(400)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.onTimer)
+
+    def onStart(self):
+        self.pattern = patterns.Pattern(copy.deepcopy(Mainframe.model.board), \
+            self.anywhere.isChecked(), self.symmetric.isChecked(), \
+            self.minPieces.value(), self.maxPieces.value(), self.minFairy.value())
+        # the current entry holds the pattern
+        self.pending = [i for i in xrange(len(Mainframe.model.entries)) if i != Mainframe.model.current]
+        self.pending.reverse()
+        self.matches = None
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            tensor = Mainframe.model.positions() # built once, then kept up to date by the model
+            if not tensor is None:
+                self.matches = tensor.search(self.pattern)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        self.found = 0
+        self.progress.setRange(0, max(1, len(self.pending)))
+        self.progress.setValue(0)
+        self.overview.selectionModel().clearSelection()
+        self.buttonStart.setEnabled(False)
+        self.buttonStop.setEnabled(True)
+        self.timer.start(0)
+
+    def onTimer(self):
+        chunk = [self.pending.pop() for i in xrange(min(PatternSearchDialog.CHUNK, len(self.pending)))]
+        if self.matches is None:
+            found = patterns.search(self.pattern, Mainframe.model.occupancy, chunk)
+        else:
+            found = [idx for idx in chunk if self.matches[idx]]
+        for idx in found:
+            index = self.overview.overviewModel.index(idx, 0)
+            self.overview.selectionModel().select(index, \
+                QtGui.QItemSelectionModel.Select | QtGui.QItemSelectionModel.Rows)
+            if self.found == 0:
+                self.overview.scrollTo(index)
+            self.found = self.found + 1
+        self.progress.setValue(self.progress.maximum() - len(self.pending))
+        self.labelStatus.setText(Lang.value('PS_Status') % \
+            (self.found, self.progress.maximum() - len(self.pending), self.progress.maximum()))
+        if len(self.pending) == 0:
+            self.onStop()
+
+    def onStop(self):
+        self.timer.stop()
+        self.pending = []
+        self.buttonStart.setEnabled(True)
+        self.buttonStop.setEnabled(False)
+
+    def reject(self):
+        self.timer.stop()
+        QtGui.QDialog.reject(self)
+
 class FenView(QtGui.QLineEdit):
     def __init__(self, mainframe):
         super(FenView, self).__init__()
@@ -797,17 +1126,94 @@ class FenView(QtGui.QLineEdit):
         Mainframe.sigWrapper.sigModelChanged.emit()
         self.skip_model_changed = False
         
-class OverviewList(QtGui.QTreeWidget):
+class OverviewModel(QtCore.QAbstractTableModel):
+    # rows are computed on demand straight from Mainframe.model, nothing is copied into widgets
+
+    def __init__(self):
+        super(OverviewModel, self).__init__()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(Mainframe.model.entries)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(OverviewModel.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return QtCore.QVariant()
+        if index.row() >= len(Mainframe.model.entries):
+            return QtCore.QVariant()
+        return QtCore.QVariant(self.cell(index.row(), index.column()))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or orientation != QtCore.Qt.Horizontal:
+            return QtCore.QVariant()
+        if OverviewModel.columns[section] == '':
+            return QtCore.QVariant('')
+        return QtCore.QVariant(Lang.value(OverviewModel.columns[section]))
+
+    def cell(self, idx, column):
+        if column == 0:
+            return str(idx+1)+['', '*'][Mainframe.model.dirty_flags[idx]]
+        summary = Mainframe.model.summary(idx)
+        if column == 4:
+            return summary.distinctionInLang(Lang)
+        if column == 6:
+            return Mainframe.model.pieces_counts[idx]
+        return getattr(summary, OverviewModel.keys[column])
+
+    # Mainframe.model is changed between the begin and end notifications, as Qt expects
+
+    def insertEntry(self, idx, data, dirty):
+        self.beginInsertRows(QtCore.QModelIndex(), idx, idx)
+        Mainframe.model.insert(data, dirty, idx)
+        self.endInsertRows()
+
+    def deleteEntry(self, idx):
+        self.beginRemoveRows(QtCore.QModelIndex(), idx, idx)
+        Mainframe.model.delete(idx)
+        self.endRemoveRows()
+
+    def replaceEmptyModel(self, newModel):
+        # an emptied collection is replaced by a new one with a single entry
+        self.beginInsertRows(QtCore.QModelIndex(), 0, len(newModel.entries) - 1)
+        Mainframe.model = newModel
+        self.endInsertRows()
+
+    def refreshRows(self, first, last, first_column=0, last_column=-1):
+        if last < first:
+            return
+        if last_column == -1:
+            last_column = len(OverviewModel.columns) - 1
+        self.dataChanged.emit(self.index(first, first_column), self.index(last, last_column))
+
+    def refreshHeader(self):
+        self.headerDataChanged.emit(QtCore.Qt.Horizontal, 0, len(OverviewModel.columns) - 1)
+
+OverviewModel.columns = ['', 'EP_Authors', 'EP_Source', 'EP_Date', 'EP_Distinction', \
+    'EP_Stipulation', 'EP_Pieces_count']
+OverviewModel.keys = ['', 'authors', 'source', 'date', 'distinction', 'stipulation', '']
+
+class OverviewList(QtGui.QTreeView):
 
     def __init__(self):
         super(OverviewList, self).__init__()
         self.setAlternatingRowColors(True)
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True) # lets the view skip measuring every row
         
         self.clipboard = QtGui.QApplication.clipboard()
         
+        self.overviewModel = OverviewModel()
+        self.setModel(self.overviewModel)
+        
         Mainframe.sigWrapper.sigLangChanged.connect(self.onLangChanged)
         Mainframe.sigWrapper.sigModelChanged.connect(self.onModelChanged)
-        self.currentItemChanged.connect(self.onCurrentItemChanged)
+        self.selectionModel().currentRowChanged.connect(self.onCurrentRowChanged)
         
         #self.setSelectionMode(QtGui.QAbstractItemView.MultiSelection)
         self.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
@@ -819,7 +1225,7 @@ class OverviewList(QtGui.QTreeWidget):
         
     def mousePressEvent(self, e):
         if e.buttons() != QtCore.Qt.RightButton:
-            return QtGui.QTreeWidget.mousePressEvent(self, e)
+            return QtGui.QTreeView.mousePressEvent(self, e)
         
         hasSelection = len(self.selectionModel().selectedRows()) > 0
         
@@ -849,13 +1255,11 @@ class OverviewList(QtGui.QTreeWidget):
         menu.exec_(e.globalPos())
 
     def getSelectionAsYaml(self):
-        text = u''
+        # the entries that were not modified are copied as stored, without parsing them
+        text = ''
         for idx in sorted([x.row() for x in self.selectionModel().selectedRows()]):
-            text = text + "---\n"
-            text = text + yaml.dump(\
-                    Mainframe.model.entries[idx], encoding=None, allow_unicode=True
-                    )
-        return text
+            text = text + olvdb.documentText(Mainframe.model.entries, Mainframe.model.dirty_flags, idx)
+        return text.decode('utf8')
         
     def onCopy(self):
         self.clipboard.setText(self.getSelectionAsYaml())
@@ -864,26 +1268,35 @@ class OverviewList(QtGui.QTreeWidget):
         self.onCopy()
         selection = sorted([x.row() for x in self.selectionModel().selectedRows()])
         selection.reverse()
+        self.skip_current_item_changed = True
         for idx in selection:
-            Mainframe.model.delete(idx)
+            self.deleteItem(idx)
+        self.skip_current_item_changed = False
+        reportParseErrors()
         if len(Mainframe.model.entries) == 0:
-            Mainframe.model = model.Model()
-        self.rebuild()
+            self.overviewModel.replaceEmptyModel(model.Model())
+            self.skip_model_changed = True
+            self.setCurrentRow(Mainframe.model.current)
+        else:
+            self.setCurrentRow(Mainframe.model.current)
         Mainframe.sigWrapper.sigModelChanged.emit()
 
         
     def onPaste(self):
         try:
-            data = yaml.load_all(unicode(self.clipboard.text()))
-            if isinstance(data,  dict):
-                data = [data]
+            data = list(yaml.load_all(unicode(self.clipboard.text())))
         except yaml.YAMLError, e:
             msgBox(Lang.value('MSG_YAML_failed') % e)
             return
+        if len(data) == 0:
+            return
+        self.skip_current_item_changed = True
         for entry in data:
             entry = model.makeSafe(entry)
-            Mainframe.model.insert(entry, True, Mainframe.model.current + 1)
-        self.rebuild()
+            self.overviewModel.insertEntry(Mainframe.model.current + 1, entry, True)
+        self.skip_current_item_changed = False
+        self.skip_model_changed = True
+        self.setCurrentRow(Mainframe.model.current)
         Mainframe.sigWrapper.sigModelChanged.emit()
 
     def onSaveSelectionAs(self):
@@ -903,102 +1316,59 @@ class OverviewList(QtGui.QTreeWidget):
             f.close()
 
     def init(self):
-        self.setColumnCount(6)
         self.onLangChanged()
         
     def getColumnWidths(self):
         retval = str()
-        for i in xrange(self.columnCount()):
+        for i in xrange(self.overviewModel.columnCount()):
             retval += struct.pack("I", self.columnWidth(i))            
         return QtCore.QByteArray.fromRawData(retval)
     
     def setColumnWidths(self, widths):
         w = widths.data()
-        for i in xrange(self.columnCount()):
+        for i in xrange(self.overviewModel.columnCount()):
             self.setColumnWidth(i, struct.unpack("I", w[i*4:(i+1)*4])[0])
     
     def onLangChanged(self):
-        self.setHeaderLabels(['', Lang.value('EP_Authors'), \
-            Lang.value('EP_Source'), Lang.value('EP_Date'), \
-            Lang.value('EP_Distinction'), Lang.value('EP_Stipulation'), \
-            Lang.value('EP_Pieces_count')])
-        for i in xrange(len(Mainframe.model.entries)):
-            if Mainframe.model.entries[i].has_key('distinction'):
-                d = model.Distinction.fromString(Mainframe.model.entries[i]['distinction'])
-                self.topLevelItem(i).setText(4, d.toStringInLang(Lang)) # 4 is the index of the distinction column
+        self.overviewModel.refreshHeader()
+        # 4 is the index of the distinction column
+        self.overviewModel.refreshRows(0, len(Mainframe.model.entries) - 1, 4, 4)
     
     def removeDirtyMarks(self):
-        for i in xrange(len(Mainframe.model.entries)):
-            self.topLevelItem(i).setText(0, str(i+1))
+        self.overviewModel.refreshRows(0, len(Mainframe.model.entries) - 1, 0, 0)
+
+    def setCurrentRow(self, idx):
+        self.setCurrentIndex(self.overviewModel.index(idx, 0))
 
     def rebuild(self):
-        self.clear()
-        for i in xrange(len(Mainframe.model.entries)):
-            newItem = QtGui.QTreeWidgetItem()
-            for j,  text in enumerate(self.createItem(i)):
-                newItem.setText(j,  text)
-            self.addTopLevelItem(newItem)
+        self.overviewModel.reset()
         self.skip_model_changed = True
-        self.setCurrentItem(self.topLevelItem(Mainframe.model.current))
+        self.setCurrentRow(Mainframe.model.current)
         
-    def insertItem(self, idx):
-        newItem = QtGui.QTreeWidgetItem()
-        for j,  text in enumerate(self.createItem(idx)):
-            newItem.setText(j,  text)
-        self.insertTopLevelItem(idx, newItem)
-        
-        for j in xrange(idx + 1, len(Mainframe.model.entries)):
-            self.topLevelItem(j).setText(0, str(j+1)+['', '*'][Mainframe.model.dirty_flags[j]])
+    def insertItem(self, idx, data, dirty):
+        self.overviewModel.insertEntry(idx, data, dirty)
         self.skip_model_changed = True
-        self.setCurrentItem(self.topLevelItem(Mainframe.model.current))
+        self.setCurrentRow(Mainframe.model.current)
 
     def deleteItem(self, idx):
-        self.takeTopLevelItem(idx)
-        for j in xrange(idx, len(Mainframe.model.entries)):
-            self.topLevelItem(j).setText(0, str(j+1)+['', '*'][Mainframe.model.dirty_flags[j]])
+        self.overviewModel.deleteEntry(idx)
         # which item is current now depends and handled by the caller (Mainframe)
         
-    def createItem(self, idx):
-        item = []
-        item.append(str(idx+1)+['', '*'][Mainframe.model.dirty_flags[idx]])
-        
-        authorsTxt = ''
-        if Mainframe.model.entries[idx].has_key('authors'):
-            authorsTxt = '; '.join(Mainframe.model.entries[idx]['authors'])
-        item.append(authorsTxt)
-        
-        for key in ['source',  'date',  'distinction',  'stipulation']:
-            if Mainframe.model.entries[idx].has_key(key):
-                if key == 'distinction':
-                    d = model.Distinction.fromString(Mainframe.model.entries[idx][key])
-                    item.append(d.toStringInLang(Lang))
-                else:
-                    item.append(unicode(Mainframe.model.entries[idx][key]))
-            else:
-                item.append('')
-        
-        item.append(Mainframe.model.pieces_counts[idx])
-        
-        return item
-    
     def onModelChanged(self):
         if self.skip_model_changed:
             self.skip_model_changed = False
             return
         
-        for i,  text in enumerate(self.createItem(Mainframe.model.current)):
-            self.topLevelItem(Mainframe.model.current).setText(i,  text)
+        self.overviewModel.refreshRows(Mainframe.model.current, Mainframe.model.current)
 
-    def onCurrentItemChanged(self, current, prev):
-        if current is None: # happens when deleting
+    def onCurrentRowChanged(self, current, prev):
+        if not current.isValid(): # happens when deleting
             return
         if self.skip_current_item_changed:
             return
         
-        # stupid hack:
-        text = current.text(0)
-        if(text[-1] == '*'): text = text[:-1]
-        Mainframe.model.setNewCurrent(int(text) - 1)
+        Mainframe.model.setNewCurrent(current.row())
+        reportParseErrors()
         
         self.skip_model_changed = True
         Mainframe.sigWrapper.sigModelChanged.emit()
@@ -1249,13 +1619,13 @@ class InfoView(QtGui.QTextEdit):
         self.setText("<br/><br/>".join([x for x in chunks if x != '']))
         
     def meta(self):
-        return pdf.ExportDocument.header(Mainframe.model.cur(), Lang)
+        return model.headerHtml(Mainframe.model.cur(), Lang)
         
     def solver(self):
-        return pdf.ExportDocument.solver(Mainframe.model.cur(), Lang)
+        return model.solverHtml(Mainframe.model.cur(), Lang)
 
     def legend(self):
-        return pdf.ExportDocument.legend(Mainframe.model.board)
+        return model.legendHtml(Mainframe.model.board)
      
         
 class ChessBox(QtGui.QWidget):
@@ -1746,9 +2116,12 @@ class PopeyeView(QtGui.QSplitter):
         self.input = PopeyeInputWidget()
         #self.input.setReadOnly(True)
         self.output = PopeyeOutputWidget(self)
-        self.output.setReadOnly(True)
-        #self.output.setTextColor(QtGui.QColor(255,255,255))
-        #self.output.setTextBackgroundColor(QtGui.QColor(255, 0, 0))
+        self.raw = console.OutputBuffer(int(Conf.value('console-spill-bytes')))
+        self.job, self.rival, self.rival_chunks = None, None, []
+        self.listener = console.JobListener()
+        self.listener.sigOutput.connect(self.onOut)
+        self.listener.sigError.connect(self.onError)
+        self.listener.sigFinished.connect(self.onFinished)
         
         self.sstip = QtGui.QCheckBox(Lang.value('PS_SStipulation'))
         self.btnEdit = QtGui.QPushButton(Lang.value('PS_Edit'))
@@ -1839,10 +2212,9 @@ class PopeyeView(QtGui.QSplitter):
         pass
     def onEdit(self):
         if self.raw_mode:
-            lines = self.raw_output.strip().split("\n")
-            if len(lines) < 2:
+            if len(self.rawOutput().strip().split("\n")) < 2:
                 return
-            Mainframe.model.cur()['solution'] = ("\n".join(lines[1:-2])).strip()
+            Mainframe.model.cur()['solution'] = batch.solutionFromOutput(self.rawOutput())
         else:
             Mainframe.model.cur()['solution'] = self.solutionOutput.solution
         
@@ -1850,24 +2222,52 @@ class PopeyeView(QtGui.QSplitter):
         Mainframe.sigWrapper.sigModelChanged.emit()
         Mainframe.sigWrapper.sigFocusOnSolution.emit()
     def stopPopeye(self):
+        if self.job is None:
+            return
         self.stop_requested = True
-        self.process.kill()
-        self.output.insertPlainText(QtCore.QString("\n" + Lang.value('MSG_Terminated')))
+        Mainframe.solverScheduler.cancel(self.job)
+        if not self.rival is None:
+            Mainframe.solverScheduler.cancel(self.rival)
+        self.output.appendOutput("\n" + Lang.value('MSG_Terminated'))
+
+    def shutdown(self):
+        self.raw.close()
         
     def reset(self):
         self.stop_requested = False
         self.output.setText("")
-        self.raw_output = ''
+        self.raw.clear()
+        self.parser, self.solution = None, None
         self.raw_mode = True
         self.compact_possible = False
         self.solutionOutput = None
         self.current_index = Mainframe.model.current
+        self.cache_key, self.cached_solutions, self.from_cache = None, {}, False
         
     def toggleCompact(self):
         self.raw_mode = not self.raw_mode
-        self.output.setText([self.solutionOutput.solution, self.raw_output][self.raw_mode])
+        if self.raw_mode:
+            self.output.setText(self.rawTail())
+        else:
+            self.output.setText(self.solutionOutput.solution)
+    
+    def rawOutput(self):
+        # the console shows the tail only, the complete output is in the buffer
+        return self.raw.text()
+
+    def rawTail(self):
+        return self.raw.tail(self.output.maximumBlockCount())
+
+    def parsedSolution(self):
+        if self.solution is None:
+            if self.parser is None:
+                self.solution = legacy.popeye.parse_output(self.entry_copy, self.rawOutput())
+            else:
+                self.solution = self.parser.close()
+        return self.solution
     
-    def runPopeyeInGui(self, input):
+    def runPopeyeInGui(self, input, chest_input = None):
+        # with chest_input chest races popeye, the first solution wins and the other solver is cancelled
         self.setActionEnabled(False)        
 
         self.reset()
@@ -1875,52 +2275,94 @@ class PopeyeView(QtGui.QSplitter):
                 
         Mainframe.sigWrapper.sigFocusOnPopeye.emit()
         
-        # writing input to temporary file
-        handle, self.temp_filename = tempfile.mkstemp()
-        os.write(handle, input)
-        os.close(handle)
-        
-        self.process = QtCore.QProcess()
-        self.process.readyReadStandardOutput.connect(self.onOut)
-        self.process.readyReadStandardError.connect(self.onError)
-        self.process.finished.connect(self.onFinished)
-        #self.process.closeWriteChannel()
-        py_exe = Conf.value('popeye-executable')[os.name].split(" ")
-        params = py_exe[1:]
-        params.append(self.temp_filename)
-        #print py_exe[0], params
-        self.process.error.connect(self.onFailed)
-        self.process.start(py_exe[0], params)
+        # same input to the same popeye - same output
+        backend = solvers.popeyeBackend()
+        self.cache_key = solvercache.makeKey(input, backend.signature())
+        cached = Mainframe.solverCache.get(self.cache_key)
+        if not cached is None:
+            self.from_cache = True
+            self.raw.append(cached['output'])
+            self.cached_solutions = cached['solutions']
+            self.output.appendOutput(self.rawTail())
+            self.onFinished(None)
+            return
+        
+        # the solution tree is built while popeye is still printing
+        self.parser = legacy.popeye.OutputParser(self.entry_copy)
+        
+        self.job = solvers.Job(backend, input, solvers.INTERACTIVE, 0, \
+            int(Conf.value('popeye-stop-max-bytes')), self.listener)
+        Mainframe.solverScheduler.submit(self.job)
+        if not chest_input is None:
+            self.rival, self.rival_chunks = solvers.Job(solvers.chestBackend(), chest_input, solvers.INTERACTIVE, 0, \
+                int(Conf.value('popeye-stop-max-bytes')), self.listener), []
+            Mainframe.solverScheduler.submit(self.rival)
     
     def startPopeye(self):
         self.runPopeyeInGui(str(self.input.toPlainText()))
-    
-    def onFailed(self):
-        try:
-            os.unlink(self.temp_filename)
-        except:
-            pass
-        self.setActionEnabled(True)
-        if not self.stop_requested:
-            msgBox(Lang.value('MSG_Popeye_failed') % Conf.value('popeye-executable')[os.name])
-        
-    def onOut(self):
-        data = self.process.readAllStandardOutput()
-        self.raw_output = self.raw_output + str(data)
-        self.output.insertPlainText(QtCore.QString(data))
-        if len(self.raw_output) > int(Conf.value('popeye-stop-max-bytes')):
-            self.stopPopeye()
-        
-    def onError(self):
-        self.output.setTextColor(QtGui.QColor(255,0,0))
-        self.output.insertPlainText(QtCore.QString(self.process.readAllStandardError()))
-        self.output.setTextColor(QtGui.QColor(0,0,0))
 
-    def onFinished(self):
+    def startFastest(self):
+        # chest takes part only in the problems it can solve
+        chest_input, message = chest.createInput(Mainframe.model.cur(), Mainframe.model.board)
+        self.runPopeyeInGui(str(self.input.toPlainText()), chest_input)
+    
+    def onOut(self, job, data):
+        if (not self.rival is None) and job is self.rival:
+            self.rival_chunks.append(data)
+        if not job is self.job:
+            return
+        self.raw.append(data)
+        if not self.parser is None:
+            self.parser.feed(data)
+        self.output.appendOutput(data)
+        
+    def onError(self, job, data):
+        if job is self.job:
+            self.output.appendError(data)
+
+    def onFinished(self, job):
+        if (not self.rival is None) and job is self.rival:
+            self.onRivalFinished(job)
+            return
+        if not self.from_cache:
+            if not job is self.job:
+                return
+            self.job = None
+            if not self.rival is None:
+                Mainframe.solverScheduler.cancel(self.rival)
+                self.rival = None
+                if job.status == solvers.OK:
+                    self.output.appendOutput("\n" + Lang.value('MSG_Race_result') % ('Popeye', job.elapsed, 'Chest'))
+            if job.status == solvers.FAILED and not self.stop_requested:
+                self.setActionEnabled(True)
+                msgBox(Lang.value('MSG_Popeye_failed') % Conf.value('popeye-executable')[os.name])
+                return
+            if job.status == solvers.OVERFLOW:
+                self.output.appendOutput("\n" + Lang.value('MSG_Terminated'))
+            if job.status == solvers.OK:
+                Mainframe.solverCache.put(self.cache_key, self.rawOutput())
+        self.onSolved()
+
+    def onRivalFinished(self, job):
+        # chest has won if it has solved the problem while popeye is still running,
+        # otherwise popeye goes on
+        self.rival = None
+        if job.status != solvers.OK or self.job is None or self.stop_requested:
+            return
+        output = ''.join(self.rival_chunks)
         try:
-            os.unlink(self.temp_filename)
-        except:
-            pass
+            solution = chest.parseOutput(self.entry_copy, output)
+        except (legacy.popeye.ParseError, legacy.chess.UnsupportedError):
+            return
+        Mainframe.solverScheduler.cancel(self.job)
+        self.job, self.parser, self.solution, self.cache_key = None, None, solution, None
+        self.raw.clear()
+        self.raw.append(output)
+        self.output.setText(self.rawTail())
+        self.output.appendOutput("\n" + Lang.value('MSG_Race_result') % ('Chest', job.elapsed, 'Popeye'))
+        self.onSolved()
+
+    def onSolved(self):
         self.setActionEnabled(True)
         
         if Conf.value('auto-compactify'):
@@ -1934,6 +2376,7 @@ class PopeyeView(QtGui.QSplitter):
     def setActionEnabled(self, status):
         self.actions['stop'].setEnabled(not status)
         self.actions['start'].setEnabled(status)
+        self.actions['race'].setEnabled(status)
         self.actions['legalb'].setEnabled(status)
         self.actions['legalw'].setEnabled(status)
     
@@ -1947,12 +2390,18 @@ class PopeyeView(QtGui.QSplitter):
 
     def onCompact(self):
         try:
-            self.setLegacyNotation(Conf.value('default-notation'))
-            self.solution = legacy.popeye.parse_output(self.entry_copy, self.raw_output)
+            notation = Conf.value('default-notation')
+            self.setLegacyNotation(notation)
             self.solutionOutput = legacy.chess.SolutionOutput(False)
-            b = legacy.chess.Board()
-            b.from_algebraic(self.entry_copy['algebraic'])
-            self.solutionOutput.create_output(self.solution, b)
+            if self.cached_solutions.has_key(notation):
+                self.solutionOutput.solution = self.cached_solutions[notation]
+            else:
+                b = legacy.chess.Board()
+                b.from_algebraic(self.entry_copy['algebraic'])
+                self.solutionOutput.create_output(self.parsedSolution(), b)
+                self.cached_solutions[notation] = self.solutionOutput.solution
+                if not self.cache_key is None:
+                    Mainframe.solverCache.addSolution(self.cache_key, notation, self.solutionOutput.solution)
             self.toggleCompact()
         except (legacy.popeye.ParseError, legacy.chess.UnsupportedError) as e:
             msgBox(Lang.value('MSG_Not_supported') % str(e))
@@ -1996,7 +2445,7 @@ class PopeyeView(QtGui.QSplitter):
             self.setLegacyNotation(notation)
             b = legacy.chess.Board()
             b.from_algebraic(self.entry_copy['algebraic'])
-            self.solutionOutput.create_output(self.solution, b)
+            self.solutionOutput.create_output(self.parsedSolution(), b)
             self.output.setText(self.solutionOutput.solution)    
         return callable
 
@@ -2139,7 +2588,7 @@ class PublishingView(QtGui.QSplitter):
         self.richText.setText("")
         self.richText.setFontPointSize(12)
         
-        self.richText.insertHtml(pdf.ExportDocument.header(Mainframe.model.cur(), Lang) + "<br/>\n")
+        self.richText.insertHtml(model.headerHtml(Mainframe.model.cur(), Lang) + "<br/>\n")
                
         inline_font = self.config['inline-fonts'][self.solFontSelect.currentIndex()]
         diagram_font = self.config['diagram-fonts'][self.diaFontSelect.currentIndex()]
@@ -2147,8 +2596,8 @@ class PublishingView(QtGui.QSplitter):
         self.richText.insertHtml(self.board2Html(Mainframe.model.board, self.config['config'][diagram_font]))
         self.richText.insertHtml(Mainframe.model.cur()['stipulation'] + ' ' + Mainframe.model.board.getPiecesCount() + "<br/>\n")
         
-        self.richText.insertHtml(pdf.ExportDocument.solver(Mainframe.model.cur(), Lang) + "<br/>\n")
-        self.richText.insertHtml(pdf.ExportDocument.legend(Mainframe.model.board) + "<br/><br/>\n")
+        self.richText.insertHtml(model.solverHtml(Mainframe.model.cur(), Lang) + "<br/>\n")
+        self.richText.insertHtml(model.legendHtml(Mainframe.model.board) + "<br/><br/>\n")
         
         if Mainframe.model.cur().has_key('solution'):
             self.richText.insertHtml(self.solution2Html(Mainframe.model.cur()['solution'], self.config['config'][inline_font]))
@@ -2167,10 +2616,10 @@ class PublishingView(QtGui.QSplitter):
         self.labelMemo.setText(Lang.value('PU_Memo'))
         self.onModelChanged()
         
-class PopeyeOutputWidget(QtGui.QTextEdit):
+class PopeyeOutputWidget(console.OutputConsole):
     def __init__(self,  parentView):
         self.parentView = parentView
-        super(PopeyeOutputWidget, self).__init__()
+        super(PopeyeOutputWidget, self).__init__(int(Conf.value('console-max-lines')))
     def contextMenuEvent(self, e):
         menu = self.createStandardContextMenu()
         if self.parentView.compact_possible:
@@ -2190,6 +2639,12 @@ def msgBox(msg):
     box.setText(msg)
     box.exec_()
 
+def reportParseErrors():
+    # the entries that became current but could not be parsed, see model.Model.setNewCurrent
+    for e in Mainframe.model.parse_errors:
+        msgBox(Lang.value('MSG_YAML_failed') % e)
+    Mainframe.model.parse_errors = []
+
 class YamlView(QtGui.QTextEdit):
     def __init__(self):
         super(YamlView, self).__init__()
@@ -2198,61 +2653,3 @@ class YamlView(QtGui.QTextEdit):
 
     def onModelChanged(self):
         self.setText(yaml.dump(Mainframe.model.cur(), encoding=None, allow_unicode=True))
-class Conf:
-    file = 'conf/main.yaml'
-    keywords_file = 'conf/keywords.yaml'
-    zoo_file = 'conf/zoos.yaml'
-    
-    def read():
-        f = open(Conf.file, 'r')
-        try:
-            Conf.values = yaml.load(f)
-        finally:
-            f.close()
-
-        Conf.zoos = []
-        f = open(Conf.zoo_file, 'r')
-        try:
-            for zoo in yaml.load_all(f):
-                Conf.zoos.append(zoo)
-        finally:
-            f.close()
-
-        f = open(Conf.keywords_file, 'r')
-        try:
-            Conf.keywords = yaml.load(f)
-        finally:
-            f.close()
-    read = staticmethod(read)
-
-    def write():
-        f = open(Conf.file, 'w')
-        try:
-            f.write(unicode(yaml.dump(Conf.values, encoding=None, allow_unicode=True)).encode('utf8'))
-        finally:
-            f.close()
-    write = staticmethod(write)
-
-    
-    def value(v):
-        return Conf.values[v]
-    value = staticmethod(value)
-
-class Lang:
-    file = 'conf/lang.yaml'
-    
-    def read():
-        f = open(Lang.file, 'r')
-        try:
-            Lang.values = yaml.load(f)
-        finally:
-            f.close()
-        Lang.current = Conf.value('default-lang')
-    read = staticmethod(read)
-
-    def value(v):
-        return Lang.values[v][Lang.current]
-    value = staticmethod(value)
-    
-
-
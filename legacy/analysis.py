@@ -0,0 +1,32 @@
+import chess
+
+# analyzers that need to walk the solution tree implement:
+#   visitors(twin, keyplay) - returns two lists of visitors: for the whole twin
+#       (including tries and set play) and for the keyplay only
+#   twin_done(twin, board) - called after the traversal, the twin position is on the board
+#   result(board) - returns {keyword: bool}, the initial position is on the board
+# all analyzers are served by a single traversal per twin
+
+def run(board, solution, analyzers):
+    for twin in solution.siblings:
+        twin.make(board)
+        keyplay = twin.keyplay()
+        whole, keyplay_only = [], []
+        for analyzer in analyzers:
+            w, k = analyzer.visitors(twin, keyplay)
+            whole.extend(w)
+            keyplay_only.extend(k)
+        if len(keyplay_only):
+            # keyplay is a plain Node: making it is a no-op, white is on move
+            chess.MultiVisitor(keyplay_only).visit(keyplay, board, chess.WHITE)
+        for node in twin.siblings:
+            visitors = whole + [[], keyplay_only][node in keyplay.siblings]
+            if len(visitors):
+                node.traverse(board, chess.MultiVisitor(visitors))
+        for analyzer in analyzers:
+            analyzer.twin_done(twin, board)
+        twin.unmake(board)
+    retval = {}
+    for analyzer in analyzers:
+        retval.update(analyzer.result(board))
+    return retval
@@ -0,0 +1,53 @@
+# times popeye.parse_output on captured popeye outputs
+# usage:
+#   python bench_popeye.py [--repeat N] FILE.olv [FILE.olv ...]
+# FILE.olv - a collection solved with 'olivecli.py solve' (without --compact),
+#            so that the solutions are what popeye printed
+# --repeat N - every output is parsed N times
+
+import sys
+import time
+import yaml
+import chess
+import popeye
+
+def captured_output(solution):
+    # the header and the footer were stripped when the solution was stored
+    return "Popeye bench\n\n" + solution + "\n\nsolution finished. Time = 0.001 s\n"
+
+def main(args):
+    repeat = 1
+    if '--repeat' in args:
+        i = args.index('--repeat')
+        repeat = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
+    if len(args) == 0:
+        print "usage: python bench_popeye.py [--repeat N] FILE.olv [FILE.olv ...]"
+        return 1
+
+    cases = []
+    for filename in args:
+        for entry in yaml.load_all(open(filename)):
+            if entry is None or not entry.has_key('algebraic') or not entry.has_key('solution'):
+                continue
+            cases.append((entry, captured_output(unicode(entry['solution']).encode('utf8'))))
+
+    size, elapsed, slowest, errors = 0, 0.0, (0.0, 0), 0
+    for entry, output in cases:
+        started = time.time()
+        try:
+            for i in xrange(repeat):
+                popeye.parse_output(entry, output)
+        except (popeye.ParseError, chess.UnsupportedError):
+            errors = errors + 1
+        spent = (time.time() - started) / repeat
+        size, elapsed = size + len(output), elapsed + spent
+        slowest = max(slowest, (spent, len(output)))
+
+    print "%d outputs, %d bytes, %d not parsed" % (len(cases), size, errors)
+    print "%.3f s, %.1f KB/s" % (elapsed, size / 1024.0 / max(elapsed, 1e-6))
+    print "slowest: %.3f s for %d bytes" % slowest
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
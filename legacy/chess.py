@@ -1,8 +1,11 @@
 ﻿# -*- coding: utf-8 -*-
 
 # standard
-import array
+import os
 import copy
+import mmap
+import random
+import struct
 
 # local
 import popeye
@@ -12,6 +15,15 @@ PIECES = 'KkQqRrBbSsPp'
 BLACK = False
 WHITE = True
 NOTATION = {'K':u'Кр', 'Q':u'Ф', 'R':u'Л', 'B':u'С', 'S':u'К', 'P':u'п'}
+# king, queen, rook, bishop, knight, pawn of each color
+ARMY = {BLACK:'kqrbsp', WHITE:'KQRBSP'}
+# castling rights are bits of an int: 1 << (2*color + short)
+CASTLING_ALL = 15
+CASTLING_COLOR = {BLACK:3, WHITE:12}
+
+# precomputed lookup tables, see mklut.py
+LUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lut.bin')
+LUT_MAGIC, LUT_VERSION = 'OLIVELUT', 1
 
 
 NAME = 0
@@ -36,6 +48,8 @@ class Board:
         self.board[at] = [piece, -1, self.head, id]
         self.head = at
         self.interferers[at] = 1
+        self.occupied[piece] = self.occupied.get(piece, 0) | (1 << at)
+        self.hash ^= LUT.zobrist[piece][at]
 
     def drop(self, at):
         if((at > 63) or (at < 0)):
@@ -46,10 +60,19 @@ class Board:
             self.board[self.board[at][NEXT]][PREV] = self.board[at][PREV]
         if(at == self.head):
             self.head = self.board[at][NEXT]
+        if self.board[at][NAME] != '':
+            self.occupied[self.board[at][NAME]] &= ~(1 << at)
+            self.hash ^= LUT.zobrist[self.board[at][NAME]][at]
         self.board[at] = ['', -1, -1, -1]
         self.interferers[at] = 0
     
     def move(self, dep, arr):
+        if self.board[arr][NAME] != '':
+            self.occupied[self.board[arr][NAME]] &= ~(1 << arr)
+            self.hash ^= LUT.zobrist[self.board[arr][NAME]][arr]
+        name = self.board[dep][NAME]
+        self.occupied[name] = (self.occupied.get(name, 0) & ~(1 << dep)) | (1 << arr)
+        self.hash ^= LUT.zobrist[name][dep] ^ LUT.zobrist[name][arr]
         self.board[arr] = self.board[dep]
         if(self.board[arr][NEXT] != -1):
             self.board[self.board[arr][NEXT]][PREV] = arr
@@ -65,12 +88,38 @@ class Board:
         if(self.board[arr][NAME] in 'kK'):
             self.kings[self.board[arr][NAME] == 'K'] = arr
         
+    # zobrist key of the complete position (side to move is up to the caller)
+    def key(self):
+        return self.hash ^ LUT.zobrist_castling[self.castling] ^ LUT.zobrist_ep[self.ep + 1]
+
+    def save_state(self):
+        self.history.append(self.castling | ((self.ep + 1) << 4))
+
+    def restore_state(self):
+        state = self.history.pop()
+        self.castling, self.ep = state & CASTLING_ALL, (state >> 4) - 1
+
+    def rename(self, at, piece): # e.g. promotions
+        name = self.board[at][NAME]
+        if name == piece:
+            return
+        self.occupied[name] &= ~(1 << at)
+        self.occupied[piece] = self.occupied.get(piece, 0) | (1 << at)
+        self.hash ^= LUT.zobrist[name][at] ^ LUT.zobrist[piece][at]
+        self.board[at][NAME] = piece
+        if(piece in 'kK'):
+            self.kings[piece == 'K'] = at
 
     def clear(self):
         self.kings = [-1, -1]
         self.head, self.board, self.interferers = -1, [], BitBoard()
+        self.occupied = {} # piece name -> bitboard (as int) of its squares
+        for piece in PIECES:
+            self.occupied[piece] = 0
         self.ep = -1 # square where an en passant capture is possible
-        self.castling = [[True, True], [True, True]] # castling rights
+        self.castling = CASTLING_ALL # castling rights
+        self.history = [] # castling rights and ep before each made move
+        self.hash = 0 # zobrist key of the pieces placement, maintained incrementally
         
         for i in xrange(64):
             self.board.append(['', -1, -1, -1])
@@ -117,8 +166,10 @@ class Board:
         if len(fields) < 1:
             return
         if len(fields) == 6:
-            self.castling = [['q' in fields[2], 'k' in fields[2]], \
-                ['Q' in fields[2], 'K' in fields[2]]]
+            self.castling = 0
+            for i, letter in enumerate('qkQK'):
+                if letter in fields[2]:
+                    self.castling |= 1 << i
             if (len(fields[3]) == 2) and (fields[3][0] in 'abcdefgh') \
                 and (fields[3][1] in '87654321'):
                 self.ep = '87654321'.find(fields[3][1])*8 + \
@@ -156,15 +207,60 @@ class Board:
     is_of = staticmethod(is_of)
     
     def is_attacked(self, square, color):
-        for (piece, pos) in Pieces(self, color):
-            if((LUT.att[piece][pos][square] == 1) and \
-                (LUT.btw[pos][square] & self.interferers).is_zero()):
-                return True
-        return False
+        if square == -1: # e.g. no king
+            return False
+        k, q, r, b, s, p = ARMY[color]
+        if (self.occupied[s] & LUT.attackers[s][square]) or \
+            (self.occupied[k] & LUT.attackers[k][square]) or \
+            (self.occupied[p] & LUT.attackers[p][square]):
+            return True
+        return (self.slider_attackers(square, color, True) != 0)
+
+    # bitboard of the pieces of the color attacking the square
+    def attackers(self, square, color):
+        k, q, r, b, s, p = ARMY[color]
+        return (self.occupied[s] & LUT.attackers[s][square]) | \
+            (self.occupied[k] & LUT.attackers[k][square]) | \
+            (self.occupied[p] & LUT.attackers[p][square]) | \
+            self.slider_attackers(square, color, False)
+
+    # queens, rooks and bishops that see the square along unobstructed rays
+    def slider_attackers(self, square, color, first_only):
+        k, q, r, b, s, p = ARMY[color]
+        retval, btw, interferers = 0, LUT.btw_bits[square], self.interferers.bits
+        candidates = ((self.occupied[q] | self.occupied[r]) & LUT.attackers[r][square]) | \
+            ((self.occupied[q] | self.occupied[b]) & LUT.attackers[b][square])
+        while candidates:
+            lowest = candidates & -candidates
+            candidates ^= lowest
+            if not (btw[lowest.bit_length() - 1] & interferers):
+                retval |= lowest
+                if first_only:
+                    break
+        return retval
+
+    # bitboard of the pieces of the color that are pinned to their own king
+    def pinned(self, color):
+        retval, king = 0, self.kings[color]
+        if king == -1:
+            return retval
+        k, q, r, b, s, p = ARMY[not color]
+        own, btw, interferers = 0, LUT.btw_bits[king], self.interferers.bits
+        for piece in ARMY[color]:
+            own |= self.occupied[piece]
+        pinners = ((self.occupied[q] | self.occupied[r]) & LUT.attackers[r][king]) | \
+            ((self.occupied[q] | self.occupied[b]) & LUT.attackers[b][king])
+        while pinners:
+            lowest = pinners & -pinners
+            pinners ^= lowest
+            between = btw[lowest.bit_length() - 1] & interferers
+            if between and not (between & (between - 1)) and (between & own):
+                retval |= between
+        return retval
     
     def can_castle(self, color, short):
         # check: pieces have moved
-        if(not self.castling[color][short]):
+        if(not (self.castling >> (2*color + short)) & 1):
             return False
         king, rook = LUT.castling[color][0], LUT.castling[color][1][short]
         # check: king is at the initial square
@@ -210,6 +306,17 @@ class Board:
     # recurses: f(N, N) -> f(N, N-1) -> ... -> f(N, 1) -> mate_in_1()
     # the first argument is only needed to tell when to include tries
     def mate_in_n(self, n, depth):
+        if n == depth:
+            TT.new_search()
+        # it is always white to move here, tries are only collected at the top level
+        key = (self.key(), depth, WHITE, n == depth)
+        retval = TT.get(key)
+        if retval is None:
+            retval = self.search_mate(n, depth)
+            TT.put(key, depth, retval)
+        return retval
+
+    def search_mate(self, n, depth):
 
         # invalid position
         if self.is_attacked(self.kings[BLACK], WHITE):
@@ -271,55 +378,61 @@ class Board:
                     retval = False
         return retval
 
-class BitBoard:
+class BitBoard(object):
+    # 64 squares packed into a single (long) int, bit i is square i
+    __slots__ = ['bits']
     
     def __init__(self, lo = 0, hi = 0):
-        self.v = array.array('L', [lo, hi])
+        self.bits = lo | (hi << 32)
+    
+    def from_int(bits):
+        retval = BitBoard()
+        retval.bits = bits
+        return retval
+    from_int = staticmethod(from_int)
+    
+    # the two 32-bit halves, as the former array-based storage exposed them
+    def get_v(self):
+        return (self.bits & 0xffffffff, self.bits >> 32)
+    v = property(get_v)
     
     def is_zero(self):
-        return self.v[0] == 0 and self.v[1] == 0
+        return self.bits == 0
     
     def __setitem__(self, pos, item):
         if item:
-            self.v[pos > 31] |= 1 << (pos % 32)
+            self.bits |= 1 << pos
         else:
-            self.v[pos > 31] &= 0xffffffff ^ (1 << (pos % 32))
+            self.bits &= ~(1 << pos)
 
     def __getitem__(self, pos):
-        return (self.v[pos > 31] >> (pos % 32)) & 1
+        return (self.bits >> pos) & 1
     
     def __and__(self, that):
-        return BitBoard(self.v[0] & that.v[0], self.v[1] & that.v[1])
+        return BitBoard.from_int(self.bits & that.bits)
     
     def __or__(self, that):
-        return BitBoard(self.v[0] | that.v[0], self.v[1] | that.v[1])
+        return BitBoard.from_int(self.bits | that.bits)
 
     def __xor__(self, that):
-        return BitBoard(self.v[0] ^ that.v[0], self.v[1] ^ that.v[1])
+        return BitBoard.from_int(self.bits ^ that.bits)
 
     def __invert__(self):
-        return BitBoard(~self.v[0] & 0xffffffff, ~self.v[1] & 0xffffffff)
+        return BitBoard.from_int(~self.bits & 0xffffffffffffffff)
 
     def __eq__(self, that):
-        return (self.v[0] == that.v[0]) and (self.v[1] == that.v[1])
+        return self.bits == that.bits
+
+    def __ne__(self, that):
+        return self.bits != that.bits
 
     def __iter__(self):
-        self.pos = 0
+        for i in xrange(64):
+            yield (self.bits >> i) & 1
 
     def count_set_bits(self):
-        retval = 0
-        for bit in SetBits(self):
-            retval += 1
-        return retval
+        return bin(self.bits).count('1')
 
-    def next(self):
-        if(self.pos > 63):
-            raise StopIteration
-        # return self[self.pos++] :) 
-        retval = self[self.pos]
-        self.pos += 1
-        return retval 
-    
     def __str__(self):
         retval = ''
         for i in xrange(64):
@@ -331,18 +444,20 @@ class BitBoard:
 # iterators
 class SetBits:
     def __init__(self, qword):
-        self.pos, self.qword = -1, qword
+        self.bits = qword.bits
     def __iter__(self):
         return self
     def next(self):
-        while(True):
-            self.pos = self.pos + 1
-            if(self.pos > 63):
-                raise StopIteration
-            if(self.qword[self.pos] == 1):
-                return self.pos
+        if self.bits == 0:
+            raise StopIteration
+        lowest = self.bits & -self.bits
+        self.bits ^= lowest
+        return lowest.bit_length() - 1
 
-class Move:
+class Move(object):
+    __slots__ = ['dep', 'arr', 'cap', 'captured_piece_id', 'departing_piece_id', 'ep', 'castling', \
+        'is_castling', 'rook_before', 'rook_after', 'is_stalemate', 'is_check', 'is_mate', \
+        'disambiguation', 'letter', 'disambiguation_int', 'mark', 'cpd']
     
     # params are tuples: ([char Piece], int position)
     def __init__(self, dep, arr, cap):
@@ -351,22 +466,17 @@ class Move:
         self.departing_piece_id = -1
 
         # if move is a pawn doublestep set up an e.p. square
-        if((self.dep[0] in 'pP') and (not LUT.btw[dep[1]][arr[1]].is_zero())):
-            for i in SetBits(LUT.btw[dep[1]][arr[1]]): # there's just 1 bit
-                self.ep = i
+        if((self.dep[0] in 'pP') and (abs(arr[1] - dep[1]) == 16)):
+            self.ep = (dep[1] + arr[1]) >> 1
         else: # void further ep possibility
             self.ep = -1
         
+        # castling rights that survive the move:
+        # if something arrives to initial position of the rook - void that castling,
         # if move is made by king - void that side castling rights
-        self.castling = [[True, True], [True, True]]
+        self.castling = LUT.castling_kept[arr[1]]
         if(self.dep[0] in 'kK'):
-            self.castling[self.dep[0] == 'K'] = [False, False]                
-        
-        # if something arrives to initial position of the rook: void castling
-        for (color, short) in \
-            [(BLACK, False), (BLACK, True), (WHITE, False), (WHITE, True)]:
-            if(arr[1] == LUT.castling[color][1][short]):
-                self.castling[color][short] = False
+            self.castling &= ~CASTLING_COLOR[self.dep[0] == 'K']
 
         # castling is set from the outside
         self.is_castling = False
@@ -382,18 +492,14 @@ class Move:
         #print '->', self
         
         # saving castlings and ep
-        self.old_castling = copy.deepcopy(board.castling)
-        self.old_ep = board.ep
+        board.save_state()
 
         # saving departing piece id
         self.departing_piece_id = board.board[self.dep[1]][ID]
         
         # applying new castlings and ep
         board.ep = self.ep
-        for (color, short) in \
-            [(BLACK, False), (BLACK, True), (WHITE, False), (WHITE, True)]:
-            board.castling[color][short] = \
-                board.castling[color][short] and self.castling[color][short]
+        board.castling &= self.castling
         
         # removing the captured piece
         if(self.cap[1] != -1):
@@ -404,7 +510,7 @@ class Move:
         board.move(self.dep[1], self.arr[1])
         
         # promoting the piece
-        board.board[self.arr[1]][NAME] = self.arr[0]
+        board.rename(self.arr[1], self.arr[0])
         
         # moving the rook, if castled
         if(self.is_castling):
@@ -422,15 +528,14 @@ class Move:
         board.move(self.arr[1], self.dep[1])
         
         # unpromoting
-        board.board[self.dep[1]][NAME] = self.dep[0]
+        board.rename(self.dep[1], self.dep[0])
         
         # returning the captured piece
         if(self.cap[1] != -1):
             board.add(self.cap[0], self.cap[1], self.captured_piece_id)
 
         # restoring castling and ep
-        board.castling = copy.deepcopy(self.old_castling)
-        board.ep = self.old_ep
+        board.restore_state()
     
     # short algebraic notation can be ambiguous
     def disambiguate(self, board):
@@ -484,18 +589,53 @@ class NullMove: #for threats and setplay
         pass
     def make(self, board):
         # to avoid "1.a2-a4 threating 2. b2xa3 e.p."
-        self.old_ep = board.ep 
+        board.save_state()
         board.ep = -1
     def unmake(self, board):
-        board.ep = self.old_ep
+        board.restore_state()
     def __eq__(self, that):
         return isinstance(that, NullMove)
     def hash(self):
         return '-'
+
+# a move with the replies to it, as found by Board.mate_in_n()
+class Phase:
+    def __init__(self, move):
+        self.move, self.variations, self.refutations = move, [], []
+
+# bounded cache of Board.mate_in_n() results, two slots per bucket:
+# the first one keeps the deepest result (unless it is left from a previous search),
+# the second one always takes the latest
+class TranspositionTable:
+    def __init__(self, size = 1 << 16):
+        self.size, self.generation = size, 0
+        self.deep, self.recent = [None] * size, [None] * size
+    
+    def new_search(self):
+        self.generation += 1
     
+    def get(self, key):
+        i = key[0] % self.size
+        for slots in [self.deep, self.recent]:
+            if (not slots[i] is None) and (slots[i][0] == key):
+                return slots[i][2]
+        return None
+    
+    def put(self, key, depth, value):
+        i = key[0] % self.size
+        entry = (key, depth, value, self.generation)
+        if (self.deep[i] is None) or (self.deep[i][1] <= depth) or \
+            (self.deep[i][3] != self.generation):
+            self.deep[i] = entry
+        else:
+            self.recent[i] = entry
+
+    def clear(self):
+        self.deep, self.recent = [None] * self.size, [None] * self.size
+
 class LookupTables:
     
-    def __init__(self):
+    def __init__(self, filename = LUT_FILE):
         self.att = {} # attack bitboards for each piece and square
         self.mov = {} # move lists for each piece and square
         self.btw = [] # between bitboards for each pair of squares
@@ -505,7 +645,21 @@ class LookupTables:
         self.castling = [[4, [0, 7], [2, 6], [3, 5]], \
                          [60, [56, 63], [58, 62], [59, 61]]]
         
-        self.promotions = ['qrbn', 'QRBN']
+        self.promotions = ['qrbs', 'QRBS']
+        
+        # castling rights kept by a move arriving at the square
+        self.castling_kept = [CASTLING_ALL] * 64
+        for color in [BLACK, WHITE]:
+            for short in [False, True]:
+                self.castling_kept[self.castling[color][1][short]] &= ~(1 << (2*color + short))
+        
+        # zobrist keys, the seed is fixed so that keys are reproducible
+        rng = random.Random(0x01172E)
+        self.zobrist = {}
+        for piece in PIECES:
+            self.zobrist[piece] = [rng.getrandbits(64) for i in xrange(64)]
+        self.zobrist_castling = [rng.getrandbits(64) for i in xrange(CASTLING_ALL + 1)]
+        self.zobrist_ep = [0] + [rng.getrandbits(64) for i in xrange(64)]
         
         for piece in PIECES:
             self.att[piece] = []
@@ -518,6 +672,26 @@ class LookupTables:
         self.vecWP = [(-1, -1), (1, -1)];
         self.vecPs = [ [(0, 1)], [(0, -1)] ]
         
+        # the tables are loaded from the file generated by mklut.py when
+        # it is there and up to date, otherwise they are computed
+        self.precomputed = (not filename is None) and self.load(filename)
+        if not self.precomputed:
+            self.build()
+
+        # the same as plain ints, for the hot paths
+        self.btw_bits = [[bb.bits for bb in row] for row in self.btw]
+        # reverse lookup: squares from where the piece attacks the square
+        # (pawns are not symmetric, a white pawn attacks X from where a black pawn on X would attack)
+        self.attackers = {}
+        for piece in PIECES:
+            self.attackers[piece] = [bb.bits for bb in \
+                self.att[{'p':'P', 'P':'p'}.get(piece, piece)]]
+
+    def build(self):
+        for piece in PIECES:
+            self.att[piece] = []
+            self.mov[piece] = []
+
         rules = []
         rules.append({'pieces':'rR', 'vecs':self.vecR, 'range':7})
         rules.append({'pieces':'bB', 'vecs':self.vecB, 'range':7})
@@ -549,6 +723,75 @@ class LookupTables:
                 else:
                     self.btw[i].append(BitBoard())
 
+    def load(self, filename):
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return False
+        try:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                return False
+            try:
+                return self.unpack(data)
+            finally:
+                data.close()
+        finally:
+            f.close()
+
+    def unpack(self, data):
+        # layout: magic, version, pieces; 64 attack bitboards per piece;
+        # 64x64 between bitboards; move lists as bytes: per piece and square
+        # the number of rays, then for each ray its length and the squares
+        header = struct.Struct('<8sI12s')
+        if len(data) < header.size:
+            return False
+        magic, version, pieces = header.unpack_from(data, 0)
+        if (magic, version, pieces) != (LUT_MAGIC, LUT_VERSION, PIECES):
+            return False
+        offset, att, btw, mov = header.size, {}, [], {}
+        if len(data) < offset + 8*64*(len(PIECES) + 64):
+            return False
+        for piece in PIECES:
+            att[piece] = [BitBoard.from_int(x) for x in struct.unpack_from('<64Q', data, offset)]
+            offset += 8*64
+        for i in xrange(64):
+            btw.append([BitBoard.from_int(x) for x in struct.unpack_from('<64Q', data, offset)])
+            offset += 8*64
+        octets = [ord(x) for x in data[offset:]]
+        offset = 0
+        try:
+            for piece in PIECES:
+                mov[piece] = []
+                for i in xrange(64):
+                    rays, count = [], octets[offset]
+                    offset += 1
+                    for r in xrange(count):
+                        length = octets[offset]
+                        rays.append(octets[offset + 1:offset + 1 + length])
+                        offset += 1 + length
+                    mov[piece].append(rays)
+        except IndexError:
+            return False
+        if offset != len(octets):
+            return False
+        self.att, self.btw, self.mov = att, btw, mov
+        return True
+
+    def pack(self):
+        chunks = [struct.pack('<8sI12s', LUT_MAGIC, LUT_VERSION, PIECES)]
+        for piece in PIECES:
+            chunks.append(struct.pack('<64Q', *[bb.bits for bb in self.att[piece]]))
+        for i in xrange(64):
+            chunks.append(struct.pack('<64Q', *[bb.bits for bb in self.btw[i]]))
+        for piece in PIECES:
+            for i in xrange(64):
+                chunks.append(chr(len(self.mov[piece][i])))
+                for ray in self.mov[piece][i]:
+                    chunks.append(chr(len(ray)) + ''.join([chr(x) for x in ray]))
+        return ''.join(chunks)
+
     def trace(self, start, vectors, range):
         bitboard, movelist = BitBoard(), []
         (a, b) = LookupTables.to_xy(start)
@@ -595,6 +838,21 @@ class LookupTables:
         return LookupTables.from_xy(ax, dy)
     ep = staticmethod(ep)
 
+class LazyLookupTables(LookupTables):
+    # the tables take a while to build and most sessions never need them,
+    # so they are built on the first attribute access; after that the
+    # attributes are found in the instance and __getattr__ is not called
+    def __init__(self):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__') or self.__dict__.has_key('att'):
+            raise AttributeError(name)
+        assigned = dict(self.__dict__) # whatever was patched from outside stays
+        LookupTables.__init__(self)
+        self.__dict__.update(assigned)
+        return getattr(self, name)
+
 
 class Pieces:
     def __init__(self, board, color):
@@ -757,19 +1015,45 @@ class LegalMoves:
     def __init__(self, board, color):
         self.board, self.moves, self.color = board, Moves(board, color), color
         self.move = None
+        # everything below is about the initial position and is not altered by make/unmake
+        self.king = board.kings[color]
+        self.pinned, self.checkers, self.evasions = 0, 0, -1
+        if self.king != -1:
+            self.pinned = board.pinned(color)
+            self.checkers = board.attackers(self.king, not color)
+        if self.checkers:
+            if self.checkers & (self.checkers - 1): # double check: only the king can move
+                self.evasions = 0
+            else: # capture the checker or interpose
+                self.evasions = self.checkers | \
+                    LUT.btw_bits[self.king][self.checkers.bit_length() - 1]
     def __iter__(self):
         return self
     def next(self):
         if not (self.move is None):
             self.move.unmake(self.board)
-        self.move = self.moves.next()
-        self.move.make(self.board)
-        legal = not self.board.is_attacked(self.board.kings[self.color], \
-            not self.color)
-        if(legal):
-            return self.move
-        else:
-            return self.next()
+            self.move = None
+        while(True):
+            move = self.moves.next()
+            verify = (self.king == -1) or (move.dep[1] == self.king) or \
+                (self.pinned & (1 << move.dep[1])) or \
+                ((move.cap[1] != -1) and (move.cap[1] != move.arr[1])) # e.p. may discover a check
+            if not verify and not (self.evasions & (1 << move.arr[1])):
+                continue # does not parry the check
+            move.make(self.board)
+            if (not verify) or (not self.board.is_attacked(self.board.kings[self.color], \
+                not self.color)):
+                self.move = move
+                return move
+            move.unmake(self.board)
+
+class MultiVisitor:
+    # dispatches every node to several visitors, so that one traversal serves them all
+    def __init__(self, visitors):
+        self.visitors = visitors
+    def visit(self, node, board, side_on_move):
+        for visitor in self.visitors:
+            visitor.visit(node, board, side_on_move)
 
 class Node:
     def __init__(self):
@@ -780,68 +1064,6 @@ class Node:
         pass
     def unmake(self, board):
         pass
-    def parse_solution(self, solution, board, side_to_move, ply_no):
-        self.ply_no = ply_no
-        if solution == '':
-            self.make(board) # to save DPI and properly calc digests
-            self.unmake(board)
-            return '', {}
-        
-        self.make(board)
-        
-        tail, ply = popeye.parse_ply(solution, side_to_move)
-
-        while True:
-            if not ply.has_key('move'):
-                self.unmake(board)
-                return tail, ply
-            if ply.has_key('move_no'):
-                ply['ply_no'] = int(ply['move_no'])*2 - 1
-                if ply['side'] == '...':
-                    ply['ply_no'] = ply['ply_no'] + 1
-            else:
-                ply['ply_no'] = self.ply_no + 1
-            # case 1: our child - create node + recurse
-            if ply['ply_no'] == self.ply_no + 1:
-                for sibling in self.siblings:
-                    if not isinstance(sibling.move, NullMove):
-                        if (sibling.move.dep == ply['move'].dep) and (sibling.move.arr == ply['move'].arr):
-                            tail, ply = sibling.parse_solution(tail, board, side_to_move, ply['ply_no'])
-                            break
-                else:
-                    sibling = MoveNode(ply['move'])
-                    if ply['ply_no'] != 1 and ply['move'].mark == '!':
-                        sibling.is_refutation = True
-                        self.is_try = True
-                    self.siblings.append(sibling)
-                    tail, ply = sibling.parse_solution(tail, board, side_to_move, ply['ply_no'])
-            # case 2: our child via null move (setplay, threat) - create 2 nodes + recurse
-            elif ply['ply_no'] == self.ply_no + 2:
-                sibling = MoveNode(ply['move'])
-                tail, ply = sibling.parse_solution(tail, board, side_to_move, ply['ply_no'])
-                nullnode = None
-                for node in self.siblings:
-                    if isinstance(node.move, NullMove):
-                        nullnode = node
-                        break
-                else:
-                    nullnode = MoveNode(NullMove())
-                    nullnode.ply_no = self.ply_no + 1
-                    self.siblings.append(nullnode)
-                nullnode.siblings.append(sibling)
-                if self.ply_no == 0:
-                    nullnode.is_set = True
-                else:
-                    nullnode.is_threat = True
-            # case 3: not our child - up
-            elif ply['ply_no'] <= self.ply_no:
-                self.unmake(board)
-                return tail, ply
-            else:
-                raise UnsupportedError("Popeye semantics 1")
-        
-        raise UnsupportedError("Popeye semantics 2")
-        
     def dump(self, board, so, self_as_text = ''):
         #if not isinstance(self.move, NullMove):
         #    self.move.disambiguate(board)
@@ -917,6 +1139,80 @@ class Node:
             sibling.traverse(board, visitor)
         self.unmake(board)
 
+class SolutionBuilder:
+    # grows the solution tree of a twin ply by ply, as popeye prints them;
+    # the nodes on the stack are the current line of play and are made on the board
+    def __init__(self, twin, board):
+        self.board = board
+        self.stack = []
+        self.push(twin, 0, None)
+
+    def push(self, node, ply_no, parent):
+        # parent is set for the plies that follow a null move (set play, threats),
+        # such nodes are attached when they are complete
+        node.ply_no = ply_no
+        node.make(self.board)
+        self.stack.append((node, parent))
+
+    def pop(self):
+        node, parent = self.stack.pop()
+        node.unmake(self.board)
+        if parent is None:
+            return
+        for nullnode in parent.siblings:
+            if isinstance(nullnode.move, NullMove):
+                break
+        else:
+            nullnode = MoveNode(NullMove())
+            nullnode.ply_no = parent.ply_no + 1
+            parent.siblings.append(nullnode)
+        nullnode.siblings.append(node)
+        if parent.ply_no == 0:
+            nullnode.is_set = True
+        else:
+            nullnode.is_threat = True
+
+    def add(self, ply):
+        while len(self.stack):
+            node = self.stack[-1][0]
+            if ply.has_key('move_no'):
+                ply['ply_no'] = int(ply['move_no'])*2 - 1
+                if ply['side'] == '...':
+                    ply['ply_no'] = ply['ply_no'] + 1
+            else:
+                ply['ply_no'] = node.ply_no + 1
+            # case 1: our child
+            if ply['ply_no'] == node.ply_no + 1:
+                for sibling in node.siblings:
+                    if not isinstance(sibling.move, NullMove):
+                        if (sibling.move.dep == ply['move'].dep) and (sibling.move.arr == ply['move'].arr):
+                            break
+                else:
+                    sibling = MoveNode(ply['move'])
+                    if ply['ply_no'] != 1 and ply['move'].mark == '!':
+                        sibling.is_refutation = True
+                        node.is_try = True
+                    node.siblings.append(sibling)
+                self.push(sibling, ply['ply_no'], None)
+                return
+            # case 2: our child via null move (setplay, threat)
+            elif ply['ply_no'] == node.ply_no + 2:
+                self.push(MoveNode(ply['move']), ply['ply_no'], node)
+                return
+            # case 3: not our child - up
+            elif ply['ply_no'] <= node.ply_no:
+                self.pop()
+            else:
+                raise UnsupportedError("Popeye semantics 1")
+
+    def complete(self):
+        # a ply that went above the twin ends it, whatever follows is ignored
+        return len(self.stack) == 0
+
+    def close(self):
+        while len(self.stack):
+            self.pop()
+
 class MoveNode(Node):
     def __init__(self, move):
         self.move = move
@@ -976,7 +1272,7 @@ class TwinNode(Node):
                     new_name = [self.arguments[i][1].lower(), self.arguments[i][1].upper()][color==WHITE]
                     for piece, square  in Pieces(board, color):
                         if piece.lower() == self.arguments[i][0].lower():
-                            board.board[square][NAME] = new_name
+                            board.rename(square, new_name)
             if 'add' == self.commands[i]:
                 new_piece = [self.arguments[i][1][0].lower(), self.arguments[i][1][0].upper()][self.arguments[i][1] == 'white']
                 board.add(new_piece, from_xy(self.arguments[i][1][1:]), from_xy(self.arguments[i][1][1:]))
@@ -1106,4 +1402,6 @@ def to_xy(square):
     return 'abcdefgh'[square%8] + '87654321'[int(square/8)]
 
 
-LUT = LookupTables()
+LUT = LazyLookupTables()
+
+TT = TranspositionTable()
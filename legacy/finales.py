@@ -1,4 +1,4 @@
-import chess, copy, common
+import chess, copy, common, analysis
 
 
 
@@ -153,8 +153,20 @@ def provides():
             'Octet', 'Models with pin', 'Models with two pins', 'Models with three pins']
 
 def check(problem, board, solution):
-    visitor = FinalesVisitor()
-    solution.traverse(board, visitor)
+    return analysis.run(board, solution, [Analyzer(problem)])
+
+class Analyzer:
+    def __init__(self, problem):
+        self.problem = problem
+        self.visitor = FinalesVisitor()
+    def visitors(self, twin, keyplay):
+        return [self.visitor], []
+    def twin_done(self, twin, board):
+        pass
+    def result(self, board):
+        return evaluate(self.problem, board, self.visitor)
+
+def evaluate(problem, board, visitor):
     if len(visitor.by_hash) > 0:
         problem['pure-finales'] = [key for key in visitor.by_hash]
     retval = {}
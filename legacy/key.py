@@ -1,51 +1,63 @@
-import common, chess
+import common, chess, analysis
+
+def provides():
+    return ['Checking key', 'Withdrawal key', 'Flight giving key', 'Flight giving key(2)',
+        'Flight giving key(3)', 'Flight giving key(4)', 'Flight giving key(5)', 'Flight giving key(6+)',
+        'Flight taking key', 'Flight taking key(2)', 'Flight taking key(3)', 'Flight taking key(4)',
+        'Flight taking key(5)', 'Flight taking key(6)', 'Flight giving and taking key']
 
 def check(problem, board, solution):
-    retval = common.retval(provides)
-    
-    for twin in solution.siblings:
-        if not twin.stipulation.style in ['', 's', 'r']:
-            continue
-        twin.make(board)
-        keyplay = twin.keyplay()
-        fb = get_flights(board) # flights before key
-        for key in keyplay.siblings:
-            # check
-            if key.move.is_check:
-                retval['Checking key'] = True
-            # withdrawal
-            if twin.stipulation.style == '' and key.move.dep[0] <> 'P':
-                (kx, ky) = chess.LookupTables.to_xy(board.kings[chess.BLACK])
-                (bx, by) = chess.LookupTables.to_xy(key.move.dep[1])
-                (ax, ay) = chess.LookupTables.to_xy(key.move.arr[1])
-                distance_diff = ((ax-kx)**2 + (ay-ky)**2) - ((bx-kx)**2 + (by-ky)**2) 
-                retval['Withdrawal key'] |= distance_diff > 3
-            # flights
-            key.make(board)
-            fa = get_flights(board) # flights after key
-            key.unmake(board)
-            
-            diff = fa.count_set_bits() - fb.count_set_bits() 
-            
-            retval['Flight giving key'] |= diff > 0
-            retval['Flight giving key(2)'] |= diff > 1
-            retval['Flight giving key(3)'] |= diff > 2
-            retval['Flight giving key(4)'] |= diff > 3
-            retval['Flight giving key(5)'] |= diff > 4
-            retval['Flight giving key(6+)'] |= diff > 5
+    return analysis.run(board, solution, [Analyzer(problem)])
+
+class Analyzer:
+    # needs no traversal, the keys are examined with the twin position on the board
+    def __init__(self, problem):
+        self.retval = common.retval(provides)
+    def visitors(self, twin, keyplay):
+        return [], []
+    def twin_done(self, twin, board):
+        if twin.stipulation.style in ['', 's', 'r']:
+            examine_keys(twin, board, self.retval)
+    def result(self, board):
+        return self.retval
 
-            retval['Flight taking key'] |= diff < 0
-            retval['Flight taking key(2)'] |= diff < -1
-            retval['Flight taking key(3)'] |= diff < -2
-            retval['Flight taking key(4)'] |= diff < -3
-            retval['Flight taking key(5)'] |= diff < -4
-            retval['Flight taking key(6)'] |= diff < -5
+def examine_keys(twin, board, retval):
+    keyplay = twin.keyplay()
+    fb = get_flights(board) # flights before key
+    for key in keyplay.siblings:
+        # check
+        if key.move.is_check:
+            retval['Checking key'] = True
+        # withdrawal
+        if twin.stipulation.style == '' and key.move.dep[0] <> 'P':
+            (kx, ky) = chess.LookupTables.to_xy(board.kings[chess.BLACK])
+            (bx, by) = chess.LookupTables.to_xy(key.move.dep[1])
+            (ax, ay) = chess.LookupTables.to_xy(key.move.arr[1])
+            distance_diff = ((ax-kx)**2 + (ay-ky)**2) - ((bx-kx)**2 + (by-ky)**2) 
+            retval['Withdrawal key'] |= distance_diff > 3
+        # flights
+        key.make(board)
+        fa = get_flights(board) # flights after key
+        key.unmake(board)
+        
+        diff = fa.count_set_bits() - fb.count_set_bits() 
+        
+        retval['Flight giving key'] |= diff > 0
+        retval['Flight giving key(2)'] |= diff > 1
+        retval['Flight giving key(3)'] |= diff > 2
+        retval['Flight giving key(4)'] |= diff > 3
+        retval['Flight giving key(5)'] |= diff > 4
+        retval['Flight giving key(6+)'] |= diff > 5
 
-            retval['Flight giving and taking key'] |= (not ((fb ^ fa) & fa).is_zero()) and \
-                                        (not ((fb ^ fa) & fb).is_zero())
-        twin.unmake(board)
+        retval['Flight taking key'] |= diff < 0
+        retval['Flight taking key(2)'] |= diff < -1
+        retval['Flight taking key(3)'] |= diff < -2
+        retval['Flight taking key(4)'] |= diff < -3
+        retval['Flight taking key(5)'] |= diff < -4
+        retval['Flight taking key(6)'] |= diff < -5
 
-    return retval
+        retval['Flight giving and taking key'] |= (not ((fb ^ fa) & fa).is_zero()) and \
+                                    (not ((fb ^ fa) & fb).is_zero())
 
 # returns the BitBoard with black king flight squares 
 def get_flights(board):
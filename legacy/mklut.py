@@ -0,0 +1,44 @@
+# generates lut.bin, the precomputed chess.LookupTables
+# usage:
+#   python mklut.py [filename]          - (re)generate the file
+#   python mklut.py --check [filename]  - verify that the file equals the computed tables
+
+import sys
+import chess
+
+def same_tables(a, b):
+    for piece in chess.PIECES:
+        if [bb.bits for bb in a.att[piece]] != [bb.bits for bb in b.att[piece]]:
+            return False
+        if a.mov[piece] != b.mov[piece]:
+            return False
+    if a.btw_bits != b.btw_bits:
+        return False
+    return a.attackers == b.attackers
+
+def main(args):
+    check = '--check' in args
+    args = [x for x in args if x != '--check']
+    filename = chess.LUT_FILE
+    if len(args):
+        filename = args[0]
+
+    computed = chess.LookupTables(None)
+    if not check:
+        f = open(filename, 'wb')
+        f.write(computed.pack())
+        f.close()
+        print "written", filename
+
+    loaded = chess.LookupTables(filename)
+    if not loaded.precomputed:
+        print filename, "is missing, outdated or corrupt"
+        return 1
+    if not same_tables(computed, loaded):
+        print filename, "differs from the computed tables"
+        return 1
+    print filename, "ok"
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -57,106 +57,77 @@ RE_PY_CONT = re.compile('^Cont(inued)?', re.IGNORECASE)
 RE_PY_STIP = re.compile('^(?P<style>h|s|r|(hs)|())(?P<aim>[#=])(?P<movecount>[0-9\.]+)$', re.IGNORECASE)
 
 # regular expressions to parse popeye output
-RE_PY_MOVEHEAD = re.compile('^(?P<moveno>[0-9]+)(?P<side>\.+)')
-RE_PY_REGULARMOVE = re.compile('^(?P<dep_piece>[KQRBS]?)(?P<dep_square>[a-h][1-8])(?P<cap_mod>[\-\*])(?P<arr_square>[a-h][1-8])')
-RE_PY_PROMOTION = re.compile('^(?P<dep_square>[a-h][1-8])(?P<cap_mod>[\-\*])(?P<arr_square>[a-h][1-8])=(?P<promotion>[QRBS])')
-RE_PY_CASTLING = re.compile('^(?P<castling>0-0(-0)?)')
-RE_PY_EPCAPTURE = re.compile('^(?P<dep_square>[a-h][1-8])\*(?P<arr_square>[a-h][1-8]) ep\.')
-RE_PY_MOVETAIL = re.compile('^(?P<checkstalemate>[\+=#])?( +)?(?P<mark>[!?]?)')
 RE_PY_TWINSTART = re.compile('^\+?(?P<twin_id>[a-z])\)(?P<twin_descr>.*)')
-RE_PY_TRASH = re.compile('^\s*(zugzwang\.)|(threat:)|(but)\s*')
+# the solution text is scanned with a single expression that matches one ply with
+# everything in front of it, so that the text is never copied while it is consumed
+RE_PY_TRASH = re.compile('\s*((zugzwang\.|threat:|but)\s*)*')
+RE_PY_PLY = re.compile(RE_PY_TRASH.pattern +
+    '((?P<moveno>[0-9]+)(?P<side>\.+)\s*)?(' +
+    # promotion and ep must be tried before regular move
+    '(?P<promotion_dep>[a-h][1-8])[\-\*](?P<promotion_arr>[a-h][1-8])=(?P<promotion>[QRBS])|' +
+    '(?P<ep_dep>[a-h][1-8])\*(?P<ep_arr>[a-h][1-8]) ep\.|' +
+    '(?P<dep_piece>[KQRBS]?)(?P<dep_square>[a-h][1-8])[\-\*](?P<arr_square>[a-h][1-8])|' +
+    '(?P<castling>0-0(-0)?))' +
+    '\s*(?P<checkstalemate>[\+=#])?( +)?(?P<mark>[!?]?)')
 
-def parse_ply_tail(ply, text):
-    m = RE_PY_MOVETAIL.match(text)
-    ply['move'].mark = m.group('mark')
-    if m.group('checkstalemate') == '+':
-        ply['move'].is_check = True
-    if m.group('checkstalemate') == '#':
-        ply['move'].is_check, ply['move'].is_mate = True, True
-    if m.group('checkstalemate') == '=':
-        ply['move'].is_stalemate = True
-    text = re.sub(RE_PY_MOVETAIL, '', text).strip()
-    return text, ply 
+# (castling, white): king, king squares, rook squares
+CASTLINGS = {
+    ('0-0', True): ('K', 'e1', 'g1', 'h1', 'f1'),
+    ('0-0', False): ('k', 'e8', 'g8', 'h8', 'f8'),
+    ('0-0-0', True): ('K', 'e1', 'c1', 'a1', 'd1'),
+    ('0-0-0', False): ('k', 'e8', 'c8', 'a8', 'd8')}
 
-# actual solution. That is black in helpmates and white otherwise
+def is_trash(text, pos):
+    return RE_PY_TRASH.match(text, pos).end() == len(text)
+
+# text - popeye output, pos - where to start scanning
 # side_to_move - side which is on move on the first ply of the
-def parse_ply(text, side_to_move):
-    
-    ply, text = {}, re.sub(RE_PY_TRASH, '', text).strip()
+# actual solution. That is black in helpmates and white otherwise
+# returns the position after the ply and the ply
+def parse_ply(text, pos, side_to_move):
+    m = RE_PY_PLY.match(text, pos)
+    if not m:
+        text = text[RE_PY_TRASH.match(text, pos).end():]
+        raise ParseError("Can't match next ply:\n%s" % "\n".join(text.split("\n")[:3]))
 
-    m = RE_PY_MOVEHEAD.match(text)
-    if m:
-        ply['move_no'], ply['side'] = m.group('moveno'), m.group('side')
-        text = re.sub(RE_PY_MOVEHEAD, '', text).strip()
-    else:
+    ply = {}
+    if m.group('moveno') is None:
         ply['side'] = '...'
+    else:
+        ply['move_no'], ply['side'] = m.group('moveno'), m.group('side')
     side_to_move = [chess.BLACK, chess.WHITE][((side_to_move == chess.WHITE) and (ply['side'] == '.')) \
             or ((side_to_move == chess.BLACK) and (ply['side'] == '...'))]
+    pawn = 'pP'[side_to_move == chess.WHITE]
 
-    
-
-    m = RE_PY_PROMOTION.match(text)
-    if m:
-        dep_square = chess.from_xy(m.group('dep_square'))
-        arr_square = chess.from_xy(m.group('arr_square'))
-        dep_piece = 'pP'[side_to_move == chess.WHITE]
+    if not m.group('promotion') is None:
         arr_piece = [m.group('promotion').lower(), m.group('promotion')][side_to_move == chess.WHITE]
-        capture = ('', -1)
-        ply['move'] = chess.Move((dep_piece, dep_square), (arr_piece, arr_square), capture)
-        text = re.sub(RE_PY_PROMOTION, '', text).strip()
-        return parse_ply_tail(ply, text) 
-
-    #RE_PY_EPCAPTURE = re.compile('^(?P<dep_square>[a-h][1-8])\*(?P<arr_square>[a-h][1-8]) ep\.')
-    # ep must be tried befor reg move
-    m = RE_PY_EPCAPTURE.match(text)
-    if m:
-        dep_square = chess.from_xy(m.group('dep_square'))
-        arr_square = chess.from_xy(m.group('arr_square'))
-        dep_piece = 'pP'[side_to_move == chess.WHITE]
-        arr_piece = dep_piece
+        move = chess.Move((pawn, chess.from_xy(m.group('promotion_dep'))), \
+            (arr_piece, chess.from_xy(m.group('promotion_arr'))), ('', -1))
+    elif not m.group('ep_dep') is None:
+        dep_square = chess.from_xy(m.group('ep_dep'))
+        arr_square = chess.from_xy(m.group('ep_arr'))
         capture = ('pP'[side_to_move == chess.BLACK], chess.LookupTables.ep(dep_square, arr_square))
-        ply['move'] = chess.Move((dep_piece, dep_square), (arr_piece, arr_square), capture)
-        text = re.sub(RE_PY_EPCAPTURE, '', text).strip()
-        return parse_ply_tail(ply, text) 
-        
-    m = RE_PY_REGULARMOVE.match(text)
-    if m:
-        dep_square = chess.from_xy(m.group('dep_square'))
-        arr_square = chess.from_xy(m.group('arr_square'))
+        move = chess.Move((pawn, dep_square), (pawn, arr_square), capture)
+    elif not m.group('dep_square') is None:
         dep_piece = [m.group('dep_piece'), 'P'][m.group('dep_piece') == '']
         dep_piece = [dep_piece.lower(), dep_piece][side_to_move == chess.WHITE]
-        arr_piece = dep_piece
-        capture = ('', -1)
-        ply['move'] = chess.Move((dep_piece, dep_square), (arr_piece, arr_square), capture)
-        text = re.sub(RE_PY_REGULARMOVE, '', text).strip()
-        return parse_ply_tail(ply, text) 
-
-    m = RE_PY_CASTLING.match(text)
-    if m:
-        if m.group('castling') == '0-0':
-            if side_to_move == chess.BLACK:
-                ply['move'] = chess.Move(('k', chess.from_xy('e8')), ('k', chess.from_xy('g8')), ('', -1))
-                ply['move'].is_castling, ply['move'].rook_before, ply['move'].rook_after = \
-                    True, chess.from_xy('h8'), chess.from_xy('f8') 
-            else:
-                ply['move'] = chess.Move(('K', chess.from_xy('e1')), ('K', chess.from_xy('g1')), ('', -1))
-                ply['move'].is_castling, ply['move'].rook_before, ply['move'].rook_after = \
-                    True, chess.from_xy('h1'), chess.from_xy('f1') 
-        else:
-            if side_to_move == chess.BLACK:
-                ply['move'] = chess.Move(('k', chess.from_xy('e8')), ('k', chess.from_xy('c8')), ('', -1))
-                ply['move'].is_castling, ply['move'].rook_before, ply['move'].rook_after = \
-                    True, chess.from_xy('a8'), chess.from_xy('d8') 
-            else:
-                ply['move'] = chess.Move(('K', chess.from_xy('e1')), ('K', chess.from_xy('c1')), ('', -1))
-                ply['move'].is_castling, ply['move'].rook_before, ply['move'].rook_after = \
-                    True, chess.from_xy('a1'), chess.from_xy('d1')         
-        text = re.sub(RE_PY_CASTLING, '', text).strip()
-        return parse_ply_tail(ply, text) 
-
-
+        move = chess.Move((dep_piece, chess.from_xy(m.group('dep_square'))), \
+            (dep_piece, chess.from_xy(m.group('arr_square'))), ('', -1))
+    else:
+        king, dep, arr, rook_before, rook_after = CASTLINGS[(m.group('castling'), side_to_move == chess.WHITE)]
+        move = chess.Move((king, chess.from_xy(dep)), (king, chess.from_xy(arr)), ('', -1))
+        move.is_castling, move.rook_before, move.rook_after = \
+            True, chess.from_xy(rook_before), chess.from_xy(rook_after)
 
-    raise ParseError("Can't match next ply:\n%s" % "\n".join(text.split("\n")[:3]))
+    move.mark = m.group('mark')
+    if m.group('checkstalemate') == '+':
+        move.is_check = True
+    if m.group('checkstalemate') == '#':
+        move.is_check, move.is_mate = True, True
+    if m.group('checkstalemate') == '=':
+        move.is_stalemate = True
+    ply['move'] = move
+    return m.end(), ply
 
 def is_py_option(option):
     for pattern in RE_PY_OPTIONS:
@@ -197,42 +168,127 @@ def create_input(problem, sstip, sticky, pieces_clause):
     return "\n".join(lines)
 
 def parse_output(problem, output):
-    # removing popeye header (version) and footer (solving time)
-    lines = output.strip().split("\n")
-    if len(lines) < 2:
-        raise ParseError("Output too short")
-    lines = lines[1:-1]
-    
-    # parsing twins
-    if problem.has_key('twins'):
-        is_zero = ('a' == sorted(problem['twins'].keys())[0])
-        twins, twin_re, acc, cur_twin_id = {}, re.compile(RE_PY_TWINSTART), [], ''
-        for line in lines:
-            m = twin_re.match(line)
-            if m:
-                if cur_twin_id <> '':
-                    twins[cur_twin_id] = "\n".join(acc)
-                cur_twin_id, acc = m.group('twin_id'), []
+    parser = OutputParser(problem)
+    parser.feed(output)
+    return parser.close()
+
+class OutputParser:
+    # parses popeye output chunk by chunk as it arrives, the solution tree grows
+    # with every complete line, so that it is ready as soon as popeye exits
+    def __init__(self, problem):
+        self.problem = problem
+        self.root = chess.Node()
+        self.board = chess.Board()
+        self.partial = '' # incomplete last line
+        self.header_seen = False
+        # the last non-empty line is the footer (solving time) unless more follows
+        self.last, self.blanks = None, []
+        # with twins, lines before the first twin marker are kept in case there are no markers at all
+        self.preamble = []
+        self.twin, self.prev_twin, self.builder, self.text, self.pos = None, None, None, '', 0
+        self.error, self.closed = None, False
+        try:
+            self.board.from_algebraic(problem['algebraic'])
+            if not problem.has_key('twins'):
+                self.start_twin('a')
+        except (ParseError, chess.UnsupportedError), e:
+            self.error = e
+
+    def feed(self, data):
+        if not self.error is None:
+            return
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        try:
+            for line in lines:
+                self.add_line(line)
+        except (ParseError, chess.UnsupportedError), e:
+            self.error = e
+
+    def close(self):
+        # returns the root of the solution tree, raises ParseError, chess.UnsupportedError
+        if not self.error is None:
+            raise self.error
+        if self.closed:
+            return self.root
+        try:
+            if self.partial != '':
+                self.add_line(self.partial)
+                self.partial = ''
+            if self.last is None:
+                raise ParseError("Output too short")
+            self.last, self.blanks = None, []
+            if (self.twin is None) and not self.preamble is None:
+                self.start_twin('')
+                for line in self.preamble:
+                    self.parse_line(line)
+            self.finish_twin()
+        except (ParseError, chess.UnsupportedError), e:
+            self.error = e
+            raise
+        self.closed = True
+        return self.root
+
+    def add_line(self, line):
+        # removing popeye header (version) and footer (solving time)
+        if not self.header_seen:
+            self.header_seen = line.strip() != ''
+        elif line.strip() == '':
+            if self.last is None:
+                self.parse_line(line)
             else:
-                acc.append(line)
-        twins[cur_twin_id] = "\n".join(acc)
-    else:
-        twins = {'a':"\n".join(lines)}
-    
-    root = chess.Node()
-    b = chess.Board()
-    b.from_algebraic(problem['algebraic'])
-    prev_twin = None
-    for k in sorted(twins.keys()):
-        if problem.has_key('twins') and problem['twins'].has_key(k):
-            twin = chess.TwinNode(k, problem['twins'][k], prev_twin, problem)
+                self.blanks.append(line)
+        else:
+            if not self.last is None:
+                for held in [self.last] + self.blanks:
+                    self.parse_line(held)
+            self.last, self.blanks = line, []
+
+    def parse_line(self, line):
+        if self.problem.has_key('twins'):
+            m = RE_PY_TWINSTART.match(line)
+            if m:
+                self.finish_twin()
+                self.preamble = None
+                self.start_twin(m.group('twin_id'))
+                return
+            if self.twin is None:
+                self.preamble.append(line)
+                return
+        self.text = self.text + line + "\n"
+        self.parse_text(False)
+
+    def parse_text(self, final):
+        # the text holds complete lines only, and no ply spans lines
+        while True:
+            if self.builder.complete():
+                self.text, self.pos = '', 0
+                return
+            if is_trash(self.text, self.pos):
+                if final:
+                    self.text, self.pos = '', 0
+                else: # only the unparsed rest is kept
+                    self.text, self.pos = self.text[self.pos:], 0
+                return
+            self.pos, ply = parse_ply(self.text, self.pos, self.side_to_move)
+            self.builder.add(ply)
+
+    def start_twin(self, id):
+        if self.problem.has_key('twins') and self.problem['twins'].has_key(id):
+            self.twin = chess.TwinNode(id, self.problem['twins'][id], self.prev_twin, self.problem)
         else:
-            twin = chess.TwinNode(k, '', prev_twin, problem)
-        twin.parse_solution(twins[k], b, twin.stipulation.side_to_move(), 0)
-        twin.calculate_digest()
-        root.siblings.append(twin)
-        prev_twin = twin
-    return root
+            self.twin = chess.TwinNode(id, '', self.prev_twin, self.problem)
+        self.side_to_move = self.twin.stipulation.side_to_move()
+        self.builder = chess.SolutionBuilder(self.twin, self.board)
+
+    def finish_twin(self):
+        if self.twin is None:
+            return
+        self.parse_text(True)
+        self.builder.close()
+        self.twin.calculate_digest()
+        self.root.siblings.append(self.twin)
+        self.prev_twin, self.twin, self.builder, self.text, self.pos = self.twin, None, None, '', 0
 
 def parse_twin(text):
     is_continued, commands, arguments = False, [], []
@@ -1,4 +1,4 @@
-import common, chess
+import common, chess, analysis
 
 def provides():
     return ['Unsound', 'Shortmate', 'Cooked', 'Has duals']
@@ -6,38 +6,32 @@ def provides():
 
 # todo: h#*.5 with setplay
 def check(problem, board, solution):
-    retval = common.retval(provides)
-    
-    for twin in solution.siblings:
-        twin.make(board)
+    return analysis.run(board, solution, [Analyzer(problem)])
 
-        if problem.has_key('intended-solutions'):
-            intended = IntendedSolutions(problem['intended-solutions'], twin.stipulation)
+class Analyzer:
+    def __init__(self, problem):
+        self.problem = problem
+        self.retval = common.retval(provides)
+    
+    def visitors(self, twin, keyplay):
+        if self.problem.has_key('intended-solutions'):
+            intended = IntendedSolutions(self.problem['intended-solutions'], twin.stipulation)
         else:
             intended = IntendedSolutions('1', twin.stipulation)
-            
-        keyplay = twin.keyplay()
-        
-        visitor = MaxPlyVisitor()
-        keyplay.traverse(board, visitor)
-        if visitor.max_ply < twin.stipulation.ply_count:
-            retval['Shortmate'] = True
-
-        iv = IntendedVisitor(intended)
-        keyplay.traverse(board, iv)        
+        self.twin_visitors = (MaxPlyVisitor(), IntendedVisitor(intended))
+        # keyplay is a plain Node, so threats are skipped below the root regardless of
+        # with_threats, one IntendedVisitor is enough for all the keywords including duals
+        return [], list(self.twin_visitors)
+    
+    def twin_done(self, twin, board):
+        mpv, iv = self.twin_visitors
+        if mpv.max_ply < twin.stipulation.ply_count:
+            self.retval['Shortmate'] = True
         for k in iv.retval:
-            if k <> 'Has duals':
-                retval[k] = retval[k] or iv.retval[k]
-            
-        # skip duals in threats
-        iv = IntendedVisitor(intended)
-        keyplay.traverse(board, iv, with_threats = False)
-        retval['Has duals'] |= iv.retval['Has duals']
-                
-
-        twin.unmake(board)
-
-    return retval
+            self.retval[k] = self.retval[k] or iv.retval[k]
+        
+    def result(self, board):
+        return self.retval
 
 class IntendedSolutions:
     def __init__(self, str, stipulation):
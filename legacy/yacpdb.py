@@ -1,24 +1,28 @@
-import popeye, finales, chess, soundness, key, trajectories
+import popeye, finales, chess, soundness, key, trajectories, analysis
 
 VERSION = '2010-10-28'
 
-def process(problem):
-    retval = {'version':VERSION, 'status':'unsupported', 'ash':problem['ash']}
+def keywords(problem, board, solution):
+    # finales, soundness and key share a single traversal of the solution tree,
+    # trajectories build their own tree of piece routes
+    found = analysis.run(board, solution, \
+        [module.Analyzer(problem) for module in [finales, soundness, key]])
+    found.update(trajectories.check(problem, board, solution))
+    return sorted([k for k in found if found[k]])
+
+def process(problem, output):
+    # output is what popeye printed for popeye.create_input(problem, ...)
+    retval = {'version':VERSION, 'status':'unsupported', 'ash':problem.get('ash', ''), 'raw':output}
+
+    solution = popeye.parse_output(problem, output) # todo: try/catch
 
-    retval['raw'] = popeye.run(popeye.create_input(problem)) # todo: try/catch
-    solution = popeye.parse_output(problem, retval['raw']) # todo: try/catch
-    
     output = chess.SolutionOutput(True)
     b = chess.Board()
     b.from_algebraic(problem['algebraic'])
-    output.create_output(solution, b)    
+    output.create_output(solution, b)
     retval['status'] = 'ok'
 
-    retval['olive'] = {'solution':output.solution, 'boardshots':output.boardshots, 'keywords':[]}
-    for module in [finales, soundness, key, trajectories]:
-        x = module.check(problem, b, solution)
-        for k in x:
-            if x[k]: retval['olive']['keywords'].append(k)
-    
-    
-    return retval
\ No newline at end of file
+    retval['olive'] = {'solution':output.solution, 'boardshots':output.boardshots, \
+        'keywords':keywords(problem, b, solution)}
+
+    return retval
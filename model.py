@@ -12,11 +12,29 @@ import yaml
 # local
 import legacy.popeye
 import legacy.chess
+import patterns
 
 COLORS = ['black', 'white',  'neutral']
+ORTHODOX = ['K', 'Q', 'R', 'B', 'S', 'P'] # as in Piece.toAlgebraic, see hasFairyPieces
 FAIRYSPECS = ['Chameleon', 'Jigger', 'Kamikaze', 'Paralysing', \
     'Royal', 'Volage', 'Functionary', 'HalfNeutral', \
     'HurdleColourChanging', 'Protean', 'Magic', 'Uncapturable']
+SAME_COLORS = {'white':'white', 'black':'black', 'neutral':'neutral'}
+INVERTED_COLORS = {'white':'black', 'black':'white', 'neutral':'neutral'}
+
+# (x, y) -> (x, y) of Board.transform
+rot90 = lambda (x, y):  (y, 7-x)
+ROTATIONS = {'90': rot90, \
+            '180':lambda (x, y): rot90(rot90((x, y))), \
+            '270':lambda (x, y): rot90(rot90(rot90((x, y)))), }
+MIRRORS = {'a1<-->h1':lambda (x, y): (7-x, y), \
+            'a1<-->a8': lambda (x, y): (x, 7-y), \
+            'a1<-->h8': lambda (x, y): (y, x), \
+            'h1<-->a8': lambda (x, y): (7-y, 7-x)}
+# the identity first, then the other rotations and reflections
+SYMMETRIES = [lambda (x, y): (x, y)] + \
+    [ROTATIONS[key] for key in sorted(ROTATIONS.keys())] + \
+    [MIRRORS[key] for key in sorted(MIRRORS.keys())]
 
 def algebraicToIdx(a1):
     return ord(a1[0]) - ord('a') + 8*(7 + ord('1') - ord(a1[1]))
@@ -35,6 +53,31 @@ def myint(string):
     except exceptions.ValueError:
         return 0
 
+def countPieces(algebraic):
+    # same as Board.getPiecesCount() but without building the board
+    counts = {}
+    for color in COLORS:
+        counts[color] = 0
+        if algebraic.has_key(color):
+            counts[color] = len(algebraic[color])
+    retval = str(counts['white']) + '+' + str(counts['black'])
+    if(counts['neutral'] > 0):
+        retval = retval + '+' + str(counts['neutral'])
+    return retval
+
+def summarize(e):
+    # lightweight overview row data, enough to display an entry without keeping it parsed
+    retval = {}
+    retval['authors'] = u''
+    if e.has_key('authors'):
+        retval['authors'] = u'; '.join(e['authors'])
+    for key in ['source', 'date', 'distinction', 'stipulation']:
+        retval[key] = u''
+        if e.has_key(key):
+            retval[key] = unicode(e[key])
+    retval['pieces'] = countPieces(e.get('algebraic', {}))
+    return retval
+
 def notEmpty(hash, key):
     if not hash.has_key(key):
         return False
@@ -59,33 +102,37 @@ def makePieceFromXfen(fen):
 class FairyHelper:
     defaults, overrides, glyphs, fontinfo = {}, {}, {}, {}
     options, conditions = [], []
-    f = open('conf/fairy-pieces.txt')
-    for entry in map(lambda x: x.strip().split("\t"), f.readlines()):
-        glyphs[entry[0]] =  {'name': entry[1]}
-        if len(entry) > 2:
-            if '' <> entry[2].strip():
-                glyphs[entry[0]]['glyph'] = entry[2]
+
+    def read():
+        # invoked once on startup, after the working directory is set
+        f = open('conf/fairy-pieces.txt')
+        for entry in map(lambda x: x.strip().split("\t"), f.readlines()):
+            FairyHelper.glyphs[entry[0]] =  {'name': entry[1]}
+            if len(entry) > 2:
+                if '' <> entry[2].strip():
+                    FairyHelper.glyphs[entry[0]]['glyph'] = entry[2]
+                else:
+                    FairyHelper.glyphs[entry[0]]['glyph'] = 'x'
             else:
-                glyphs[entry[0]]['glyph'] = 'x'
-        else:
-            glyphs[entry[0]]['glyph'] = 'x'
-        if len(entry) > 3:
-            if 'd' == entry[3]:
-                defaults[entry[2]] = entry[0]
-    f.close()
-
-    f = open('resources/fonts/xfen.txt')
-    for entry in map(lambda x: x.strip().split("\t"), f.readlines()):
-        fontinfo[entry[0]] = {'family':entry[1], 'chars':[chr(int(entry[2])), chr(int(entry[3]))]}
-    f.close()
-
-    f = open('conf/py-options.txt')
-    options = map(lambda x: x.strip(), f.readlines())
-    f.close()
-
-    f = open('conf/py-conditions.txt')
-    conditions = map(lambda x: x.strip(), f.readlines())
-    f.close()
+                FairyHelper.glyphs[entry[0]]['glyph'] = 'x'
+            if len(entry) > 3:
+                if 'd' == entry[3]:
+                    FairyHelper.defaults[entry[2]] = entry[0]
+        f.close()
+
+        f = open('resources/fonts/xfen.txt')
+        for entry in map(lambda x: x.strip().split("\t"), f.readlines()):
+            FairyHelper.fontinfo[entry[0]] = {'family':entry[1], 'chars':[chr(int(entry[2])), chr(int(entry[3]))]}
+        f.close()
+
+        f = open('conf/py-options.txt')
+        FairyHelper.options = map(lambda x: x.strip(), f.readlines())
+        f.close()
+
+        f = open('conf/py-conditions.txt')
+        FairyHelper.conditions = map(lambda x: x.strip(), f.readlines())
+        f.close()
+    read = staticmethod(read)
     
 class Distinction:
     suffixes = ['th', 'st', 'nd', 'rd', 'th', 'th', 'th', 'th', 'th', 'th']
@@ -160,6 +207,24 @@ class Distinction:
         return retval
     fromString = staticmethod(fromString)
     
+class EntrySummary:
+    def __init__(self, summary):
+        self.authors = summary['authors']
+        self.source = summary['source']
+        self.date = summary['date']
+        self.stipulation = summary['stipulation']
+        self.pieces = summary['pieces']
+        self.distinction = None
+        if summary['distinction'] != '':
+            self.distinction = Distinction.fromString(summary['distinction'])
+        self.localized = {} # language -> distinction text
+    def distinctionInLang(self, Lang):
+        if self.distinction is None:
+            return ''
+        if not self.localized.has_key(Lang.current):
+            self.localized[Lang.current] = self.distinction.toStringInLang(Lang)
+        return self.localized[Lang.current]
+
 class Piece:
     def __init__(self, name, color, specs):
         self.name, self.color, self.specs = name, color, sorted(specs)
@@ -254,18 +319,10 @@ class Board:
         return retval
         
     def rotate(self, angle):
-        rot90 = lambda (x, y):  (y, 7-x)
-        transform = {'90': rot90, \
-                    '180':lambda (x, y): rot90(rot90((x, y))), \
-                    '270':lambda (x, y): rot90(rot90(rot90((x, y)))), }
-        self.transform(transform[angle])
+        self.transform(ROTATIONS[angle])
         
     def mirror(self, axis):
-        transform = {'a1<-->h1':lambda (x, y): (7-x, y), \
-                    'a1<-->a8': lambda (x, y): (x, 7-y), \
-                    'a1<-->h8': lambda (x, y): (y, x), \
-                    'h1<-->a8': lambda (x, y): (7-y, 7-x)}
-        self.transform(transform[axis])
+        self.transform(MIRRORS[axis])
 
     def shift(self, x, y):
         self.transform(lambda (a, b): (x+a, y+b))
@@ -281,9 +338,8 @@ class Board:
     def invertColors(self):
         b = copy.deepcopy(self)
         self.clear()
-        colors_map = {'white':'black', 'black':'white', 'neutral':'neutral'}
         for square, piece in Pieces(b):
-            self.add(Piece(piece.name, colors_map[piece.color], piece.specs), square)
+            self.add(Piece(piece.name, INVERTED_COLORS[piece.color], piece.specs), square)
                  
     def fromFen(self, fen):
         self.clear()
@@ -446,21 +502,82 @@ class Model:
         finally:
             f.close()
         self.current, self.entries, self.dirty_flags, self.board = -1, [], [],  Board()
-        self.pieces_counts = []
+        self.pieces_counts, self.summaries = [], []
+        self.tensor = None # positiontensor.PositionTensor, None - not built yet
+        self.occupancies = []
+        self.parse_errors = [] # yaml.YAMLError of the entries that could not be parsed, see setNewCurrent
         self.add(copy.deepcopy(self.defaultEntry),  False)
         self.is_dirty = False
         self.filename = '';
     
+    def load(self, entries):
+        # entries is a list-like container, e.g. storage.LazyEntries
+        self.entries = entries
+        self.dirty_flags = [False] * len(entries)
+        self.pieces_counts = [None] * len(entries) # None - not calculated yet
+        if hasattr(entries, 'piecesCount'):
+            self.pieces_counts = [entries.piecesCount(idx) for idx in xrange(len(entries))]
+        self.summaries = [None] * len(entries) # EntrySummary, None - not calculated yet
+        self.tensor = None
+        self.occupancies = [None] * len(entries) # patterns.Occupancy, None - not calculated yet
+        self.is_dirty = False
+        self.current = -1
+        if len(entries) > 0:
+            self.setNewCurrent(len(entries) - 1)
+
     def cur(self):
         return self.entries[self.current]
+
+    def positions(self):
+        # for the collection-wide queries, None if numpy is not installed
+        import positiontensor # numpy is loaded on first use only
+        if self.tensor is None and positiontensor.available():
+            self.tensor = positiontensor.PositionTensor()
+            self.tensor.build([self.algebraic(idx) for idx in xrange(len(self.entries))])
+        return self.tensor
+
+    def occupancy(self, idx):
+        if self.occupancies[idx] is None:
+            self.occupancies[idx] = patterns.Occupancy(self.algebraic(idx))
+        return self.occupancies[idx]
+
+    def algebraic(self, idx):
+        # the entries that were not loaded yet are not kept parsed
+        if hasattr(self.entries, 'isParsed') and not self.entries.isParsed(idx):
+            try:
+                return self.entries.parse(idx).get('algebraic', {})
+            except yaml.YAMLError:
+                return {} # reported when the entry becomes current, see setNewCurrent
+        return self.entries[idx].get('algebraic', {})
+
+    def summary(self, idx):
+        if self.summaries[idx] is None:
+            if hasattr(self.entries, 'isParsed') and not self.entries.isParsed(idx):
+                # the collection file index keeps summaries of the entries that were not loaded yet
+                self.summaries[idx] = EntrySummary(self.entries.summary(idx))
+            else:
+                self.summaries[idx] = EntrySummary(summarize(self.entries[idx]))
+            if self.pieces_counts[idx] is None:
+                self.pieces_counts[idx] = self.summaries[idx].pieces
+        return self.summaries[idx]
     
     def setNewCurrent(self,  idx):
+        try:
+            entry = self.entries[idx]
+        except yaml.YAMLError, e:
+            # a lazily loaded document that is not valid YAML stands as an empty entry,
+            # it is saved as it is unless the entry is edited
+            entry = makeSafe(None)
+            self.entries[idx] = entry
+            self.parse_errors.append(e)
         self.current = idx
-        if self.entries[idx].has_key('algebraic'):
-            self.board.fromAlgebraic(self.entries[idx]['algebraic'])
+        if entry.has_key('algebraic'):
+            self.board.fromAlgebraic(entry['algebraic'])
         else:
             self.board.clear()
-            
+        if self.pieces_counts[idx] is None:
+            self.pieces_counts[idx] = self.board.getPiecesCount()
+
     def insert(self,  data,  dirty,  idx):
         self.entries.insert(idx,  data)
         self.dirty_flags.insert(idx, dirty)
@@ -469,14 +586,23 @@ class Model:
         else:
             self.board.clear()
         self.pieces_counts.insert(idx, self.board.getPiecesCount())
+        self.summaries.insert(idx, None)
+        self.occupancies.insert(idx, None)
+        if not self.tensor is None:
+            self.tensor.insert(idx, data.get('algebraic', {}))
         self.current = idx
         if(dirty): self.is_dirty = True
     def onBoardChanged(self):
         self.pieces_counts[self.current] = self.board.getPiecesCount()
+        self.summaries[self.current] = None
+        self.occupancies[self.current] = None
         self.dirty_flags[self.current] = True
         self.is_dirty = True
         self.entries[self.current]['algebraic'] = self.board.toAlgebraic()
+        if not self.tensor is None:
+            self.tensor.update(self.current, self.entries[self.current]['algebraic'])
     def markDirty(self):
+        self.summaries[self.current] = None
         self.dirty_flags[self.current] = True
         self.is_dirty = True
     def add(self, data, dirty):
@@ -486,6 +612,10 @@ class Model:
         self.entries.pop(idx)
         self.dirty_flags.pop(idx)
         self.pieces_counts.pop(idx)
+        self.summaries.pop(idx)
+        self.occupancies.pop(idx)
+        if not self.tensor is None:
+            self.tensor.delete(idx)
         self.is_dirty = True
         if(len(self.entries) > 0):
             if(idx < len(self.entries)):
@@ -553,6 +683,46 @@ def createPrettyTwinsText(e):
             prev_twin = twin
     return "<br/>".join(formatted)
     
+def headerHtml(e, Lang): 
+    parts = []
+    if(e.has_key('authors')):
+        parts.append("<b>" + "<br/>".join(e['authors']) + "</b>")
+    if(notEmpty(e, 'source')):
+        s = "<i>" + e['source'] + "</i>"
+        if(notEmpty(e, 'source-id')):
+            s = s + "<i> (" + e['source-id'] + ")</i>"
+        if(notEmpty(e, 'date')):
+            s = s + "<i>, " + e['date'] + "</i>"
+        parts.append(s)
+    if(notEmpty(e, 'distinction')):
+        d = Distinction.fromString(e['distinction'])
+        parts.append(d.toStringInLang(Lang))
+    return escapeHtml("<br/>".join(parts))
+
+def solverHtml(e, Lang):
+    parts = []
+    if(notEmpty(e, 'intended-solutions')):
+        if '.' in e['intended-solutions']:
+            parts.append(e['intended-solutions'])
+        else:
+            parts.append(e['intended-solutions'] + " " + Lang.value('EP_Intended_solutions_shortened'))
+    if(e.has_key('options')):
+        parts.append("<b>" + "<br/>".join(e['options']) + "</b>")
+    if(e.has_key('twins')):
+        parts.append(createPrettyTwinsText(e))
+    return escapeHtml("<br/>".join(parts))
+
+def legendHtml(board):
+    legend = board.getLegend()
+    if len(legend) == 0:
+        return ''
+    return escapeHtml("<br/>".join([", ".join(legend[k]) + ': ' + k for k in legend.keys()]))
+
+def escapeHtml(str):
+    str = str.replace('&', '&amp;');
+    # todo: more replacements
+    return str 
+    
 def hasFairyConditions(e):
     if not e.has_key('options'):
         return False
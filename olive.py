@@ -10,12 +10,30 @@ Usage:
 import sys
 import os
 import ctypes
+import time
+
+# set OLIVE_TIMING=1 to see where the startup time goes
+TIMING = os.environ.get('OLIVE_TIMING', '') not in ['', '0']
+started = time.time()
+timings = [('python', started)]
+
+def checkpoint(name):
+    timings.append((name, time.time()))
+
+def reportTimings():
+    if not TIMING:
+        return
+    for i in xrange(1, len(timings)):
+        sys.stderr.write("%-12s %7.1f ms\n" % (timings[i][0], 1000*(timings[i][1] - timings[i-1][1])))
+    sys.stderr.write("%-12s %7.1f ms\n" % ('total', 1000*(timings[-1][1] - started)))
 
 # 3rd party
 from PyQt4 import QtGui, QtCore
+checkpoint('qt')
 
 # local
 import gui
+checkpoint('imports')
 
 def main():
 
@@ -30,6 +48,8 @@ def main():
     # loading configs
     gui.Conf.read()
     gui.Lang.read()
+    gui.model.FairyHelper.read()
+    checkpoint('configs')
 
     # Qt bootstrap
     app = QtGui.QApplication(sys.argv)
@@ -45,10 +65,13 @@ def main():
     QtGui.QFontDatabase.addApplicationFont('resources/fonts/gc2004y_.ttf')
 
     mainframe = gui.Mainframe()
+    checkpoint('mainframe')
     
-    # if invoked with "olive.py filename.olv" - read filename.olv
-    if len(sys.argv) and sys.argv[-1][-4:] == '.olv':
+    # if invoked with "olive.py filename.olv" (or .olvdb) - read the collection
+    if len(sys.argv) > 1 and os.path.splitext(sys.argv[-1])[1].lower() in ['.olv', '.olvdb']:
         mainframe.openCollection(sys.argv[-1])
+        checkpoint('collection')
+    reportTimings()
     
     # entering main loop
     sys.exit(app.exec_())
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""olivecli - olive without GUI
+Usage:
+    olivecli.py import-pbm [--encoding ENC] [-o OUT] FILE
+    olivecli.py import-ccv [--encoding ENC] [-o OUT] FILE
+    olivecli.py input [-o OUT] [FILE]
+    olivecli.py solve [--workers N] [--timeout SEC] [--overwrite] [--compact] [-o OUT] [FILE]
+    olivecli.py verify [--workers N] [--timeout SEC] [FILE]
+    olivecli.py tag [--workers N] [--timeout SEC] [-o OUT] [FILE]
+    olivecli.py export-pdf [--lang LANG] -o OUT.pdf [FILE]
+    olivecli.py find [--any-stipulation] FILE ARCHIVE [ARCHIVE ...]
+    olivecli.py convert FILE OUT
+    olivecli.py pattern [--anywhere] [--symmetric] [--pieces MIN MAX] [--min-fairy N] PATTERN [FILE]
+    FILE - YAML collection (.olv) or SQLite collection (.olvdb), '-' or nothing for stdin
+    ARCHIVE - YAML collection (.olv) to look for the identical or symmetric positions in
+    PATTERN - YAML collection (.olv), the position of its first entry is the pattern
+    OUT - '-' or nothing for stdout; for convert .olv or .olvdb, by the extension
+"""
+
+# standard
+import sys
+import os
+import argparse
+import multiprocessing
+
+# the configuration files are looked up relative to the application directory
+CWD = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# 3rd party
+import yaml
+
+# local
+from config import Conf, Lang
+import model
+import pbm
+import fancy
+import legacy.popeye
+import legacy.chess
+import legacy.yacpdb
+import batch
+import solvers
+import storage
+import solvercache
+import positionindex
+import patterns
+
+def openInput(filename, mode='r'):
+    if filename in [None, '-']:
+        return sys.stdin
+    return open(os.path.join(CWD, filename), mode)
+
+def openOutput(filename, mode='w'):
+    if filename in [None, '-']:
+        return sys.stdout
+    return open(os.path.join(CWD, filename), mode)
+
+def readEntries(filename):
+    # files are read through storage, so that the entries parsed once are cached
+    if not filename in [None, '-']:
+        entries = storage.openCollection(os.path.join(CWD, filename))
+        try:
+            for i in xrange(len(entries)):
+                entry = entries.parse(i) # not kept parsed
+                if len(entry):
+                    yield entry # as yaml.load_all below, empty documents are skipped
+        finally:
+            entries.saveIndex()
+            entries.close()
+        return
+    for data in yaml.load_all(openInput(filename)):
+        if not data is None:
+            yield model.makeSafe(data)
+
+def writeEntries(entries, filename):
+    f = openOutput(filename)
+    try:
+        for entry in entries:
+            f.write(storage.dumpEntry(entry))
+            f.flush()
+    finally:
+        if not f is sys.stdout:
+            f.close()
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
+
+def createSolver(args):
+    return batch.BatchSolver(solvers.popeyeBackend(), \
+        [int(Conf.value('batch-workers')), args.workers][args.workers is not None], \
+        [float(Conf.value('batch-timeout')), args.timeout][args.timeout is not None], \
+        int(Conf.value('popeye-stop-max-bytes')), \
+        solvercache.SolverCache(Conf.value('solver-cache-dir'), int(Conf.value('solver-cache-max-bytes'))))
+
+def solveStream(solver, entries, select):
+    # yields (entry, result) in the original order, result is None for the entries not solved,
+    # the stream is processed in chunks so that memory does not grow with the collection size
+    for chunk in chunks(entries, max(1, solver.workers) * 4):
+        results, jobs = {}, []
+        for i, entry in enumerate(chunk):
+            if select(entry):
+                try:
+                    jobs.append(batch.Job(i, batch.makeInput(entry, Conf.value('popeye-sticky-options'))))
+                except Exception:
+                    sys.stderr.write("cannot create popeye input for %s\n" % describe(entry))
+        solver.run(jobs, lambda result: results.__setitem__(result.idx, result))
+        for i, entry in enumerate(chunk):
+            yield entry, results.get(i)
+
+def describe(entry):
+    parts = []
+    for key in ['authors', 'source', 'date']:
+        if entry.has_key(key):
+            parts.append(unicode(['; '.join(entry[key]), entry[key]][key != 'authors']))
+    return (u', '.join(parts)).encode('utf8')
+
+def compactify(entry, output):
+    solution = legacy.popeye.parse_output(entry, output)
+    solutionOutput = legacy.chess.SolutionOutput(False)
+    b = legacy.chess.Board()
+    b.from_algebraic(entry['algebraic'])
+    solutionOutput.create_output(solution, b)
+    return solutionOutput.solution
+
+def hasSolution(entry):
+    return entry.has_key('solution') and unicode(entry['solution']).strip() != ''
+
+def setLegacyNotation(notation):
+    legacy_notation = {}
+    notations = Conf.value('notations')
+    for a, b in zip(notations['en'], notations[notation]):
+        legacy_notation[a] = b
+    legacy.chess.NOTATION = legacy_notation
+
+def cmdImportPbm(args):
+    pbm.PBM_ENCODING = args.encoding
+    f = openInput(args.file, 'rb')
+    try:
+        writeEntries((model.makeSafe(data) for data in pbm.PbmEntries(f)), args.output)
+    finally:
+        f.close()
+    return 0
+
+def cmdImportCcv(args):
+    writeEntries((model.makeSafe(data) for data in fancy.readCvv(os.path.join(CWD, args.file), args.encoding)), \
+        args.output)
+    return 0
+
+def cmdConvert(args):
+    # the entries are copied as they are stored, see olvdb.documentText
+    entries = storage.openCollection(os.path.join(CWD, args.file))
+    try:
+        storage.saveCollection(os.path.join(CWD, args.output), entries, [False] * len(entries)).close()
+    finally:
+        entries.close()
+    return 0
+
+def cmdInput(args):
+    f = openOutput(args.output)
+    for entry in readEntries(args.file):
+        f.write(batch.makeInput(entry, Conf.value('popeye-sticky-options')) + "\n")
+    return 0
+
+def cmdSolve(args):
+    solver, failures = createSolver(args), [0]
+    setLegacyNotation(Conf.value('default-notation'))
+    def solved():
+        for entry, result in solveStream(solver, readEntries(args.file), \
+            lambda e: args.overwrite or not hasSolution(e)):
+            if result is None:
+                pass
+            elif result.status != batch.OK:
+                failures[0] = failures[0] + 1
+                sys.stderr.write("%s: %s\n" % (result.status, describe(entry)))
+            elif args.compact:
+                try:
+                    entry['solution'] = compactify(entry, result.output)
+                except (legacy.popeye.ParseError, legacy.chess.UnsupportedError), e:
+                    entry['solution'] = batch.solutionFromOutput(result.output)
+            else:
+                entry['solution'] = batch.solutionFromOutput(result.output)
+            yield entry
+    try:
+        writeEntries(solved(), args.output)
+    finally:
+        solver.close()
+    return [0, 1][failures[0] > 0]
+
+def cmdVerify(args):
+    # solves every entry that has a solution and compares the result with the stored one
+    solver, failures = createSolver(args), 0
+    normalize = lambda text: " ".join(unicode(text).split())
+    try:
+        for i, (entry, result) in enumerate(solveStream(solver, readEntries(args.file), hasSolution)):
+            if result is None:
+                continue
+            status = result.status
+            if status == batch.OK and normalize(batch.solutionFromOutput(result.output)) != \
+                normalize(entry['solution']):
+                status = 'mismatch'
+            if status != batch.OK:
+                failures = failures + 1
+            print "%d\t%s\t%s" % (i + 1, status, describe(entry))
+    finally:
+        solver.close()
+    return [0, 1][failures > 0]
+
+def findKeywords(job):
+    # runs in a worker process
+    entry, output = job
+    try:
+        solution = legacy.popeye.parse_output(entry, output)
+        b = legacy.chess.Board()
+        b.from_algebraic(entry['algebraic'])
+        return legacy.yacpdb.keywords(entry, b, solution)
+    except (legacy.popeye.ParseError, legacy.chess.UnsupportedError):
+        return None
+
+def cmdTag(args):
+    # popeye runs in the solver processes, the analysis of its output in a pool of python processes
+    solver = createSolver(args)
+    pool = multiprocessing.Pool(solver.workers)
+    def tagged():
+        for chunk in chunks(solveStream(solver, readEntries(args.file), \
+            lambda e: e.has_key('algebraic')), max(1, solver.workers) * 4):
+            solved = [i for i, (entry, result) in enumerate(chunk) \
+                if (not result is None) and result.status == batch.OK]
+            found = dict(zip(solved, pool.map(findKeywords, [(chunk[i][0], chunk[i][1].output) for i in solved])))
+            for i, (entry, result) in enumerate(chunk):
+                if not found.get(i) is None:
+                    keywords = entry.get('keywords', [])
+                    entry['keywords'] = keywords + [k for k in found[i] if not k in keywords]
+                elif not result is None:
+                    sys.stderr.write("not tagged: %s\n" % describe(entry))
+                yield entry
+    try:
+        writeEntries(tagged(), args.output)
+    finally:
+        pool.terminate()
+        solver.close()
+    return 0
+
+def cmdExportPdf(args):
+    import pdf # reportlab is only needed here
+    if not args.lang is None:
+        Lang.current = args.lang
+    ed = pdf.ExportDocument([entry for entry in readEntries(args.file)], Lang)
+    ed.doExport(os.path.join(CWD, args.output))
+    return 0
+
+def describeSummary(summary):
+    # same as describe, for model.summarize
+    return (u', '.join([summary[key] for key in ['authors', 'source', 'date'] if summary[key] != ''])).encode('utf8')
+
+def cmdFind(args):
+    # the archives are indexed on first use and when they change, see positionindex.PositionIndex
+    archives = [os.path.join(CWD, archive) for archive in args.archives]
+    source = [os.path.abspath(os.path.join(CWD, args.file)), None][args.file == '-']
+    collections, found = {}, 0
+    try:
+        for i, entry in enumerate(readEntries(args.file)):
+            for archive, idx, kind in positionindex.findPositions(entry, archives, args.any_stipulation):
+                if idx == i and os.path.abspath(archive) == source:
+                    continue # the entry itself
+                if not collections.has_key(archive):
+                    collections[archive] = storage.openCollection(archive)
+                found = found + 1
+                print "%d\t%s\t%s:%d\t%s" % (i + 1, kind, archive, idx + 1, \
+                    describeSummary(collections[archive].summary(idx)))
+    finally:
+        for collection in collections.values():
+            collection.close()
+    return [1, 0][found > 0]
+
+def cmdPattern(args):
+    board = model.Board()
+    for entry in readEntries(args.pattern):
+        board.fromAlgebraic(entry.get('algebraic', {}))
+        break
+    pattern = patterns.Pattern(board, args.anywhere, args.symmetric, \
+        args.pieces[0], args.pieces[1], args.min_fairy)
+    found = 0
+    for i, entry in enumerate(readEntries(args.file)):
+        if pattern.matches(patterns.Occupancy(entry.get('algebraic', {}))):
+            found = found + 1
+            print "%d\t%s" % (i + 1, describe(entry))
+    return [1, 0][found > 0]
+
+def createParser():
+    parser = argparse.ArgumentParser(description='olive without GUI')
+    commands = parser.add_subparsers()
+
+    for name, func in [('import-pbm', cmdImportPbm), ('import-ccv', cmdImportCcv)]:
+        p = commands.add_parser(name)
+        p.add_argument('file')
+        p.add_argument('--encoding', default=Conf.value('import-post-decode-default'))
+        p.add_argument('-o', '--output')
+        p.set_defaults(func=func)
+
+    p = commands.add_parser('convert', help='convert between .olv and .olvdb')
+    p.add_argument('file')
+    p.add_argument('output')
+    p.set_defaults(func=cmdConvert)
+
+    p = commands.add_parser('input', help='print popeye input for every entry')
+    p.add_argument('file', nargs='?')
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=cmdInput)
+
+    for name, func in [('solve', cmdSolve), ('verify', cmdVerify)]:
+        p = commands.add_parser(name)
+        p.add_argument('file', nargs='?')
+        p.add_argument('--workers', type=int)
+        p.add_argument('--timeout', type=float)
+        p.set_defaults(func=func)
+    p = commands.add_parser('tag', help='find keywords and add them to the entries')
+    p.add_argument('file', nargs='?')
+    p.add_argument('--workers', type=int)
+    p.add_argument('--timeout', type=float)
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=cmdTag)
+
+    p = commands.choices['solve']
+    p.add_argument('--overwrite', action='store_true')
+    p.add_argument('--compact', action='store_true')
+    p.add_argument('-o', '--output')
+
+    p = commands.add_parser('export-pdf')
+    p.add_argument('file', nargs='?')
+    p.add_argument('--lang')
+    p.add_argument('-o', '--output', required=True)
+    p.set_defaults(func=cmdExportPdf)
+
+    p = commands.add_parser('find', help='find the identical or symmetric positions in the archives')
+    p.add_argument('file')
+    p.add_argument('archives', nargs='+')
+    p.add_argument('--any-stipulation', action='store_true')
+    p.set_defaults(func=cmdFind)
+
+    p = commands.add_parser('pattern', help='find the positions that match the pattern, see patterns.Pattern')
+    p.add_argument('pattern')
+    p.add_argument('file', nargs='?')
+    p.add_argument('--anywhere', action='store_true')
+    p.add_argument('--symmetric', action='store_true')
+    p.add_argument('--pieces', type=int, nargs=2, default=[0, 64], metavar=('MIN', 'MAX'))
+    p.add_argument('--min-fairy', type=int, default=0)
+    p.set_defaults(func=cmdPattern)
+
+    return parser
+
+def main():
+    Conf.read()
+    Lang.read()
+    model.FairyHelper.read()
+    args = createParser().parse_args()
+    try:
+        return args.func(args)
+    except IOError, e:
+        sys.stderr.write("%s\n" % e)
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main())
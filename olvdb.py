@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import os
+import sqlite3
+import tempfile
+
+# 3rd party
+import yaml
+
+# local
+import model
+import storage
+import positionindex
+
+DB_SUFFIX = '.olvdb'
+SCHEMA_VERSION = 1
+PAGE_SIZE = 256 # summaries fetched at once for the overview
+
+SUMMARY_COLUMNS = ['authors', 'source', 'date', 'distinction', 'stipulation', 'pieces']
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    # document - the YAML text of the entry, starting with '---'
+    # position - the canonical hash of positionindex.positionHashes
+    "CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, seq INTEGER NOT NULL, " + \
+        "document BLOB NOT NULL, " + ', '.join([c + ' TEXT' for c in SUMMARY_COLUMNS]) + ", position TEXT)",
+    "CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq)"] + \
+    ["CREATE INDEX IF NOT EXISTS entries_%s ON entries (%s)" % (c, c) \
+        for c in ['authors', 'source', 'date', 'stipulation', 'position']]
+
+INSERT = "INSERT INTO entries (seq, document, " + ', '.join(SUMMARY_COLUMNS) + ", position) VALUES (?" + \
+    ", ?" * (len(SUMMARY_COLUMNS) + 2) + ")"
+UPDATE = "UPDATE entries SET document = ?, " + ', '.join([c + ' = ?' for c in SUMMARY_COLUMNS]) + \
+    ", position = ? WHERE id = ?"
+
+def isDb(filename):
+    return filename.lower().endswith(DB_SUFFIX)
+
+def connect(filename): # throws IOError
+    try:
+        db = sqlite3.connect(filename)
+        for statement in SCHEMA:
+            db.execute(statement)
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None:
+            db.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(SCHEMA_VERSION), ))
+        elif row[0] != str(SCHEMA_VERSION):
+            db.close()
+            raise IOError('Unsupported version of ' + filename)
+        db.commit()
+    except sqlite3.Error, e:
+        raise IOError(str(e))
+    return db
+
+def normalizeDocument(text):
+    # as storage.copyRun does: a separator in front, a newline at the end
+    if not storage.isDocumentStart(text[:4]):
+        text = "---\n" + text
+    if not text.endswith("\n"):
+        text = text + "\n"
+    return text
+
+def rowValues(document, e):
+    # the columns after seq
+    summary = model.summarize(e)
+    hashes = positionindex.entryHashes(e)
+    return [buffer(document)] + [summary[c] for c in SUMMARY_COLUMNS] + [[None, hashes[1]][hashes is not None]]
+
+class DbEntries:
+    # list-like view of an .olvdb collection, same as storage.LazyEntries: entries are parsed
+    # on first access only, the overview summaries come from the indexed columns
+    def __init__(self, filename):
+        self.filename, self.db = filename, connect(filename)
+        self.ids = [row[0] for row in self.db.execute("SELECT id FROM entries ORDER BY seq")] # None for new entries
+        self.items = [None] * len(self.ids)
+        self.summaries = [None] * len(self.ids)
+        self.pristine = True # entries order still matches seq
+
+    def connection(self):
+        if self.db is None:
+            self.db = connect(self.filename)
+        return self.db
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        if self.items[idx] is None:
+            self.items[idx] = self.parse(idx)
+        return self.items[idx]
+
+    def __setitem__(self, idx, entry):
+        self.items[idx] = entry
+
+    def __iter__(self):
+        for i in xrange(len(self.items)):
+            yield self[i]
+
+    def insert(self, idx, entry):
+        self.items.insert(idx, entry)
+        self.ids.insert(idx, None)
+        self.summaries.insert(idx, None)
+        self.pristine = False
+
+    def pop(self, idx):
+        entry = self[idx]
+        self.items.pop(idx)
+        self.ids.pop(idx)
+        self.summaries.pop(idx)
+        self.pristine = False
+        return entry
+
+    def isParsed(self, idx):
+        return not self.items[idx] is None
+
+    def parse(self, idx):
+        # the entry as stored, not kept parsed
+        return model.makeSafe(yaml.load(self.read(idx)))
+
+    def read(self, idx):
+        # the stored text, even if the entry was modified since
+        try:
+            row = self.connection().execute("SELECT document FROM entries WHERE id = ?", (self.ids[idx], )).fetchone()
+        except sqlite3.Error, e:
+            raise IOError(str(e))
+        if row is None:
+            raise IOError('Entry is missing in ' + self.filename)
+        return str(row[0])
+
+    def summary(self, idx):
+        if self.summaries[idx] is None and self.ids[idx] is None:
+            self.summaries[idx] = model.summarize(self[idx])
+        elif self.summaries[idx] is None:
+            start = idx - idx % PAGE_SIZE
+            page = dict([(self.ids[i], i) for i in xrange(start, min(start + PAGE_SIZE, len(self.ids))) \
+                if not self.ids[i] is None and self.summaries[i] is None])
+            rows = self.connection().execute("SELECT id, " + ', '.join(SUMMARY_COLUMNS) + " FROM entries WHERE id IN (" + \
+                ', '.join(['?'] * len(page)) + ")", page.keys())
+            for row in rows:
+                self.summaries[page[row[0]]] = dict(zip(SUMMARY_COLUMNS, [[v, u''][v is None] for v in row[1:]]))
+        return self.summaries[idx]
+
+    def close(self):
+        if not self.db is None:
+            self.db.close()
+            self.db = None
+
+    def saveIndex(self):
+        pass # the summaries are stored with the entries
+
+def openCollection(filename): # throws IOError
+    if not os.path.exists(filename):
+        raise IOError('No such file: ' + filename)
+    return DbEntries(filename)
+
+def documentText(entries, dirty_flags, i):
+    # clean entries keep their text, whichever format they come from
+    if not dirty_flags[i]:
+        if isinstance(entries, DbEntries) and not entries.ids[i] is None:
+            return entries.read(i)
+        if isinstance(entries, storage.LazyEntries) and not entries.spans[i] is None:
+            return normalizeDocument(entries.read(i))
+    return storage.dumpEntry(entries[i])
+
+def entryOf(entries, i):
+    # the entries that were not loaded yet are not kept parsed
+    if hasattr(entries, 'isParsed') and not entries.isParsed(i):
+        return entries.parse(i)
+    return entries[i]
+
+def keepParsed(source, entries):
+    # whatever was parsed stays parsed
+    for i in xrange(len(source)):
+        if not hasattr(source, 'isParsed') or source.isParsed(i):
+            entries.items[i] = source[i]
+    return entries
+
+def findPositions(filename, hashes, any_stipulation=False): # throws IOError
+    # same as positionindex.PositionIndex.find, through the indexed position column; only the
+    # matching entries are parsed, to tell the identical positions from the symmetric ones
+    exact, canonical, stipulation = hashes
+    if not os.path.exists(filename):
+        raise IOError('No such file: ' + filename)
+    db = connect(filename)
+    try:
+        retval = []
+        for seq, document, stored in db.execute("SELECT seq, document, stipulation FROM entries " + \
+            "WHERE position = ? ORDER BY seq", (canonical, )).fetchall():
+            if not any_stipulation and positionindex.normalizeStipulation([stored, u''][stored is None]) != stipulation:
+                continue
+            idx = db.execute("SELECT COUNT(*) FROM entries WHERE seq < ?", (seq, )).fetchone()[0]
+            e = model.makeSafe(yaml.load(str(document)))
+            kind = [positionindex.SYMMETRIC, positionindex.IDENTICAL][positionindex.entryHashes(e)[0] == exact]
+            retval.append((idx, kind))
+    except sqlite3.Error, e:
+        raise IOError(str(e))
+    finally:
+        db.close()
+    return retval
+
+def saveChanges(entries, dirty_flags): # throws IOError
+    # one transaction: the dirty entries are updated, the new ones inserted, the removed ones
+    # deleted, seq is rewritten only if the order has changed
+    db = entries.connection()
+    try:
+        kept = set([id for id in entries.ids if not id is None])
+        removed = [(row[0], ) for row in db.execute("SELECT id FROM entries") if not row[0] in kept]
+        db.executemany("DELETE FROM entries WHERE id = ?", removed)
+        ids = list(entries.ids)
+        for i in xrange(len(entries)):
+            if ids[i] is None:
+                document = storage.dumpEntry(entries[i])
+                cursor = db.execute(INSERT, [i] + rowValues(document, entries[i]))
+                ids[i] = cursor.lastrowid
+            elif dirty_flags[i]:
+                document = storage.dumpEntry(entries[i])
+                db.execute(UPDATE, rowValues(document, entries[i]) + [ids[i]])
+        if not entries.pristine:
+            db.executemany("UPDATE entries SET seq = ? WHERE id = ?", [(i, id) for i, id in enumerate(ids)])
+        db.commit()
+    except sqlite3.Error, e:
+        db.rollback()
+        raise IOError(str(e))
+    entries.ids, entries.pristine = ids, True
+    for i in xrange(len(entries)):
+        if dirty_flags[i]:
+            entries.summaries[i] = None
+    return entries
+
+def saveCollection(filename, entries, dirty_flags): # throws IOError, OSError
+    # into the file the entries were loaded from - in place, otherwise a new database
+    # replaces the target the same way storage.saveCollection does
+    if isinstance(entries, DbEntries) and os.path.abspath(entries.filename) == os.path.abspath(filename):
+        return saveChanges(entries, dirty_flags)
+    fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    os.remove(tmpname) # sqlite creates it
+    try:
+        db = connect(tmpname)
+        try:
+            rows = []
+            for i in xrange(len(entries)):
+                document = documentText(entries, dirty_flags, i)
+                rows.append([i] + rowValues(document, entryOf(entries, i)))
+                if len(rows) == PAGE_SIZE or i + 1 == len(entries):
+                    db.executemany(INSERT, rows)
+                    rows = []
+            db.commit()
+        except sqlite3.Error, e:
+            raise IOError(str(e))
+        finally:
+            db.close()
+        storage.replaceFile(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    return keepParsed(entries, openCollection(filename))
+
+def exportCollection(filename, entries, dirty_flags): # throws IOError, OSError
+    # an .olvdb collection as .olv, the clean entries are written as they are stored
+    fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            for i in xrange(len(entries)):
+                f.write(documentText(entries, dirty_flags, i))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        storage.replaceFile(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    return keepParsed(entries, storage.openCollection(filename))
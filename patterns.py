@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# local
+import model
+
+DUMMY = 'DU'
+
+def bitCount(bitboard):
+    return bin(bitboard).count('1')
+
+class Occupancy:
+    # bitboards of an entry's position, bit i stands for square i of model.Board
+    def __init__(self, algebraic):
+        self.kinds = {} # (color, piece) -> bitboard, piece as in model.Piece.toAlgebraic
+        self.colors = {} # color -> bitboard
+        for color in model.COLORS:
+            self.colors[color] = 0
+        self.all, self.fairy = 0, 0
+        for color in model.COLORS:
+            if not algebraic.has_key(color): continue
+            for piecedecl in algebraic[color]:
+                parts = [x.strip() for x in piecedecl.split(' ')]
+                piece = ' '.join(sorted(parts[:-1]) + [parts[-1][:-2].upper()])
+                bit = 1 << model.algebraicToIdx(parts[-1][-2:])
+                if self.all & bit:
+                    self.drop(bit) # the last one stays, as in model.Board.add
+                self.kinds[(color, piece)] = self.kinds.get((color, piece), 0) | bit
+                self.colors[color] = self.colors[color] | bit
+                self.all = self.all | bit
+        for (color, piece), bitboard in self.kinds.items():
+            if color not in ['white', 'black'] or not piece in model.ORTHODOX: # see model.hasFairyPieces
+                self.fairy = self.fairy + bitCount(bitboard)
+
+    def drop(self, bit):
+        for key in self.kinds.keys():
+            self.kinds[key] = self.kinds[key] & ~bit
+        for color in model.COLORS:
+            self.colors[color] = self.colors[color] & ~bit
+        self.all = self.all & ~bit
+
+class Pattern:
+    # a partial board: the pieces must stand as drawn, a white or black dummy stands for
+    # any piece of that color and a neutral dummy for an empty square, the other squares
+    # do not matter
+    # anywhere - the pattern may be shifted over the board
+    # symmetric - the pattern may be rotated, reflected and have the colors inverted
+    def __init__(self, board, anywhere=False, symmetric=False, min_pieces=0, max_pieces=64, min_fairy=0):
+        self.min_pieces, self.max_pieces, self.min_fairy = min_pieces, max_pieces, min_fairy
+        pieces = [(square % 8, square >> 3, piece.color, piece.toAlgebraic()) for square, piece in model.Pieces(board)]
+        funcs, colorings = model.SYMMETRIES[:1], [model.SAME_COLORS]
+        if symmetric:
+            funcs, colorings = model.SYMMETRIES, [model.SAME_COLORS, model.INVERTED_COLORS]
+        variants = {}
+        for func in funcs:
+            for colors in colorings:
+                placed = [func((x, y)) + (colors[color], piece) for x, y, color, piece in pieces]
+                for dx, dy in Pattern.shifts(placed, anywhere):
+                    variant = Pattern.compile([(x + dx, y + dy, color, piece) for x, y, color, piece in placed])
+                    variants[variant] = True
+        self.variants = variants.keys()
+
+    def shifts(placed, anywhere):
+        if not anywhere or len(placed) == 0:
+            return [(0, 0)]
+        xs, ys = [x for x, y, c, p in placed], [y for x, y, c, p in placed]
+        return [(dx, dy) for dx in xrange(-min(xs), 8 - max(xs)) for dy in xrange(-min(ys), 8 - max(ys))]
+    shifts = staticmethod(shifts)
+
+    def compile(placed):
+        # (kinds, colors, empty): tuples of (key, mask) and the mask of the empty squares
+        kinds, colors, empty = {}, {}, 0
+        for x, y, color, piece in placed:
+            bit = 1 << (x + 8*y)
+            if piece != DUMMY:
+                kinds[(color, piece)] = kinds.get((color, piece), 0) | bit
+            elif color == 'neutral':
+                empty = empty | bit
+            else:
+                colors[color] = colors.get(color, 0) | bit
+        return (tuple(sorted(kinds.items())), tuple(sorted(colors.items())), empty)
+    compile = staticmethod(compile)
+
+    def matches(self, occupancy):
+        count = bitCount(occupancy.all)
+        if count < self.min_pieces or count > self.max_pieces or occupancy.fairy < self.min_fairy:
+            return False
+        for kinds, colors, empty in self.variants:
+            if occupancy.all & empty:
+                continue
+            if self.covers(occupancy.kinds, kinds) and self.covers(occupancy.colors, colors):
+                return True
+        return False
+
+    def covers(self, bitboards, masks):
+        for key, mask in masks:
+            if bitboards.get(key, 0) & mask != mask:
+                return False
+        return True
+
+def search(pattern, occupancies, indices):
+    # yields the indices of the matching entries, occupancies(idx) -> Occupancy
+    for idx in indices:
+        if pattern.matches(occupancies(idx)):
+            yield idx
@@ -183,49 +183,11 @@ class ExportDocument:
             ))
         return story
         
-    def header(e, Lang): 
-        parts = []
-        if(e.has_key('authors')):
-            parts.append("<b>" + "<br/>".join(e['authors']) + "</b>")
-        if(model.notEmpty(e, 'source')):
-            s = "<i>" + e['source'] + "</i>"
-            if(model.notEmpty(e, 'source-id')):
-                s = s + "<i> (" + e['source-id'] + ")</i>"
-            if(model.notEmpty(e, 'date')):
-                s = s + "<i>, " + e['date'] + "</i>"
-            parts.append(s)
-        if(model.notEmpty(e, 'distinction')):
-            d = model.Distinction.fromString(e['distinction'])
-            parts.append(d.toStringInLang(Lang))
-        return ExportDocument.escapeHtml("<br/>".join(parts))
-    header = staticmethod(header)
-    
-    def solver(e, Lang):
-        parts = []
-        if(model.notEmpty(e, 'intended-solutions')):
-            if '.' in e['intended-solutions']:
-                parts.append(e['intended-solutions'])
-            else:
-                parts.append(e['intended-solutions'] + " " + Lang.value('EP_Intended_solutions_shortened'))
-        if(e.has_key('options')):
-            parts.append("<b>" + "<br/>".join(e['options']) + "</b>")
-        if(e.has_key('twins')):
-            parts.append(model.createPrettyTwinsText(e))
-        return ExportDocument.escapeHtml("<br/>".join(parts))
-    solver = staticmethod(solver)
-    
-    def legend(board):
-        legend = board.getLegend()
-        if len(legend) == 0:
-            return ''
-        return ExportDocument.escapeHtml("<br/>".join([", ".join(legend[k]) + ': ' + k for k in legend.keys()]))
-    legend = staticmethod(legend)
-
-    def escapeHtml(str):
-        str = str.replace('&', '&amp;');
-        # todo: more replacements
-        return str 
-    escapeHtml = staticmethod(escapeHtml)
+    # the html snippets are shared with the gui, which must not depend on reportlab
+    header = staticmethod(model.headerHtml)
+    solver = staticmethod(model.solverHtml)
+    legend = staticmethod(model.legendHtml)
+    escapeHtml = staticmethod(model.escapeHtml)
         
     def board2Html(self,  board):
         lines = []
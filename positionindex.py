@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import hashlib
+import marshal
+
+# 3rd party
+import yaml
+
+# local
+import model
+import storage
+import olvdb
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.pos'
+
+IDENTICAL, SYMMETRIC = 'identical', 'symmetric'
+
+def serialize(pieces, func, colors):
+    placed = []
+    for square, color, piece in pieces:
+        x, y = func((square % 8, square >> 3))
+        placed.append(colors[color] + ' ' + piece + model.idxToAlgebraic(x + 8*y))
+    placed.sort()
+    return ', '.join(placed)
+
+def positionHashes(algebraic):
+    # (exact, canonical): the canonical hash is the same for the positions that differ
+    # by a rotation, a reflection and/or the inverted colors only
+    b = model.Board()
+    b.fromAlgebraic(algebraic)
+    pieces = [(square, piece.color, piece.toAlgebraic()) for square, piece in model.Pieces(b)]
+    variants = [serialize(pieces, func, colors) \
+        for colors in [model.SAME_COLORS, model.INVERTED_COLORS] for func in model.SYMMETRIES]
+    return hashlib.sha1(variants[0]).hexdigest(), hashlib.sha1(min(variants)).hexdigest()
+
+def normalizeStipulation(stipulation):
+    return ''.join(unicode(stipulation).lower().split())
+
+def entryHashes(e):
+    # [exact, canonical, stipulation], None for the entries without a position
+    if not e.has_key('algebraic'):
+        return None
+    exact, canonical = positionHashes(e['algebraic'])
+    return [exact, canonical, normalizeStipulation(e.get('stipulation', ''))]
+
+class PositionIndex:
+    # position hashes of the entries of a collection file, kept next to the file and
+    # rebuilt when the file changes; the entries are numbered as in storage.LazyEntries
+    def __init__(self, filename):
+        self.filename = filename
+        self.signature = None
+        self.hashes = []
+        self.lookup = None
+
+    def indexFile(filename):
+        return filename + INDEX_SUFFIX
+    indexFile = staticmethod(indexFile)
+
+    def build(self):
+        entries = storage.openCollection(self.filename)
+        try:
+            self.hashes = []
+            for i in xrange(len(entries)):
+                try:
+                    self.hashes.append(entryHashes(entries.parse(i)))
+                except yaml.YAMLError:
+                    self.hashes.append(None)
+        finally:
+            entries.saveIndex() # the parsed entries are cached for the next time
+            entries.close()
+        self.signature = storage.fileSignature(self.filename)
+        self.lookup = None
+
+    def load(self):
+        try:
+            f = open(PositionIndex.indexFile(self.filename), 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            return False
+        if data.get('signature') != storage.fileSignature(self.filename):
+            return False
+        self.signature, self.hashes, self.lookup = data['signature'], data['hashes'], None
+        return True
+
+    def save(self):
+        data = {'version':INDEX_VERSION, 'signature':self.signature, 'hashes':self.hashes}
+        try:
+            f = open(PositionIndex.indexFile(self.filename), 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+        except IOError:
+            pass # the index is merely an accelerator
+
+    def find(self, hashes, any_stipulation=False):
+        # [(idx, IDENTICAL|SYMMETRIC)] for the result of entryHashes
+        if self.lookup is None:
+            self.lookup = {}
+            for i, h in enumerate(self.hashes):
+                if not h is None:
+                    self.lookup.setdefault(h[1], []).append(i)
+        exact, canonical, stipulation = hashes
+        retval = []
+        for i in self.lookup.get(canonical, []):
+            if any_stipulation or self.hashes[i][2] == stipulation:
+                retval.append((i, [SYMMETRIC, IDENTICAL][self.hashes[i][0] == exact]))
+        return retval
+
+def openIndex(filename): # throws IOError
+    index = PositionIndex(filename)
+    if not index.load():
+        index.build()
+        index.save()
+    return index
+
+def findPositions(e, filenames, any_stipulation=False): # throws IOError
+    # [(filename, idx, IDENTICAL|SYMMETRIC)] of the entries with the position of e
+    hashes = entryHashes(e)
+    if hashes is None:
+        return []
+    retval = []
+    for filename in filenames:
+        if olvdb.isDb(filename):
+            found = olvdb.findPositions(filename, hashes, any_stipulation) # no sidecar, the database is indexed
+        else:
+            found = openIndex(filename).find(hashes, any_stipulation)
+        for idx, kind in found:
+            retval.append((filename, idx, kind))
+    return retval
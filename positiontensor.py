@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# 3rd party
+try:
+    import numpy
+except ImportError: # the collection-wide queries are not available then
+    numpy = None
+
+# local
+import model
+
+def available():
+    return not numpy is None
+
+class PositionTensor:
+    # (entries x 64) array of the pieces of a collection, squares numbered as in model.Board;
+    # 0 is an empty square, other codes stand for the (color, piece) pairs of self.kinds,
+    # where piece is as in model.Piece.toAlgebraic, e.g. ('white', 'Q'), ('black', 'Royal S')
+    def __init__(self):
+        self.kinds, self.codes = [None], {}
+        self.rows = numpy.zeros((0, 64), numpy.int8)
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    def code(self, color, piece):
+        key = (color, piece)
+        if not self.codes.has_key(key):
+            if len(self.kinds) > numpy.iinfo(self.rows.dtype).max:
+                self.rows = self.rows.astype(numpy.int16)
+            self.codes[key] = len(self.kinds)
+            self.kinds.append(key)
+        return self.codes[key]
+
+    def encode(self, algebraic):
+        # same as model.Board.fromAlgebraic, without building the board
+        placed = []
+        for color in model.COLORS:
+            if not algebraic.has_key(color): continue
+            for piecedecl in algebraic[color]:
+                parts = [x.strip() for x in piecedecl.split(' ')]
+                piece = ' '.join(sorted(parts[:-1]) + [parts[-1][:-2].upper()])
+                placed.append((model.algebraicToIdx(parts[-1][-2:]), self.code(color, piece)))
+        row = numpy.zeros(64, self.rows.dtype) # after self.code, that may widen the type
+        for square, code in placed:
+            row[square] = code
+        return row
+
+    def build(self, positions):
+        # positions - the algebraic of every entry
+        rows = [self.encode(algebraic) for algebraic in positions]
+        self.rows = numpy.zeros((len(rows), 64), self.rows.dtype)
+        for i, row in enumerate(rows):
+            self.rows[i] = row
+
+    def insert(self, idx, algebraic):
+        row = self.encode(algebraic)
+        self.rows = numpy.insert(self.rows, idx, row, axis=0)
+
+    def update(self, idx, algebraic):
+        self.rows[idx] = self.encode(algebraic)
+
+    def delete(self, idx):
+        self.rows = numpy.delete(self.rows, idx, axis=0)
+
+    # queries: color - one of model.COLORS, piece - as in model.Piece.toAlgebraic,
+    # None for any; each returns an array with a value per entry
+
+    def table(self, match):
+        # lookup table code -> bool
+        table = numpy.zeros(len(self.kinds), numpy.bool_)
+        for code in xrange(1, len(self.kinds)):
+            table[code] = match(*self.kinds[code])
+        return table
+
+    def matching(self, color=None, piece=None):
+        # entries x 64 bool: the squares with such pieces
+        return self.table(lambda c, p: (color is None or c == color) and (piece is None or p == piece))[self.rows]
+
+    def count(self, color=None, piece=None):
+        return self.matching(color, piece).sum(axis=1)
+
+    def on(self, square, color=None, piece=None):
+        # square - e.g. 'd1'
+        return self.matching(color, piece)[:, model.algebraicToIdx(square)]
+
+    def fairy(self):
+        # the entries with fairy pieces, see model.hasFairyPieces
+        return self.table(lambda c, p: c not in ['white', 'black'] or not p in model.ORTHODOX)[self.rows].any(axis=1)
+
+    def search(self, pattern):
+        # same as patterns.Pattern.matches for every entry at once
+        counts = (self.rows != 0).sum(axis=1)
+        fairy = self.table(lambda c, p: c not in ['white', 'black'] or not p in model.ORTHODOX)[self.rows].sum(axis=1)
+        found = numpy.zeros(len(self), numpy.bool_)
+        for kinds, colors, empty in pattern.variants:
+            hit = (self.rows[:, squares(empty)] == 0).all(axis=1)
+            for key, mask in kinds:
+                if not self.codes.has_key(key):
+                    hit[:] = False
+                    break
+                hit &= (self.rows[:, squares(mask)] == self.codes[key]).all(axis=1)
+            for color, mask in colors:
+                hit &= self.table(lambda c, p: c == color)[self.rows[:, squares(mask)]].all(axis=1)
+            found |= hit
+        return found & (counts >= pattern.min_pieces) & (counts <= pattern.max_pieces) & (fairy >= pattern.min_fairy)
+
+def squares(mask):
+    # of a bitboard
+    return [i for i in xrange(64) if mask >> i & 1]
+
+def select(mask):
+    # indices of the entries where mask is true
+    return numpy.flatnonzero(mask).tolist()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import os
+import hashlib
+import marshal
+import tempfile
+import threading
+
+# local
+import storage
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.res'
+LOW_WATER = 0.9 # eviction frees some room at once, so that the next puts do not walk again
+
+def executableSignature(command):
+    # the command line plus size and mtime of the binary: a rebuilt or upgraded
+    # solver (or different options such as -maxmem) invalidates the cached results
+    parts = command.split(" ")
+    signature = command
+    try:
+        st = os.stat(parts[0])
+        signature = "%s|%d|%d" % (command, st.st_size, int(st.st_mtime))
+    except OSError:
+        pass
+    return signature
+
+def makeKey(input, command):
+    h = hashlib.sha1()
+    h.update(executableSignature(command))
+    h.update("\0")
+    if isinstance(input, unicode):
+        input = input.encode('utf8')
+    h.update(input)
+    return h.hexdigest()
+
+class SolverCache:
+    # content-addressed store of solver output, bounded by size (least recently used go first)
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total = None # bytes in the cache, None - not scanned yet
+        self.lock = threading.RLock() # shared by the GUI thread and the batch workers
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def filename(self, key):
+        return os.path.join(self.directory, key[:2], key + CACHE_SUFFIX)
+
+    def get(self, key):
+        # returns {'output':..., 'solutions':{notation:compact solution}} or None
+        if not self.enabled():
+            return None
+        self.lock.acquire()
+        try:
+            return self.load(key)
+        finally:
+            self.lock.release()
+
+    def load(self, key):
+        fname = self.filename(key)
+        try:
+            f = open(fname, 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+            os.utime(fname, None) # for LRU
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return None
+        return data
+
+    def put(self, key, output, solutions=None):
+        if not self.enabled():
+            return
+        if solutions is None:
+            solutions = {}
+        data = {'version':CACHE_VERSION, 'output':output, 'solutions':solutions}
+        self.lock.acquire()
+        try:
+            self.store(key, data)
+        finally:
+            self.lock.release()
+
+    def store(self, key, data):
+        fname = self.filename(key)
+        if self.total is None:
+            self.total = self.scan()[1]
+        try:
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            handle, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(fname))
+            f = os.fdopen(handle, 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+            size = os.path.getsize(tmpname)
+            if os.path.exists(fname):
+                self.total = self.total - os.path.getsize(fname)
+            storage.replaceFile(tmpname, fname)
+            self.total = self.total + size
+        except (IOError, OSError, ValueError):
+            return # the cache is merely an accelerator
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def addSolution(self, key, notation, solution):
+        if not self.enabled():
+            return
+        self.lock.acquire()
+        try:
+            data = self.load(key)
+            if data is None:
+                return
+            data['solutions'][notation] = solution
+            self.store(key, data)
+        finally:
+            self.lock.release()
+
+    def scan(self):
+        # ([(mtime, size, filename)], total size) of the cached results
+        files, total = [], 0
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(CACHE_SUFFIX):
+                    continue
+                fname = os.path.join(root, name)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, fname))
+                total = total + st.st_size
+        return files, total
+
+    def evict(self):
+        # the directory is walked only when the running total goes over max_bytes,
+        # which also picks up the results other processes have put
+        files, total = self.scan()
+        files.sort()
+        for mtime, size, fname in files:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(fname)
+                total = total - size
+            except OSError:
+                pass
+        self.total = total
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import os
+import time
+import heapq
+import itertools
+import tempfile
+import threading
+import subprocess
+
+# local
+from config import Conf
+
+QUEUED, RUNNING = 'queued', 'running'
+OK, TIMEOUT, OVERFLOW, FAILED, CANCELLED = 'ok', 'timeout', 'overflow', 'failed', 'cancelled'
+
+# jobs with lower priority start first
+INTERACTIVE, BATCH = 0, 10
+
+# the solvers do not inherit the other open files; python 2 on Windows cannot
+# close them when the standard handles are redirected
+CLOSE_FDS = os.name != 'nt'
+
+class Backend:
+    # how to start a solver: command line, memory cap and where the input goes
+    def __init__(self, command, options, max_memory, stdin):
+        self.command, self.options, self.max_memory, self.stdin = \
+            command, options, max_memory, stdin
+        self.warm = None
+
+    def memoryOptions(self, max_memory):
+        return []
+
+    def params(self, max_memory, filename):
+        params = self.command.split(" ") + self.options + self.memoryOptions(max_memory)
+        if not filename is None:
+            params.append(filename)
+        return params
+
+    def signature(self):
+        # the command line that solves the input, for solvercache.makeKey
+        return " ".join(self.params(self.max_memory, None))
+
+    def keepWarm(self, size):
+        # processes are started in advance, possible only if the input goes to stdin
+        if self.stdin and self.warm is None:
+            self.warm = WarmProcesses(self.params(self.max_memory, None), size)
+
+    def close(self):
+        if not self.warm is None:
+            self.warm.close()
+            self.warm = None
+
+    def start(self, job, filename):
+        # raises OSError if the solver cannot be started, IOError if it does not take the input
+        max_memory = [job.max_memory, self.max_memory][job.max_memory is None]
+        if not filename is None:
+            devnull = open(os.devnull, 'rb') # rather than the stdin of olive
+            try:
+                return subprocess.Popen(self.params(max_memory, filename), stdin=devnull, \
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=CLOSE_FDS)
+            finally:
+                devnull.close()
+        warm = self.warm
+        if (not warm is None) and max_memory == self.max_memory:
+            process = warm.take()
+        else:
+            process = spawn(self.params(max_memory, None))
+        try:
+            process.stdin.write(job.input)
+            process.stdin.close()
+        except IOError: # the solver has exited
+            kill(process)
+            process.wait()
+            raise
+        if not warm is None:
+            warm.refill()
+        return process
+
+class PopeyeBackend(Backend):
+    def memoryOptions(self, max_memory):
+        # older configurations have -maxmem in popeye-executable
+        if max_memory in [None, ''] or '-maxmem' in self.command:
+            return []
+        return ['-maxmem', str(max_memory)]
+
+class ChestBackend(Backend):
+    def memoryOptions(self, max_memory):
+        # hash table size in MB
+        if max_memory in [None, '']:
+            return []
+        return ['-M ' + str(max_memory)]
+
+def popeyeBackend():
+    return PopeyeBackend(Conf.value('popeye-executable')[os.name], [], \
+        Conf.value('popeye-max-memory')[os.name], bool(Conf.value('solver-stdin')))
+
+def chestBackend():
+    return ChestBackend(Conf.value('chest-executable')[os.name], ['-r', '-LS'], \
+        Conf.value('chest-max-memory'), bool(Conf.value('solver-stdin')))
+
+def spawn(params):
+    return subprocess.Popen(params, stdin=subprocess.PIPE, stdout=subprocess.PIPE, \
+        stderr=subprocess.PIPE, close_fds=CLOSE_FDS)
+
+def kill(process):
+    try:
+        process.kill()
+    except OSError:
+        pass # already finished
+
+class WarmProcesses:
+    # solver processes started ahead of the jobs and waiting for the input on stdin,
+    # so that a job does not wait for the solver to load
+    def __init__(self, params, size):
+        self.params, self.size = params, size
+        self.lock = threading.Lock()
+        self.idle = []
+        self.closed = False
+
+    def take(self):
+        # raises OSError if the solver cannot be started
+        self.lock.acquire()
+        try:
+            while len(self.idle):
+                process = self.idle.pop()
+                if process.poll() is None:
+                    return process
+        finally:
+            self.lock.release()
+        return spawn(self.params)
+
+    def refill(self):
+        while True:
+            self.lock.acquire()
+            try:
+                if self.closed or len(self.idle) >= self.size:
+                    return
+            finally:
+                self.lock.release()
+            try:
+                process = spawn(self.params)
+            except OSError:
+                return
+            self.lock.acquire()
+            try:
+                if self.closed:
+                    kill(process)
+                    process.wait()
+                    return
+                self.idle.append(process)
+            finally:
+                self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        finally:
+            self.lock.release()
+        for process in idle:
+            kill(process)
+            process.wait()
+
+class Job:
+    # listener.onOutput(job, data), listener.onError(job, data) and listener.onFinished(job)
+    # are invoked in the thread that runs the job
+    # timeout (seconds) and max_bytes (of output) - 0 for no limit
+    # max_memory - None for the backend's default
+    def __init__(self, backend, input, priority, timeout, max_bytes, listener, max_memory = None):
+        self.backend, self.input, self.priority, self.timeout, self.max_bytes, self.listener, self.max_memory = \
+            backend, input, priority, timeout, max_bytes, listener, max_memory
+        self.status, self.size, self.elapsed = QUEUED, 0, 0.0
+        self.process, self.cancel_requested = None, False
+        self.tag = None # for the submitter
+
+class Scheduler:
+    # runs the submitted jobs, at most max_running at a time, each in its own thread;
+    # queued jobs start in order of priority, then in order of submission
+    def __init__(self, max_running):
+        self.max_running = max_running
+        self.lock = threading.Lock()
+        self.queue, self.running = [], set()
+        self.counter = itertools.count()
+
+    def submit(self, job):
+        self.lock.acquire()
+        try:
+            job.status, job.cancel_requested = QUEUED, False
+            heapq.heappush(self.queue, (job.priority, self.counter.next(), job))
+        finally:
+            self.lock.release()
+        self.dispatch()
+        return job
+
+    def cancel(self, job):
+        self.lock.acquire()
+        try:
+            job.cancel_requested = True
+            queued = job.status == QUEUED
+            if queued:
+                job.status = CANCELLED # stays in the queue, skipped by dispatch
+            elif not job.process is None:
+                kill(job.process)
+        finally:
+            self.lock.release()
+        if queued:
+            job.listener.onFinished(job)
+
+    def shutdown(self):
+        # cancels everything, the running processes are killed
+        self.lock.acquire()
+        try:
+            jobs = [job for (priority, counter, job) in self.queue] + list(self.running)
+        finally:
+            self.lock.release()
+        for job in jobs:
+            self.cancel(job)
+
+    def dispatch(self):
+        self.lock.acquire()
+        try:
+            while len(self.queue) and len(self.running) < self.max_running:
+                job = heapq.heappop(self.queue)[2]
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                self.running.add(job)
+                thread = threading.Thread(target=self.execute, args=(job,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.lock.release()
+
+    def execute(self, job):
+        started, filename, status, timer = time.time(), None, FAILED, None
+        try:
+            if not job.backend.stdin:
+                handle, filename = tempfile.mkstemp()
+                os.write(handle, job.input)
+                os.close(handle)
+            try:
+                process = job.backend.start(job, filename)
+            except (OSError, IOError):
+                return
+            self.lock.acquire()
+            job.process = process
+            cancelled = job.cancel_requested
+            self.lock.release()
+            if cancelled:
+                kill(process)
+
+            timed_out = []
+            if job.timeout > 0:
+                def onTimeout():
+                    timed_out.append(True)
+                    kill(process)
+                timer = threading.Timer(job.timeout, onTimeout)
+                timer.daemon = True # does not keep the interpreter from exiting
+                timer.start()
+            errors = threading.Thread(target=self.readErrors, args=(job, process))
+            errors.daemon = True
+            errors.start()
+
+            status = OK
+            while True:
+                data = os.read(process.stdout.fileno(), 4096)
+                if data == '':
+                    break
+                job.size = job.size + len(data)
+                job.listener.onOutput(job, data)
+                if job.max_bytes > 0 and job.size > job.max_bytes:
+                    status = OVERFLOW
+                    kill(process)
+                    break
+            process.stdout.close()
+            process.wait()
+            errors.join()
+
+            if len(timed_out):
+                status = TIMEOUT
+            elif job.cancel_requested:
+                status = CANCELLED
+            elif status == OK and job.size == 0: # crashed or could not read the input
+                status = FAILED
+        finally:
+            if not timer is None:
+                timer.cancel()
+                timer.join()
+            job.elapsed = time.time() - started
+            if not filename is None:
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+            self.lock.acquire()
+            self.running.discard(job)
+            job.process, job.status = None, status
+            self.lock.release()
+            job.listener.onFinished(job)
+            self.dispatch()
+
+    def readErrors(self, job, process):
+        while True:
+            data = os.read(process.stderr.fileno(), 4096)
+            if data == '':
+                break
+            job.listener.onError(job, data)
+        process.stderr.close()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+# standard
+import os
+import marshal
+import shutil
+import ctypes
+import hashlib
+import tempfile
+
+# 3rd party
+import yaml
+
+# local
+import model
+import olvdb
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache'
+COPY_BLOCK_SIZE = 1 << 20
+SIGNATURE_BLOCK_SIZE = 1 << 12
+
+def isDocumentStart(line):
+    return line.startswith('---') and (len(line) == 3 or line[3] in " \t\r\n")
+
+def scanDocuments(f):
+    # byte ranges of the YAML documents in a multi-document stream
+    # the text before the first '---' (if any) is a document too
+    spans, start, offset, has_content = [], 0, 0, False
+    for line in f:
+        if isDocumentStart(line):
+            if has_content:
+                spans.append((start, offset))
+            start, has_content = offset, True
+        elif not has_content and line.strip() != '' and not line.startswith('#'):
+            has_content = True
+        offset = offset + len(line)
+    if has_content:
+        spans.append((start, offset))
+    return spans
+
+def fileSignature(filename):
+    # size, mtime and inode do not tell an edit of the same size within the mtime
+    # granularity of the file system, the hash of the first and last block mostly does
+    st = os.stat(filename)
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        h.update(f.read(SIGNATURE_BLOCK_SIZE))
+        if st.st_size > SIGNATURE_BLOCK_SIZE:
+            f.seek(max(SIGNATURE_BLOCK_SIZE, st.st_size - SIGNATURE_BLOCK_SIZE))
+            h.update(f.read(SIGNATURE_BLOCK_SIZE))
+    finally:
+        f.close()
+    return [st.st_size, st.st_mtime, st.st_ino, h.hexdigest()]
+
+def contentHash(filename):
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        while True:
+            chunk = f.read(COPY_BLOCK_SIZE)
+            if chunk == '':
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+class CollectionIndex:
+    def __init__(self, filename):
+        self.filename = filename
+        self.signature = None
+        self.spans, self.summaries = [], []
+
+    def indexFile(filename):
+        return filename + INDEX_SUFFIX
+    indexFile = staticmethod(indexFile)
+
+    def build(self):
+        f = open(self.filename, 'rb')
+        try:
+            self.spans = scanDocuments(f)
+        finally:
+            f.close()
+        self.summaries = [None] * len(self.spans)
+        self.signature = fileSignature(self.filename)
+
+    def load(self):
+        try:
+            f = open(CollectionIndex.indexFile(self.filename), 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            return False
+        if data.get('signature') != fileSignature(self.filename):
+            return False
+        self.signature, self.spans, self.summaries = \
+            data['signature'], data['spans'], data['summaries']
+        return True
+
+    def save(self):
+        data = {'version':INDEX_VERSION, 'signature':self.signature,
+            'spans':self.spans, 'summaries':self.summaries}
+        try:
+            f = open(CollectionIndex.indexFile(self.filename), 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+        except IOError:
+            pass # the index is merely an accelerator
+
+class EntryCache:
+    # the parsed (model.makeSafe) entries of a collection file as marshal strings, kept
+    # next to the file, so that reopening it does not parse the YAML again;
+    # keyed by the offset of the entry in the file, which does not change with inserts and deletes
+    # signature - of the file content the offsets refer to
+    def __init__(self, filename, signature):
+        self.filename, self.signature = filename, signature
+        self.sha1 = None
+        self.entries, self.pieces = {}, {}
+        self.dirty = False
+
+    def cacheFile(filename):
+        return filename + CACHE_SUFFIX
+    cacheFile = staticmethod(cacheFile)
+
+    def load(self):
+        try:
+            f = open(EntryCache.cacheFile(self.filename), 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return False
+        try:
+            if data.get('signature') != self.signature or data.get('sha1') != contentHash(self.filename):
+                return False
+        except (IOError, OSError):
+            return False
+        self.sha1, self.entries, self.pieces = data['sha1'], data['entries'], data['pieces']
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            if fileSignature(self.filename) != self.signature:
+                return # the file has changed since, the offsets are no longer valid
+            if self.sha1 is None:
+                self.sha1 = contentHash(self.filename)
+            data = {'version':CACHE_VERSION, 'signature':self.signature, 'sha1':self.sha1,
+                'entries':self.entries, 'pieces':self.pieces}
+            fname = EntryCache.cacheFile(self.filename)
+            handle, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(fname)))
+            f = os.fdopen(handle, 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+            replaceFile(tmpname, fname)
+        except (IOError, OSError, ValueError):
+            return # the cache is merely an accelerator
+        self.dirty = False
+
+    def get(self, offset):
+        if not self.entries.has_key(offset):
+            return None
+        return marshal.loads(self.entries[offset])
+
+    def put(self, offset, entry):
+        try:
+            self.entries[offset] = marshal.dumps(entry)
+        except ValueError: # e.g. a YAML timestamp somewhere in twins
+            return
+        self.pieces[offset] = model.countPieces(entry.get('algebraic', {}))
+        self.dirty = True
+
+    def copy(self, source, offset, new_offset):
+        if source.entries.has_key(offset):
+            self.entries[new_offset], self.pieces[new_offset] = source.entries[offset], source.pieces[offset]
+            self.dirty = True
+
+class LazyEntries:
+    # list-like view of a collection file: entries are parsed on first access only
+    def __init__(self, index, cache):
+        self.index, self.cache = index, cache
+        self.filename = index.filename
+        self.items = [None] * len(index.spans)
+        self.spans = list(index.spans) # None for entries that are not in the file
+        self.summaries = list(index.summaries)
+        self.pristine = True # entries order still matches the file
+        self.handle = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        if self.items[idx] is None:
+            self.items[idx] = self.parse(idx)
+        return self.items[idx]
+
+    def __setitem__(self, idx, entry):
+        self.items[idx] = entry
+
+    def __iter__(self):
+        for i in xrange(len(self.items)):
+            yield self[i]
+
+    def parse(self, idx):
+        # the entry as stored in the file, not kept parsed
+        start = self.spans[idx][0]
+        e = self.cache.get(start)
+        if e is None:
+            e = model.makeSafe(yaml.load(self.read(idx)))
+            self.cache.put(start, e)
+        return e
+
+    def piecesCount(self, idx):
+        # None if not known without parsing the entry
+        if self.spans[idx] is None:
+            return None
+        return self.cache.pieces.get(self.spans[idx][0])
+
+    def insert(self, idx, entry):
+        self.items.insert(idx, entry)
+        self.spans.insert(idx, None)
+        self.summaries.insert(idx, None)
+        self.pristine = False
+
+    def pop(self, idx):
+        entry = self[idx]
+        self.items.pop(idx)
+        self.spans.pop(idx)
+        self.summaries.pop(idx)
+        self.pristine = False
+        return entry
+
+    def isParsed(self, idx):
+        return not self.items[idx] is None
+
+    def read(self, idx):
+        start, end = self.spans[idx]
+        return self.readRange(start, end)
+
+    def readRange(self, start, end):
+        if self.handle is None:
+            self.handle = open(self.filename, 'rb')
+        self.handle.seek(start)
+        return self.handle.read(end - start)
+
+    def summary(self, idx):
+        if self.summaries[idx] is None:
+            try:
+                e = self.parse(idx)
+            except yaml.YAMLError:
+                e = {}
+            self.summaries[idx] = model.summarize(e)
+        return self.summaries[idx]
+
+    def close(self):
+        if not self.handle is None:
+            self.handle.close()
+            self.handle = None
+
+    def saveIndex(self):
+        # the entries parsed so far are cached in any case
+        self.cache.save()
+        if not self.pristine:
+            return
+        self.index.summaries = self.summaries
+        self.index.save()
+
+def openCollection(filename): # throws IOError
+    if olvdb.isDb(filename):
+        return olvdb.openCollection(filename)
+    index = CollectionIndex(filename)
+    if not index.load():
+        index.build()
+        index.save()
+    cache = EntryCache(filename, index.signature)
+    cache.load()
+    return LazyEntries(index, cache)
+
+def dumpEntry(entry):
+    return "---\n" + unicode(yaml.dump(entry, encoding=None, allow_unicode=True)).encode('utf8')
+
+def cleanRun(entries, dirty_flags, i):
+    # the longest run of unmodified entries starting at i that are contiguous in the source file
+    j, end = i, entries.spans[i][1]
+    while j + 1 < len(entries) and not dirty_flags[j + 1] and \
+        not entries.spans[j + 1] is None and entries.spans[j + 1][0] == end:
+        j = j + 1
+        end = entries.spans[j][1]
+    return j
+
+def copyRun(source, f, start, end):
+    # copies raw bytes, returns (bytes written, bytes prepended)
+    written, prepended, last = 0, 0, ''
+    pos = start
+    while pos < end:
+        chunk = source.readRange(pos, min(end, pos + COPY_BLOCK_SIZE))
+        if chunk == '':
+            raise IOError('Unexpected end of file: ' + source.filename)
+        if pos == start and not isDocumentStart(chunk[:4]):
+            # the very first document of the file may come without a separator
+            f.write("---\n")
+            written, prepended = 4, 4
+        f.write(chunk)
+        written, pos, last = written + len(chunk), pos + len(chunk), chunk[-1]
+    if last != "\n":
+        f.write("\n")
+        written = written + 1
+    return written, prepended
+
+def replaceFile(tmpname, filename):
+    # atomic: the target is either the old file or the new one, never missing;
+    # the new file gets the mode of the old one (mkstemp creates it readable by the owner only)
+    if os.path.exists(filename):
+        shutil.copymode(filename, tmpname)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpname, 0666 & ~umask)
+    if os.name == 'nt':
+        # os.rename does not replace an existing file on Windows
+        MOVEFILE_REPLACE_EXISTING, MOVEFILE_WRITE_THROUGH = 0x1, 0x8
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(tmpname), unicode(filename), \
+            MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+        return
+    os.rename(tmpname, filename)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def saveCollection(filename, entries, dirty_flags): # throws IOError, OSError
+    # clean entries are copied byte for byte from the file they were loaded from,
+    # only the dirty and the new ones are serialized. The result is written to a temporary
+    # file that atomically replaces the target, so a failure never leaves it half-written
+    if olvdb.isDb(filename):
+        return olvdb.saveCollection(filename, entries, dirty_flags)
+    if isinstance(entries, olvdb.DbEntries):
+        return olvdb.exportCollection(filename, entries, dirty_flags)
+    source = None
+    if isinstance(entries, LazyEntries) and os.path.exists(entries.filename):
+        source = entries
+    fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    spans, summaries, cached = [], [], [] # cached - (new offset, old offset or the entry)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            offset, i = 0, 0
+            while i < len(entries):
+                if not source is None and not dirty_flags[i] and not source.spans[i] is None:
+                    j = cleanRun(source, dirty_flags, i)
+                    start, end = source.spans[i][0], source.spans[j][1]
+                    written, prepended = copyRun(source, f, start, end)
+                    for k in xrange(i, j + 1):
+                        a, b = source.spans[k]
+                        spans.append((offset + [prepended, 0][k == i] + a - start, offset + prepended + b - start))
+                        summaries.append(source.summaries[k])
+                        cached.append((spans[-1][0], a))
+                    spans[-1] = (spans[-1][0], offset + written)
+                    offset, i = offset + written, j + 1
+                else:
+                    data = dumpEntry(entries[i])
+                    f.write(data)
+                    spans.append((offset, offset + len(data)))
+                    summaries.append(model.summarize(entries[i]))
+                    cached.append((offset, entries[i]))
+                    offset, i = offset + len(data), i + 1
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if not source is None:
+            source.close()
+        replaceFile(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+    index = CollectionIndex(filename)
+    index.spans, index.summaries = spans, summaries
+    index.signature = fileSignature(filename)
+    index.save()
+    cache = EntryCache(filename, index.signature)
+    for new_offset, old in cached:
+        if isinstance(old, dict):
+            cache.put(new_offset, old)
+        else:
+            cache.copy(source.cache, old, new_offset)
+    cache.save()
+    retval = LazyEntries(index, cache)
+    if source is None:
+        retval.items = list(entries)
+    else:
+        retval.items = list(source.items) # whatever was parsed stays parsed
+    return retval